@@ -0,0 +1,238 @@
+"""Code to benchmark the throughput of crunchy operations."""
+
+import gzip
+import logging
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from crunchy.command import CramProcess
+from crunchy.integrity import (
+    DEFAULT_BUFFER_SIZE,
+    LEGACY_CHUNK_SIZE,
+    MEBIBYTE,
+    get_available_inflate_backends,
+    get_checksum,
+    get_hash_obj,
+    is_gzipped,
+    open_gzipped,
+)
+from crunchy.profiles import CRAM_PROFILES
+
+LOG = logging.getLogger(__name__)
+
+
+def get_legacy_checksum(infile: Path, algorithm: str = "sha256") -> str:
+    """Get the checksum for a file by reading it in small chunks, as crunchy used to do."""
+    hash_obj = get_hash_obj(algorithm)
+    opener = gzip.open if is_gzipped(infile) else open
+    with opener(infile, "rb") as content:
+        for chunk in iter(lambda: content.read(LEGACY_CHUNK_SIZE), b""):
+            hash_obj.update(chunk)
+    return hash_obj.hexdigest()
+
+
+def time_call(function: Callable, *args, **kwargs) -> tuple:
+    """Call a function and return the result together with the elapsed wall time in seconds."""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def get_throughput(nr_bytes: int, seconds: float) -> float:
+    """Return the throughput in MiB/s."""
+    if seconds <= 0:
+        return float("inf")
+    return nr_bytes / MEBIBYTE / seconds
+
+
+def benchmark_checksum(
+    infile: Path,
+    algorithm: str = "sha256",
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    rounds: int = 1,
+) -> List[Dict]:
+    """Compare the checksum engine with the legacy 4 KiB loop.
+
+    Throughput is counted in bytes read from disk, i.e. the compressed size for gzipped files.
+    The fastest of all rounds is reported for each method.
+
+    Returns:
+        one dict per method with method, checksum, seconds and mib_per_second
+    """
+    nr_bytes = infile.stat().st_size
+    methods = {
+        f"legacy ({LEGACY_CHUNK_SIZE // 1024} KiB)": lambda: get_legacy_checksum(infile, algorithm),
+        f"buffered ({buffer_size / MEBIBYTE:g} MiB)": lambda: get_checksum(
+            infile, algorithm, buffer_size=buffer_size
+        ),
+    }
+    results = []
+    for method, function in methods.items():
+        LOG.info(f"Benchmarking {method} checksum of {infile}")
+        timings = []
+        for _ in range(rounds):
+            checksum, seconds = time_call(function)
+            timings.append(seconds)
+        seconds = min(timings)
+        results.append(
+            {
+                "method": method,
+                "checksum": checksum,
+                "seconds": seconds,
+                "mib_per_second": get_throughput(nr_bytes, seconds),
+            }
+        )
+    return results
+
+
+def inflate(infile: Path, backend: str, buffer_size: int = DEFAULT_BUFFER_SIZE) -> int:
+    """Unzip a file with a backend and return the number of unzipped bytes."""
+    buffer = bytearray(buffer_size)
+    nr_bytes = 0
+    with open_gzipped(infile, backend=backend) as content:
+        while True:
+            nr_read = content.readinto(buffer)
+            if not nr_read:
+                break
+            nr_bytes += nr_read
+    return nr_bytes
+
+
+def benchmark_inflate(
+    infile: Path,
+    backends: Optional[List[str]] = None,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    rounds: int = 1,
+) -> List[Dict]:
+    """Measure how fast each inflate backend unzips a file.
+
+    Throughput is counted in unzipped bytes. All available backends are used if none are given.
+
+    Returns:
+        one dict per backend with backend, unzipped_bytes, seconds and mib_per_second
+    """
+    results = []
+    for backend in backends or get_available_inflate_backends():
+        LOG.info(f"Benchmarking unzipping of {infile} with {backend}")
+        timings = []
+        for _ in range(rounds):
+            nr_bytes, seconds = time_call(inflate, infile, backend, buffer_size=buffer_size)
+            timings.append(seconds)
+        seconds = min(timings)
+        results.append(
+            {
+                "backend": backend,
+                "unzipped_bytes": nr_bytes,
+                "seconds": seconds,
+                "mib_per_second": get_throughput(nr_bytes, seconds),
+            }
+        )
+    return results
+
+
+def compress_cram_legacy(cram_api: CramProcess, bam_path: Path, cram_path: Path):
+    """Convert BAM to CRAM like crunchy used to, single threaded and indexed in a second pass."""
+    cram_api.run_command(
+        ["view", "-C", "-T", cram_api.refgenome_path, str(bam_path), "-o", str(cram_path)]
+    )
+    cram_api.run_command(["index", str(cram_path), str(cram_path) + ".crai"])
+
+
+def compress_cram(cram_api: CramProcess, bam_path: Path, cram_path: Path):
+    """Convert BAM to CRAM with the current call pattern."""
+    cram_api.compress(bam_path=bam_path, cram_path=cram_path)
+
+
+def benchmark_cram_calls(bam_path: Path, cram_api: CramProcess, rounds: int = 1) -> List[Dict]:
+    """Compare the legacy samtools call pattern with the threaded single pass one.
+
+    Throughput is counted in bytes of BAM. The CRAM files are written to a temporary directory.
+
+    Returns:
+        one dict per call pattern with method, seconds, mib_per_second and cram_bytes
+    """
+    nr_bytes = bam_path.stat().st_size
+    methods = {
+        "legacy (1 thread, index pass)": compress_cram_legacy,
+        f"threaded ({cram_api.threads} threads, write index)": compress_cram,
+    }
+    results = []
+    with tempfile.TemporaryDirectory(prefix="crunchy_") as tmp_dir:
+        cram_path = Path(tmp_dir) / bam_path.with_suffix(".cram").name
+        for method, function in methods.items():
+            LOG.info(f"Benchmarking {method} compression of {bam_path}")
+            timings = []
+            for _ in range(rounds):
+                _, seconds = time_call(function, cram_api, bam_path, cram_path)
+                timings.append(seconds)
+            seconds = min(timings)
+            results.append(
+                {
+                    "method": method,
+                    "seconds": seconds,
+                    "mib_per_second": get_throughput(nr_bytes, seconds),
+                    "cram_bytes": cram_path.stat().st_size if cram_path.exists() else None,
+                }
+            )
+    return results
+
+
+def get_peak_memory(process: CramProcess) -> Optional[int]:
+    """Return the max RSS of the last command a process ran, if it was measured."""
+    result = getattr(process, "last_result", None)
+    if result is None or result.resources is None:
+        return None
+    return result.resources.max_rss_bytes
+
+
+def benchmark_cram(
+    bam_path: Path,
+    cram_api: CramProcess,
+    profiles: Optional[List[str]] = None,
+    rounds: int = 1,
+) -> List[Dict]:
+    """Compress a BAM file with each CRAM profile and decompress it again.
+
+    Throughput is counted in bytes of BAM for both directions, the ratio is the size of the CRAM
+    divided by the size of the BAM. Only the conversion is timed, not the indexing. All profiles
+    are benchmarked if none are given.
+
+    Returns:
+        one dict per profile with profile, ratio, compress and decompress seconds and MiB/s and
+        the peak memory of samtools in each direction
+    """
+    nr_bytes = bam_path.stat().st_size
+    results = []
+    with tempfile.TemporaryDirectory(prefix="crunchy_") as tmp_dir:
+        for name in profiles or list(CRAM_PROFILES):
+            profile = CRAM_PROFILES[name]
+            cram_path = Path(tmp_dir) / f"{bam_path.stem}.{name}.cram"
+            bam_out = Path(tmp_dir) / f"{bam_path.stem}.{name}.bam"
+            LOG.info(f"Benchmarking CRAM profile {name} with {bam_path}")
+            compress_timings, decompress_timings = [], []
+            for _ in range(rounds):
+                _, seconds = time_call(
+                    cram_api.run_command,
+                    cram_api.compress_parameters(bam_path, cram_path, profile=profile),
+                )
+                compress_timings.append(seconds)
+                compress_memory = get_peak_memory(cram_api)
+                _, seconds = time_call(cram_api.decompress, cram_path, bam_out)
+                decompress_timings.append(seconds)
+                decompress_memory = get_peak_memory(cram_api)
+            cram_bytes = cram_path.stat().st_size if cram_path.exists() else None
+            results.append(
+                {
+                    "profile": name,
+                    "ratio": cram_bytes / nr_bytes if cram_bytes is not None else None,
+                    "compress_seconds": min(compress_timings),
+                    "compress_mib_per_second": get_throughput(nr_bytes, min(compress_timings)),
+                    "compress_max_rss_bytes": compress_memory,
+                    "decompress_seconds": min(decompress_timings),
+                    "decompress_mib_per_second": get_throughput(nr_bytes, min(decompress_timings)),
+                    "decompress_max_rss_bytes": decompress_memory,
+                }
+            )
+    return results
@@ -0,0 +1,163 @@
+"""Code to cache checksums of files that have not changed."""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 100000
+XATTR_PREFIX = "user.crunchy.checksum."
+
+
+class FileIdentity(NamedTuple):
+    """What identifies a version of a file, if any of these change the checksum is invalid."""
+
+    device: int
+    inode: int
+    size: int
+    mtime_ns: int
+
+
+def get_file_identity(infile: Path) -> FileIdentity:
+    """Return the identity of a file from a stat call."""
+    file_stat = os.stat(infile)
+    return FileIdentity(
+        device=file_stat.st_dev,
+        inode=file_stat.st_ino,
+        size=file_stat.st_size,
+        mtime_ns=file_stat.st_mtime_ns,
+    )
+
+
+class ChecksumCache(ABC):
+    """Base class for caches of checksums.
+
+    Entries are keyed on the identity of a file together with the algorithm, a file that is
+    modified, replaced or moved to another device gets a new key.
+    """
+
+    @abstractmethod
+    def get(self, identity: FileIdentity, algorithm: str, infile: Path) -> Optional[str]:
+        """Return a cached checksum or None if the file is not in the cache."""
+
+    @abstractmethod
+    def set(self, identity: FileIdentity, algorithm: str, infile: Path, checksum: str):
+        """Store a checksum in the cache."""
+
+
+class SqliteChecksumCache(ChecksumCache):
+    """Cache checksums in a local SQLite database.
+
+    When there are more than max_entries entries the least recently used ones are evicted. A new
+    connection is used for each operation so that the cache can be shared between threads and
+    processes.
+    """
+
+    def __init__(self, path: Path, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = Path(path)
+        self.max_entries: int = max_entries
+        LOG.info(f"Use checksum cache {self.path}")
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS checksums ("
+                "device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, "
+                "algorithm TEXT, checksum TEXT, last_used REAL, "
+                "PRIMARY KEY (device, inode, size, mtime_ns, algorithm))"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS checksums_last_used ON checksums (last_used)"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection that commits on success and is always closed."""
+        connection = sqlite3.connect(self.path, timeout=60)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, identity: FileIdentity, algorithm: str, infile: Path) -> Optional[str]:
+        """Return a cached checksum and mark the entry as used."""
+        key = (*identity, algorithm)
+        where = "device=? AND inode=? AND size=? AND mtime_ns=? AND algorithm=?"
+        with self._connect() as connection:
+            row = connection.execute(
+                f"SELECT checksum FROM checksums WHERE {where}", key
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                f"UPDATE checksums SET last_used=? WHERE {where}", (time.time(), *key)
+            )
+        LOG.info(f"Found {algorithm} checksum for {infile} in cache")
+        return row[0]
+
+    def set(self, identity: FileIdentity, algorithm: str, infile: Path, checksum: str):
+        """Store a checksum, replace entries for older versions of the file and evict."""
+        with self._connect() as connection:
+            connection.execute(
+                "DELETE FROM checksums WHERE device=? AND inode=? AND algorithm=?",
+                (identity.device, identity.inode, algorithm),
+            )
+            connection.execute(
+                "INSERT INTO checksums VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*identity, algorithm, checksum, time.time()),
+            )
+            self._evict(connection)
+
+    def _evict(self, connection: sqlite3.Connection):
+        """Delete the least recently used entries if there are more than max_entries."""
+        nr_entries = connection.execute("SELECT COUNT(*) FROM checksums").fetchone()[0]
+        nr_evict = nr_entries - self.max_entries
+        if nr_evict <= 0:
+            return
+        LOG.info(f"Evicting {nr_evict} entries from checksum cache")
+        connection.execute(
+            "DELETE FROM checksums WHERE rowid IN "
+            "(SELECT rowid FROM checksums ORDER BY last_used ASC LIMIT ?)",
+            (nr_evict,),
+        )
+
+    def __repr__(self):
+        return f"SqliteChecksumCache:path:{self.path}, max_entries:{self.max_entries}"
+
+
+class XattrChecksumCache(ChecksumCache):
+    """Cache checksums in user extended attributes on the files themselves.
+
+    The entries follow the files and are removed with them, so there is nothing to evict. Setting
+    an extended attribute does not change the mtime of a file.
+    """
+
+    def get(self, identity: FileIdentity, algorithm: str, infile: Path) -> Optional[str]:
+        """Return the checksum stored on the file if it was stored for this version of it."""
+        try:
+            entry = json.loads(os.getxattr(infile, XATTR_PREFIX + algorithm))
+        except (OSError, ValueError):
+            return None
+        if FileIdentity(**entry["identity"]) != identity:
+            LOG.info(f"Cached {algorithm} checksum for {infile} is outdated")
+            return None
+        LOG.info(f"Found {algorithm} checksum for {infile} in extended attributes")
+        return entry["checksum"]
+
+    def set(self, identity: FileIdentity, algorithm: str, infile: Path, checksum: str):
+        """Store the checksum on the file, a file system without xattr support is not an error."""
+        entry = {"identity": identity._asdict(), "checksum": checksum}
+        try:
+            os.setxattr(infile, XATTR_PREFIX + algorithm, json.dumps(entry).encode())
+        except OSError as error:
+            LOG.warning(f"Could not store checksum for {infile} in extended attributes: {error}")
+
+    def __repr__(self):
+        return "XattrChecksumCache"
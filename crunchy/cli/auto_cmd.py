@@ -1,20 +1,55 @@
 """Code for CLI auto command"""
 
+import copy
+import functools
 import logging
 import pathlib
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 import click
 
+from crunchy.cli.utils import checksum_options, checksum_workers, file_exists
+from crunchy.compress import compress_spring, get_partial_path
+from crunchy.integrity import get_checksums_concurrently
+from crunchy.journal import (
+    FAILED,
+    FINISHED,
+    JOURNAL_NAME,
+    SHARD_JOURNAL_NAME,
+    STARTED,
+    Journal,
+)
+from crunchy.pipeline import DEFAULT_QUEUE_DEPTH, Pipeline, Stage, log_reports
+from crunchy.scheduler import (
+    DEFAULT_JOB_ORDER,
+    DEFAULT_MAX_JOBS,
+    JOB_ORDERS,
+    Shard,
+    get_job_cost,
+    get_shard,
+    get_threads_per_job,
+    log_summary,
+    order_jobs,
+    parse_shard,
+    read_priority_file,
+    run_jobs,
+)
 from crunchy.utils import find_fastq_pairs
 
+from .compress_cmd import check_decompressed_files
 from .compress_cmd import fastq as compress_fastq_cmd
 
+PIPELINE_STAGES = ["hash", "compress", "verify", "delete"]
+AUTO_ALGORITHM = "sha256"
+
 LOG = logging.getLogger(__name__)
 
 
 def abort_if_false(ctx, param, value):
-    """Check if abort"""
-    if not value:
+    """Check if abort, the user is asked unless --yes is given or the pairs are only listed"""
+    if value or ctx.params.get("list_shard"):
+        return
+    if not click.confirm("Are you sure you want to compress and delete all fastqs"):
         ctx.abort()
 
 
@@ -40,17 +75,114 @@ def auto():
     type=click.Path(exists=True),
     help="Second in fastq pair to compare",
 )
+@click.option(
+    "--max-jobs",
+    default=DEFAULT_MAX_JOBS,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of pairs to compress at the same time",
+)
+@click.option(
+    "--threads-per-job",
+    type=click.IntRange(min=1),
+    help="Threads for each Spring job, default is to split --threads between the jobs",
+)
+@click.option(
+    "--pipeline",
+    is_flag=True,
+    help="Hash, compress, verify and delete in stages that work on different pairs at once",
+)
+@click.option(
+    "--queue-depth",
+    default=DEFAULT_QUEUE_DEPTH,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of pairs that can wait in front of each pipeline stage",
+)
+@click.option(
+    "--stage-workers",
+    multiple=True,
+    callback=lambda ctx, param, value: parse_stage_workers(value),
+    help="Workers for a pipeline stage, like verify=2, compress uses --max-jobs by default",
+)
+@click.option(
+    "--order",
+    default=DEFAULT_JOB_ORDER,
+    show_default=True,
+    type=click.Choice(JOB_ORDERS),
+    help="Order to compress pairs in, by the size or age of the fastqs, or in the order found",
+)
+@click.option(
+    "--priority-file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="File with spring or fastq paths, one per line, to compress first",
+)
+@click.option(
+    "--shard",
+    callback=lambda ctx, param, value: get_shard_option(value),
+    help="Only compress shard K of N, like 2/4, to split the pairs between N independent runs",
+)
+@click.option(
+    "--list-shard",
+    is_flag=True,
+    is_eager=True,
+    help="Print the shard of each pair, for the N of --shard, and exit",
+)
+@click.option(
+    "--journal",
+    "journal_path",
+    type=click.Path(dir_okay=False),
+    help=f"Journal of how far each pair has come, default is {JOURNAL_NAME} in the output dir, "
+    "or one per shard like crunchy_journal.2of4.jsonl",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue an interrupted run from its journal, finished steps are not done again",
+)
 @click.option(
     "--yes",
     is_flag=True,
     callback=abort_if_false,
     expose_value=False,
-    prompt="Are you sure you want to compress and delete all fastqs",
+    help="Compress and delete all fastqs without asking",
 )
 @click.pass_context
-def fastq(ctx, indir, spring_path, first, second, dry_run):
+def fastq(
+    ctx,
+    indir,
+    spring_path,
+    first,
+    second,
+    dry_run,
+    max_jobs,
+    threads_per_job,
+    pipeline,
+    queue_depth,
+    stage_workers,
+    journal_path,
+    resume,
+    order,
+    priority_file,
+    shard,
+    list_shard,
+):
     """Run whole pipeline by compressing, comparing and deleting original fastqs.
     Either all fastq pairs below a directory or a given pair.
+
+    Several pairs are compressed at the same time with --max-jobs, a pair that fails is skipped.
+    With --pipeline the steps for different pairs overlap, a pair is verified while the next one
+    is compressed. The largest pairs are started first so that a large pair found last does not
+    run alone at the end, see --order.
+
+    With --shard K/N the pairs are split between N runs, for example on different nodes, by a
+    hash of the Spring path relative to --indir. Each run only compresses the pairs of its shard
+    and keeps a journal of its own.
+
+    How far each pair has come is written to a journal. With --resume pairs that were finished
+    are skipped, files that an interrupted run left behind are removed and the other pairs
+    continue from the last step they finished. A pair whose Spring archive is gone, because it
+    failed verification or was removed, is compressed again.
     """
     if dry_run:
         LOG.info("Dry Run! No files will be created or deleted")
@@ -79,31 +211,254 @@ def fastq(ctx, indir, spring_path, first, second, dry_run):
 
         pairs = [(pathlib.Path(first), pathlib.Path(second), pathlib.Path(spring_path))]
 
+    if list_shard:
+        if not shard:
+            raise click.UsageError("--list-shard needs --shard to know the number of shards")
+        list_shards(pairs, shard.count, indir)
+        return
+    if shard:
+        pairs = [pair for pair in pairs if get_pair_shard(pair[2], shard.count, indir) == shard]
+        LOG.info(f"{len(pairs)} pairs are in shard {shard}")
+
+    journal = Journal(
+        journal_path
+        or pathlib.Path(
+            indir or pathlib.Path(spring_path).parent,
+            SHARD_JOURNAL_NAME.format(**shard._asdict()) if shard else JOURNAL_NAME,
+        )
+    )
+    states = journal.read() if resume else {}
+    if not (resume or dry_run):
+        journal.reset()
+    jobs = []
     for pair in pairs:
-        first_fastq = pair[0]
-        second_fastq = pair[1]
-        spring_path = pair[2]
-        try:
-            ctx.invoke(
-                compress_fastq_cmd,
-                first_read=str(first_fastq),
-                second_read=str(second_fastq),
-                spring_path=str(spring_path),
-                dry_run=dry_run,
-                check_integrity=True,
+        state = states.get(str(pair[2]))
+        if state and PIPELINE_STAGES[-1] in state.finished:
+            LOG.info(f"{pair[2]} was finished in an earlier run")
+            continue
+        job = FastqPairJob(*pair)
+        if state:
+            done = state.finished
+            if "compress" in done and not job.spring_path.exists():
+                LOG.warning(f"{job.spring_path} is missing, compress the pair again")
+                done = tuple(stage for stage in done if stage not in ("compress", "verify"))
+            job = job._replace(
+                checksums=(state.outputs or {}).get("checksums"),
+                started=state.started,
+                done=done,
+            )
+            clean_partial_files(job, dry_run)
+        jobs.append(job)
+    jobs = order_jobs(
+        jobs,
+        lambda job: [job.first, job.second, job.spring_path],
+        order=order,
+        priorities=read_priority_file(pathlib.Path(priority_file)) if priority_file else None,
+    )
+
+    spring_api = copy.copy(ctx.obj["spring_api"])
+    spring_api.threads = get_threads_per_job(spring_api.threads, max_jobs, threads_per_job)
+    LOG.info(f"Compress {max_jobs} pairs at a time with {spring_api.threads} threads each")
+    obj = {**ctx.obj, "spring_api": spring_api}
+    pair_stages = PairStages(obj, dry_run, journal=None if dry_run else journal)
+    if pipeline:
+        stages = pair_stages.stages({"compress": max_jobs, **stage_workers})
+        auto_pipeline = Pipeline(stages, queue_depth=queue_depth)
+        results = auto_pipeline.run((str(job.spring_path), job) for job in jobs)
+        log_reports(auto_pipeline.reports())
+    else:
+        results = run_jobs(
+            pair_stages.run_all,
+            [(str(job.spring_path), (job,)) for job in jobs],
+            max_jobs=max_jobs,
+        )
+    log_summary(results)
+
+    LOG.info("crunchy auto fastq completed")
+
+
+def get_shard_option(value: Optional[str]) -> Optional[Shard]:
+    """Parse the --shard option."""
+    if value is None:
+        return None
+    try:
+        return parse_shard(value)
+    except ValueError as error:
+        raise click.BadParameter(str(error)) from error
+
+
+def get_pair_shard(spring_path: pathlib.Path, count: int, indir: Optional[pathlib.Path]) -> Shard:
+    """Return the shard of a pair, by its Spring path relative to indir.
+
+    A relative path gives the same shards on nodes that mount the directory in different places.
+    """
+    key = (
+        spring_path.relative_to(indir)
+        if indir and spring_path.is_relative_to(indir)
+        else spring_path
+    )
+    return get_shard(str(key), count)
+
+
+def list_shards(pairs: List[tuple], count: int, indir: Optional[pathlib.Path]):
+    """Print the shard, the size of the fastqs and the Spring path of each pair."""
+    for first_fastq, second_fastq, spring_path in pairs:
+        pair_shard = get_pair_shard(spring_path, count, indir)
+        size = get_job_cost([first_fastq, second_fastq]).size
+        click.echo(f"{pair_shard}\t{size}\t{spring_path}")
+
+
+def parse_stage_workers(values: Tuple[str, ...]) -> Dict[str, int]:
+    """Parse workers per pipeline stage given as STAGE=N."""
+    stage_workers = {}
+    for value in values:
+        stage, _, workers = value.partition("=")
+        if stage not in PIPELINE_STAGES or not workers.isdigit() or int(workers) < 1:
+            raise click.BadParameter(
+                f"{value}, use STAGE=N with N > 0 and STAGE one of {', '.join(PIPELINE_STAGES)}"
             )
-        except click.Abort:
-            LOG.warning("Skip current and continue auto")
+        stage_workers[stage] = int(workers)
+    return stage_workers
+
+
+class FastqPairJob(NamedTuple):
+    """A pair of fastqs on its way through the auto pipeline."""
+
+    first: pathlib.Path
+    second: pathlib.Path
+    spring_path: pathlib.Path
+    checksums: Optional[List[str]] = None
+    started: Tuple[str, ...] = ()
+    done: Tuple[str, ...] = ()
+
+
+def clean_partial_files(job: FastqPairJob, dry_run: bool = False):
+    """Remove the files that an interrupted run left behind for a pair.
+
+    A Spring file is only removed if the journal shows that this run started to write it.
+    """
+    partial_files = [
+        job.first.with_suffix(".spring.fastq"),
+        job.second.with_suffix(".spring.fastq"),
+    ]
+    if "compress" not in job.done:
+        partial_files.append(get_partial_path(job.spring_path.absolute()))
+        if "compress" in job.started:
+            partial_files.append(job.spring_path)
+    for partial_file in partial_files:
+        if not partial_file.exists():
             continue
+        LOG.info(f"Removing {partial_file} from an interrupted run")
+        if not dry_run:
+            partial_file.unlink()
+
+
+class PairStages:
+    """The stages of the auto pipeline, each takes a FastqPairJob and raises click.Abort on failure.
+
+    Each job gets a copy of the Spring API since it keeps the output of the last command. Stages
+    that a job has done already are skipped, and each finished stage is written to the journal.
+    """
+
+    def __init__(self, obj: dict, dry_run: bool, journal: Optional[Journal] = None):
+        self.obj: dict = obj
+        self.dry_run: bool = dry_run
+        self.journal: Optional[Journal] = journal
+
+    def record(self, job: FastqPairJob, stage: str, status: str = FINISHED, **outputs):
+        """Write to the journal that a job has started or finished a stage."""
+        if self.journal:
+            self.journal.record(str(job.spring_path), stage, status, **outputs)
+
+    def context(self) -> click.Context:
+        """Return a context with a Spring API of its own."""
+        obj = {**self.obj, "spring_api": copy.copy(self.obj["spring_api"])}
+        return click.Context(compress_fastq_cmd, obj=obj)
 
+    def hash_originals(self, job: FastqPairJob) -> FastqPairJob:
+        """Check that the pair is not compressed already and create checksums of the fastqs."""
+        file_exists(job.spring_path, exists=False)
+        with self.context() as ctx:
+            checksums = get_checksums_concurrently(
+                [job.first, job.second],
+                [AUTO_ALGORITHM],
+                workers=checksum_workers(ctx),
+                **checksum_options(ctx),
+            )
+        job = job._replace(checksums=[checksum[AUTO_ALGORITHM] for checksum in checksums])
+        self.record(job, "hash", checksums=job.checksums)
+        return job
+
+    def compress(self, job: FastqPairJob) -> FastqPairJob:
+        """Compress the pair with Spring."""
+        self.record(job, "compress", STARTED)
+        with self.context() as ctx:
+            if not compress_spring(
+                first_read=job.first,
+                second_read=job.second,
+                spring_api=ctx.obj["spring_api"],
+                outfile=job.spring_path,
+                dry_run=self.dry_run,
+            ):
+                raise click.Abort
+        self.record(job, "compress")
+        return job
+
+    def verify(self, job: FastqPairJob) -> FastqPairJob:
+        """Decompress the Spring archive and compare with the checksums, delete it if they differ."""
+        with self.context() as ctx:
+            success = check_decompressed_files(
+                ctx,
+                spring_path=job.spring_path,
+                reads=[job.first, job.second],
+                checksums=job.checksums,
+                algorithm=AUTO_ALGORITHM,
+                dry_run=self.dry_run,
+            )
+        if not success:
+            LOG.error(f"Uncompressed Spring differ from original FASTQs, delete {job.spring_path}")
+            job.spring_path.unlink()
+            for stage in ("compress", "verify"):
+                self.record(job, stage, FAILED)
+            raise click.Abort
+        self.record(job, "verify")
+        return job
+
+    def delete(self, job: FastqPairJob) -> FastqPairJob:
+        """Delete the original fastqs."""
         LOG.info("Deleting original fastqs")
-        if not dry_run:
-            first_fastq.unlink()
-            LOG.info("%s deleted", first_fastq)
-            second_fastq.unlink()
-            LOG.info("%s deleted", second_fastq)
+        if not self.dry_run:
+            for fastq_path in [job.first, job.second]:
+                # A resumed job may have deleted one of the fastqs already
+                fastq_path.unlink(missing_ok=True)
+                LOG.info("%s deleted", fastq_path)
+        self.record(job, "delete")
+        return job
 
-    LOG.info("crunchy auto fastq completed")
+    def run_stage(self, name: str, job: FastqPairJob) -> FastqPairJob:
+        """Run a stage for a job, unless the job finished it in an earlier run."""
+        if name in job.done:
+            LOG.info(f"{job.spring_path}: {name} was done in an earlier run")
+            return job
+        functions = {
+            "hash": self.hash_originals,
+            "compress": self.compress,
+            "verify": self.verify,
+            "delete": self.delete,
+        }
+        return functions[name](job)
+
+    def run_all(self, job: FastqPairJob):
+        """Run all stages for a job, one after the other."""
+        for name in PIPELINE_STAGES:
+            job = self.run_stage(name, job)
+
+    def stages(self, stage_workers: Dict[str, int]) -> List[Stage]:
+        """Return the pipeline stages, with one worker unless stage_workers has other numbers."""
+        return [
+            Stage(name, functools.partial(self.run_stage, name), workers=stage_workers.get(name, 1))
+            for name in PIPELINE_STAGES
+        ]
 
 
 auto.add_command(fastq)
@@ -5,14 +5,25 @@ import logging
 import click
 import coloredlogs
 
+from crunchy.cache import DEFAULT_MAX_ENTRIES, SqliteChecksumCache, XattrChecksumCache
 from crunchy.command import CramProcess, SpringProcess
+from crunchy.integrity import (
+    DEFAULT_BUFFER_SIZE,
+    DEFAULT_INFLATE_WORKERS,
+    DEFAULT_WORKERS,
+    INFLATE_BACKENDS,
+    MEBIBYTE,
+)
+from crunchy.reference import ReferenceCache
 from crunchy.version import __version__
 
 from .auto_cmd import auto
+from .benchmark_cmd import benchmark
 from .checksum_cmd import checksum
 from .compare_cmd import compare
 from .compress_cmd import compress
 from .decompress_cmd import decompress
+from .verify_cmd import verify
 
 LOG = logging.getLogger(__name__)
 LOG_LEVELS = ["DEBUG", "INFO", "WARNING"]
@@ -39,6 +50,12 @@ LOG_LEVELS = ["DEBUG", "INFO", "WARNING"]
     "-r",
     help="Path to reference genome",
 )
+@click.option(
+    "--ref-cache",
+    type=click.Path(file_okay=False),
+    envvar="CRUNCHY_REF_CACHE",
+    help="Directory with a samtools MD5 cache of the reference sequences, filled if needed",
+)
 @click.option(
     "--log-level",
     default="INFO",
@@ -49,8 +66,73 @@ LOG_LEVELS = ["DEBUG", "INFO", "WARNING"]
     "--tmp-dir",
     help="If specific temp dir should be used",
 )
+@click.option(
+    "--buffer-size",
+    default=DEFAULT_BUFFER_SIZE // MEBIBYTE,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Size in MiB of the buffer used when reading files for checksums",
+)
+@click.option(
+    "--checksum-workers",
+    default=DEFAULT_WORKERS,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of files to generate checksums for at the same time",
+)
+@click.option(
+    "--inflate-workers",
+    default=DEFAULT_INFLATE_WORKERS,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of threads used to unzip BGZF files when generating checksums",
+)
+@click.option(
+    "--inflate-backend",
+    default="auto",
+    show_default=True,
+    type=click.Choice(INFLATE_BACKENDS),
+    help="How to unzip gzipped files when generating checksums, auto uses isal if installed",
+)
+@click.option(
+    "--checksum-cache",
+    type=click.Path(dir_okay=False),
+    envvar="CRUNCHY_CHECKSUM_CACHE",
+    help="SQLite file to cache checksums of unchanged files in",
+)
+@click.option(
+    "--xattr-cache",
+    is_flag=True,
+    envvar="CRUNCHY_XATTR_CACHE",
+    help="Cache checksums in user extended attributes of the files instead",
+)
+@click.option(
+    "--cache-max-entries",
+    default=DEFAULT_MAX_ENTRIES,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Evict the least recently used checksums when the SQLite cache grows larger",
+)
+@click.option("--no-cache", is_flag=True, help="Do not use any checksum cache")
 @click.pass_context
-def base_command(ctx, spring_binary, samtools_binary, threads, reference, log_level, tmp_dir):
+def base_command(
+    ctx,
+    spring_binary,
+    samtools_binary,
+    threads,
+    reference,
+    ref_cache,
+    log_level,
+    tmp_dir,
+    buffer_size,
+    checksum_workers,
+    inflate_workers,
+    inflate_backend,
+    checksum_cache,
+    xattr_cache,
+    cache_max_entries,
+    no_cache,
+):
     """Base command for crunchy
 
     \b
@@ -75,8 +157,22 @@ def base_command(ctx, spring_binary, samtools_binary, threads, reference, log_le
     spring_api = SpringProcess(spring_binary, threads, tmp_dir)
     ctx.obj = {}
     ctx.obj["spring_api"] = spring_api
-    cram_api = CramProcess(samtools_binary, reference, threads)
+    reference_cache = ReferenceCache(reference, ref_cache) if reference and ref_cache else None
+    cram_api = CramProcess(samtools_binary, reference, threads, reference_cache=reference_cache)
     ctx.obj["cram_api"] = cram_api
+    ctx.obj["buffer_size"] = buffer_size * MEBIBYTE
+    ctx.obj["checksum_workers"] = checksum_workers
+    ctx.obj["inflate_workers"] = inflate_workers
+    ctx.obj["inflate_backend"] = inflate_backend
+    ctx.obj["checksum_cache"] = None
+    if no_cache:
+        LOG.info("Checksum cache is disabled")
+    elif xattr_cache:
+        ctx.obj["checksum_cache"] = XattrChecksumCache()
+    elif checksum_cache:
+        ctx.obj["checksum_cache"] = SqliteChecksumCache(
+            checksum_cache, max_entries=cache_max_entries
+        )
     LOG.info("Running crunchy")
 
 
@@ -85,3 +181,5 @@ base_command.add_command(decompress)
 base_command.add_command(compress)
 base_command.add_command(auto)
 base_command.add_command(checksum)
+base_command.add_command(benchmark)
+base_command.add_command(verify)
@@ -0,0 +1,132 @@
+"""Code for benchmark CLI functions"""
+
+import logging
+import pathlib
+
+import click
+
+from crunchy.benchmark import (
+    benchmark_checksum,
+    benchmark_cram,
+    benchmark_cram_calls,
+    benchmark_inflate,
+)
+from crunchy.cli.utils import checksum_options
+from crunchy.integrity import ALGORITHMS, INFLATE_BACKENDS, MEBIBYTE
+from crunchy.profiles import CRAM_PROFILES
+
+LOG = logging.getLogger(__name__)
+
+
+@click.group()
+def benchmark():
+    """Benchmark the throughput of crunchy operations."""
+    LOG.info("Running benchmark")
+
+
+@click.command()
+@click.argument("infile", type=click.Path(exists=True))
+@click.option("--algorithm", "-a", type=click.Choice(ALGORITHMS), default="sha256")
+@click.option("--rounds", default=1, show_default=True, help="Number of times to run each method")
+@click.pass_context
+def checksum(ctx, infile, algorithm, rounds):
+    """Compare the checksum throughput with the legacy 4 KiB loop."""
+    results = benchmark_checksum(
+        pathlib.Path(infile),
+        algorithm=algorithm,
+        rounds=rounds,
+        buffer_size=checksum_options(ctx)["buffer_size"],
+    )
+    for result in results:
+        click.echo(
+            f"{result['method']}\t{result['seconds']:.3f} s\t"
+            f"{result['mib_per_second']:.1f} MiB/s\t{result['checksum']}"
+        )
+
+
+@click.command()
+@click.argument("infile", type=click.Path(exists=True))
+@click.option(
+    "--backend",
+    "-b",
+    type=click.Choice(INFLATE_BACKENDS[1:]),
+    multiple=True,
+    help="Backend to benchmark, defaults to all available backends",
+)
+@click.option("--rounds", default=1, show_default=True, help="Number of times to run each backend")
+@click.pass_context
+def inflate(ctx, infile, backend, rounds):
+    """Report how fast each inflate backend unzips a gzipped file."""
+    results = benchmark_inflate(
+        pathlib.Path(infile),
+        backends=list(backend) or None,
+        rounds=rounds,
+        buffer_size=checksum_options(ctx)["buffer_size"],
+    )
+    for result in results:
+        click.echo(
+            f"{result['backend']}\t{result['seconds']:.3f} s\t{result['mib_per_second']:.1f} MiB/s"
+        )
+
+
+@click.command("cram-calls")
+@click.argument("bam-path", type=click.Path(exists=True))
+@click.option("--rounds", default=1, show_default=True, help="Number of times to run each method")
+@click.pass_context
+def cram_calls(ctx, bam_path, rounds):
+    """Compare the legacy and the threaded single pass samtools calls for BAM to CRAM."""
+    cram_api = ctx.obj.get("cram_api")
+    try:
+        cram_api.self_check()
+    except (SyntaxError, FileNotFoundError) as error:
+        raise click.Abort from error
+    results = benchmark_cram_calls(pathlib.Path(bam_path), cram_api, rounds=rounds)
+    for result in results:
+        click.echo(
+            f"{result['method']}\t{result['seconds']:.3f} s\t"
+            f"{result['mib_per_second']:.1f} MiB/s\t{result['cram_bytes']} bytes"
+        )
+
+
+def format_memory(nr_bytes) -> str:
+    """Return a memory size in MiB, or unknown."""
+    return "unknown" if nr_bytes is None else f"{nr_bytes / MEBIBYTE:.0f} MiB"
+
+
+@click.command()
+@click.argument("bam-path", type=click.Path(exists=True))
+@click.option(
+    "--profile",
+    "-p",
+    type=click.Choice(list(CRAM_PROFILES)),
+    multiple=True,
+    help="CRAM profile to benchmark, defaults to all profiles",
+)
+@click.option("--rounds", default=1, show_default=True, help="Number of times to run each profile")
+@click.pass_context
+def cram(ctx, bam_path, profile, rounds):
+    """Report size ratio, speed and memory of each CRAM profile for a BAM file."""
+    cram_api = ctx.obj.get("cram_api")
+    try:
+        cram_api.self_check()
+    except (SyntaxError, FileNotFoundError) as error:
+        raise click.Abort from error
+    results = benchmark_cram(
+        pathlib.Path(bam_path), cram_api, profiles=list(profile) or None, rounds=rounds
+    )
+    click.echo("profile\tratio\tcompress\tdecompress\tcompress memory\tdecompress memory")
+    for result in results:
+        ratio = "unknown" if result["ratio"] is None else f"{result['ratio']:.3f}"
+        click.echo(
+            f"{result['profile']}\t{ratio}\t"
+            f"{result['compress_mib_per_second']:.1f} MiB/s\t"
+            f"{result['decompress_mib_per_second']:.1f} MiB/s\t"
+            f"{format_memory(result['compress_max_rss_bytes'])}\t"
+            f"{format_memory(result['decompress_max_rss_bytes'])}"
+        )
+
+
+benchmark.add_command(checksum)
+benchmark.add_command(inflate)
+benchmark.add_command(cram_calls)
+benchmark.add_command(cram)
@@ -5,15 +5,30 @@ import pathlib
 
 import click
 
-from crunchy.integrity import get_checksum
+from crunchy.cli.utils import checksum_options
+from crunchy.integrity import ALGORITHMS, get_checksums
 
 LOG = logging.getLogger(__name__)
 
 
 @click.command()
 @click.argument("infile", type=click.Path(exists=True))
-@click.option("--algorithm", "-a", type=click.Choice(["md5", "sha1", "sha256"]), default="sha256")
-def checksum(infile, algorithm):
+@click.option(
+    "--algorithm",
+    "-a",
+    type=click.Choice(ALGORITHMS),
+    default=["sha256"],
+    multiple=True,
+    help="Algorithm to use, can be given multiple times to get several checksums in one pass",
+)
+@click.pass_context
+def checksum(ctx, infile, algorithm):
     """Generate the checksum for a file."""
     LOG.info("Running checksum")
-    click.echo(get_checksum(pathlib.Path(infile), algorithm))
+    algorithms = list(dict.fromkeys(algorithm))
+    checksums = get_checksums(pathlib.Path(infile), algorithms, **checksum_options(ctx))
+    if len(algorithms) == 1:
+        click.echo(checksums[algorithms[0]])
+        return
+    for _algorithm, _checksum in checksums.items():
+        click.echo(f"{_algorithm}\t{_checksum}")
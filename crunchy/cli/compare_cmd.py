@@ -5,7 +5,13 @@ import pathlib
 
 import click
 
-from crunchy.integrity import compare_elements, get_checksum
+from crunchy.cli.utils import checksum_options, checksum_workers
+from crunchy.integrity import (
+    ALGORITHMS,
+    compare_elements,
+    compare_files,
+    get_checksums_concurrently,
+)
 
 LOG = logging.getLogger(__name__)
 
@@ -18,39 +24,107 @@ LOG = logging.getLogger(__name__)
     "-c",
     help="If the file should be compared to a checksum directly",
 )
-@click.option("--algorithm", "-a", type=click.Choice(["md5", "sha1", "sha256"]), default="sha256")
+@click.option(
+    "--second-checksum",
+    help="Checksum to compare the second file to, use together with --checksum",
+)
+@click.option("--algorithm", "-a", type=click.Choice(ALGORITHMS), default="sha256")
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    help="Number of files to hash at the same time, defaults to --checksum-workers",
+)
+@click.option(
+    "--direct",
+    is_flag=True,
+    help="Compare --first and --second byte by byte and stop at the first difference",
+)
 @click.option("--dry-run", is_flag=True)
-def compare(first, second, algorithm, checksum, dry_run):
+@click.pass_context
+def compare(ctx, first, second, algorithm, checksum, second_checksum, workers, direct, dry_run):
     """Compare two files by generating checksums. Fails if two files differ.
 
     Either the checksum of two files can be compared. Files will be decompressed and checksums
     calculated. Or the checksum of a file can be compared to a checksum string given on the command
-    line. Use --first and --checksum if a file should be compared directly to a checksum.
+    line. Use --first and --checksum if a file should be compared directly to a checksum. Use
+    --second and --second-checksum as well to verify two files against their own checksums, the
+    files are then hashed at the same time.
+
+    With --direct two files are compared byte by byte instead of by checksums. The comparison
+    stops at the first difference and reports its offset and FASTQ record.
     """
     LOG.info("Running checksum")
-    if second and checksum:
+    if second and checksum and not second_checksum:
         LOG.error("Use --first only in combination with --checksum")
         raise click.Abort
+    if second_checksum and not (second and checksum):
+        LOG.error("Use --second-checksum only in combination with --second and --checksum")
+        raise click.Abort
+
+    if direct and (checksum or not second):
+        LOG.error("Use --direct only with --first and --second")
+        raise click.Abort
 
     if dry_run:
         LOG.info("Dry Run!")
 
-    checksums = []
-    if checksum:
-        checksums.append(checksum)
+    if direct:
+        compare_directly(ctx, pathlib.Path(first), pathlib.Path(second), dry_run)
+        return
 
-    for _infile in [first, second]:
-        if not _infile:
-            continue
-        if dry_run:
-            checksums.append("dummy_checksum")
-            continue
-        _infile = pathlib.Path(_infile)
-        checksums.append(get_checksum(_infile, algorithm))
+    infiles = [pathlib.Path(_infile) for _infile in [first, second] if _infile]
+    if dry_run:
+        checksums = ["dummy_checksum" for _ in infiles]
+    else:
+        checksums = [
+            file_checksums[algorithm]
+            for file_checksums in get_checksums_concurrently(
+                infiles,
+                [algorithm],
+                workers=workers or checksum_workers(ctx),
+                **checksum_options(ctx),
+            )
+        ]
+
+    if second_checksum:
+        comparisons = [[checksums[0], checksum], [checksums[1], second_checksum]]
+    elif checksum:
+        comparisons = [[checksum] + checksums]
+    else:
+        comparisons = [checksums]
 
-    if not dry_run and not compare_elements(checksums):
-        LOG.warning(f"Checksums for {first} and {second} are NOT the same")
+    for infile, comparison in zip(infiles, comparisons):
+        if dry_run or compare_elements(comparison):
+            continue
+        if second_checksum:
+            LOG.warning(f"Checksum for {infile} is NOT the same as the given checksum")
+        else:
+            LOG.warning(f"Checksums for {first} and {second} are NOT the same")
         raise click.Abort
 
-    LOG.info(f"Checksum: {checksums[0]}")
+    LOG.info(f"Checksum: {comparisons[0][0]}")
     LOG.info("All checksums are the same")
+
+
+def compare_directly(ctx: click.Context, first: pathlib.Path, second: pathlib.Path, dry_run: bool):
+    """Compare two files byte by byte, abort if they differ."""
+    if dry_run:
+        return
+    options = checksum_options(ctx)
+    difference = compare_files(
+        first,
+        second,
+        buffer_size=options["buffer_size"],
+        inflate_backend=options["inflate_backend"],
+    )
+    if difference is None:
+        LOG.info("Files are identical")
+        return
+    if difference.reason == "size":
+        LOG.warning(f"{first} and {second} are NOT the same, the sizes differ")
+    else:
+        LOG.warning(
+            f"{first} and {second} are NOT the same, first difference at byte "
+            f"{difference.offset} in FASTQ record {difference.record}"
+        )
+    raise click.Abort
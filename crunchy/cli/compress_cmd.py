@@ -2,16 +2,26 @@
 
 import logging
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional, Tuple
 
 import click
 
 from crunchy.cli.compare_cmd import compare
 from crunchy.cli.decompress_cmd import spring as decompress_spring_cmd
-from crunchy.cli.utils import file_exists
-from crunchy.compress import compress_cram, compress_spring
+from crunchy.cli.utils import checksum_options, checksum_workers, file_exists
+from crunchy.compress import check_cram_integrity, compress_cram, compress_spring
+from crunchy.decompress import decompress_spring_to_checksums
 from crunchy.files import cram_outpath, spring_outpath
-from crunchy.metadata import dump_spring_metadata, fetch_spring_metadata
+from crunchy.integrity import ALGORITHMS, MEBIBYTE
+from crunchy.manifest import verify_spring_reads
+from crunchy.metadata import (
+    add_resource_usage,
+    dump_cram_metadata,
+    dump_spring_metadata,
+    fetch_cram_metadata,
+    fetch_spring_metadata,
+)
+from crunchy.profiles import CRAM_PROFILES, DEFAULT_CRAM_PROFILE
 
 LOG = logging.getLogger(__name__)
 
@@ -52,8 +62,49 @@ def compress():
     is_flag=True,
     help="If a json file with metada should be produced",
 )
+@click.option(
+    "--algorithm",
+    "-a",
+    type=click.Choice(ALGORITHMS),
+    default=["sha256"],
+    multiple=True,
+    help="Checksum algorithm(s) to store in the metadata, the first is used for integrity checks",
+)
+@click.option(
+    "--streaming",
+    is_flag=True,
+    help="Check the integrity by decompressing into named pipes instead of files on disk",
+)
+@click.option(
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    help="Store checksums of chunks of this many MiB in the metadata, for parallel verification",
+)
+@click.option(
+    "--fastq-stats",
+    is_flag=True,
+    help="Store read and base counts, read lengths and per field checksums in the metadata",
+)
+@click.option(
+    "--record-resources",
+    is_flag=True,
+    help="Store the time, memory, I/O and working dir usage of Spring in the metadata",
+)
 @click.pass_context
-def fastq(ctx, first_read, second_read, spring_path, dry_run, check_integrity, metadata_file):
+def fastq(
+    ctx,
+    first_read,
+    second_read,
+    spring_path,
+    dry_run,
+    check_integrity,
+    metadata_file,
+    algorithm,
+    streaming,
+    chunk_size,
+    fastq_stats,
+    record_resources,
+):
     """Compress a pair of FASTQ files with Spring."""
     LOG.info("Running compress fastq")
     if dry_run:
@@ -74,25 +125,24 @@ def fastq(ctx, first_read, second_read, spring_path, dry_run, check_integrity, m
         dry_run=dry_run,
     )
 
+    algorithms = list(dict.fromkeys(algorithm))
     metadata = fetch_spring_metadata(
-        first_read=first_read, second_read=second_read, spring=spring_path
+        first_read=first_read,
+        second_read=second_read,
+        spring=spring_path,
+        algorithm=algorithms,
+        workers=checksum_workers(ctx),
+        chunk_size=chunk_size * MEBIBYTE if chunk_size else None,
+        fastq_stats=fastq_stats,
+        **checksum_options(ctx),
     )
 
+    if record_resources and not dry_run:
+        add_resource_usage(metadata, "spring", spring_api.last_result)
     metadata_path: Optional[Path] = dump_spring_metadata(metadata) if metadata_file else None
     if not check_integrity:
         return
 
-    first_spring = Path(first_read).with_suffix(".spring.fastq")
-    second_spring = Path(second_read).with_suffix(".spring.fastq")
-
-    ctx.invoke(
-        decompress_spring_cmd,
-        spring_path=str(spring_path),
-        first_read=str(first_spring),
-        second_read=str(second_spring),
-        dry_run=dry_run,
-    )
-
     checksums = [None, None]
     for file_info in metadata:
         if file_info["file"] == "first_read":
@@ -100,18 +150,77 @@ def fastq(ctx, first_read, second_read, spring_path, dry_run, check_integrity, m
         elif file_info["file"] == "second_read":
             checksums[1] = file_info["checksum"]
 
-    success = True
-    try:
-        ctx.invoke(compare, first=str(first_spring), checksum=checksums[0], dry_run=dry_run)
-        ctx.invoke(compare, first=str(second_spring), checksum=checksums[1], dry_run=dry_run)
-    except click.Abort:
+    if streaming:
+        spring_checksums = decompress_spring_to_checksums(
+            spring_path=spring_path,
+            spring_api=spring_api,
+            algorithms=[algorithms[0]],
+            dry_run=dry_run,
+            buffer_size=checksum_options(ctx)["buffer_size"],
+        )
+        success = dry_run or checksums == [
+            read_checksums[algorithms[0]] for read_checksums in spring_checksums
+        ]
+    else:
+        success = check_decompressed_files(
+            ctx,
+            spring_path=spring_path,
+            reads=[first_read, second_read],
+            checksums=checksums,
+            algorithm=algorithms[0],
+            dry_run=dry_run,
+            metadata=metadata if chunk_size or fastq_stats else None,
+        )
+
+    if not success:
         LOG.error("Uncompressed Spring differ from original FASTQs")
-        success = False
         LOG.info(f"Deleting compressed spring file {spring_path}")
         spring_path.unlink()
         if metadata_file:
             LOG.info(f"Deleting metadata file {metadata_path}")
             metadata_path.unlink()
+        raise click.Abort
+    LOG.info("Files are identical, compression successful")
+
+
+def check_decompressed_files(
+    ctx: click.Context,
+    spring_path: Path,
+    reads: List[Path],
+    checksums: List[str],
+    algorithm: str,
+    dry_run: bool,
+    metadata: Optional[list] = None,
+) -> bool:
+    """Decompress a spring file next to the original reads and compare the checksums.
+
+    If metadata with chunk manifests or FASTQ statistics is given the files are verified against
+    it instead, chunk by chunk in parallel and with a report of which FASTQ fields differ. The
+    decompressed files are deleted afterwards.
+    """
+    first_spring = reads[0].with_suffix(".spring.fastq")
+    second_spring = reads[1].with_suffix(".spring.fastq")
+
+    ctx.invoke(
+        decompress_spring_cmd,
+        spring_path=str(spring_path),
+        first_read=str(first_spring),
+        second_read=str(second_spring),
+        dry_run=dry_run,
+    )
+
+    if metadata and not dry_run:
+        success = verify_spring_reads(
+            metadata,
+            first_read=first_spring,
+            second_read=second_spring,
+            workers=checksum_workers(ctx),
+            **checksum_options(ctx),
+        )
+    else:
+        success = compare_decompressed_files(
+            ctx, [first_spring, second_spring], checksums, algorithm, dry_run
+        )
 
     LOG.info("Deleting decompressed spring files")
     if not dry_run:
@@ -120,9 +229,30 @@ def fastq(ctx, first_read, second_read, spring_path, dry_run, check_integrity, m
         second_spring.unlink()
         LOG.info(f"{second_spring} deleted")
 
-    if not success:
-        raise click.Abort
-    LOG.info("Files are identical, compression successful")
+    return success
+
+
+def compare_decompressed_files(
+    ctx: click.Context,
+    decompressed: List[Path],
+    checksums: List[str],
+    algorithm: str,
+    dry_run: bool,
+) -> bool:
+    """Compare the decompressed files to the checksums of the original reads."""
+    try:
+        ctx.invoke(
+            compare,
+            first=str(decompressed[0]),
+            second=str(decompressed[1]),
+            checksum=checksums[0],
+            second_checksum=checksums[1],
+            algorithm=algorithm,
+            dry_run=dry_run,
+        )
+    except click.Abort:
+        return False
+    return True
 
 
 @click.command()
@@ -138,13 +268,48 @@ def fastq(ctx, first_read, second_read, spring_path, dry_run, check_integrity, m
     "-c",
     help="Path to cram file",
 )
+@click.option(
+    "--cram-profile",
+    type=click.Choice(list(CRAM_PROFILES)),
+    default=DEFAULT_CRAM_PROFILE,
+    show_default=True,
+    help="Trade compression speed for size, archive is the smallest and fast the fastest",
+)
+@click.option(
+    "--cram-option",
+    multiple=True,
+    help="Change a setting of the CRAM profile, like level=7, use_lzma=1 or embed_ref=1",
+)
+@click.option(
+    "--metadata-file",
+    is_flag=True,
+    help="If a json file with metadata, including the CRAM profile, should be produced",
+)
+@click.option(
+    "--check-integrity",
+    is_flag=True,
+    help="If the records of the CRAM should be compared to the BAM, without writing files",
+)
 @click.option("--dry-run", is_flag=True)
 @click.pass_context
-def bam(ctx, bam_path: click.Path, cram_path: str, dry_run: bool):
+def bam(
+    ctx,
+    bam_path: click.Path,
+    cram_path: str,
+    cram_profile: str,
+    cram_option: Tuple[str, ...],
+    metadata_file: bool,
+    check_integrity: bool,
+    dry_run: bool,
+):
     """Compress a BAM file to CRAM format with Samtools."""
     LOG.info("Running compress BAM")
     if dry_run:
         LOG.info("Dry Run! No files will be created or deleted")
+    try:
+        profile = CRAM_PROFILES[cram_profile].with_options(cram_option)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--cram-option") from error
     cram_api = ctx.obj.get("cram_api")
     try:
         cram_api.self_check()
@@ -158,7 +323,21 @@ def bam(ctx, bam_path: click.Path, cram_path: str, dry_run: bool):
         cram_path=cram_path,
         cram_api=cram_api,
         dry_run=dry_run,
+        profile=profile,
     )
+    metadata_path: Optional[Path] = None
+    if metadata_file and not dry_run:
+        metadata_path = dump_cram_metadata(fetch_cram_metadata(bam_path, cram_path, profile))
+
+    if check_integrity and not check_cram_integrity(
+        bam_path=bam_path, cram_path=cram_path, cram_api=cram_api, dry_run=dry_run
+    ):
+        LOG.error("CRAM records differ from the original BAM")
+        for created_path in [cram_path, cram_api.get_index_path(cram_path), metadata_path]:
+            if created_path and created_path.exists():
+                LOG.info(f"Deleting {created_path}")
+                created_path.unlink()
+        raise click.Abort
 
     LOG.info("Compression successful")
 
@@ -8,6 +8,7 @@ import click
 from crunchy.cli.compare_cmd import compare
 from crunchy.decompress import decompress_cram, decompress_spring
 from crunchy.files import fastq_outpaths
+from crunchy.regions import parse_region, read_regions_file
 
 LOG = logging.getLogger(__name__)
 
@@ -45,22 +46,45 @@ def decompress():
     is_flag=True,
     help="Skip deleting original files",
 )
+@click.option(
+    "--read-range",
+    nargs=2,
+    type=click.IntRange(min=1),
+    help="Only decompress the read pairs from START to END, counted from 1 and inclusive",
+)
+@click.option(
+    "--mate",
+    type=click.IntRange(min=1, max=2),
+    help="Only decompress the first or the second read in each pair",
+)
 @click.pass_context
-def spring(ctx, spring_path, first_read, second_read, first_checksum, second_checksum, dry_run):
+def spring(
+    ctx,
+    spring_path,
+    first_read,
+    second_read,
+    first_checksum,
+    second_checksum,
+    dry_run,
+    read_range,
+    mate,
+):
     """Decompress a spring file to fastq files"""
     LOG.info("Running decompress spring")
     spring_api = ctx.obj.get("spring_api")
     spring_path = pathlib.Path(spring_path)
+    if read_range and read_range[1] < read_range[0]:
+        raise click.BadParameter("END is before START", param_hint="--read-range")
+    if (read_range or mate) and (first_checksum or second_checksum):
+        raise click.UsageError("Part of a spring file can not be compared to checksums")
 
     if not (first_read or second_read):
         LOG.warning("No filenames provided. Guess fastq file names")
-        fastqs = fastq_outpaths(spring_path)
-        first_read = fastqs[0]
-        second_read = fastqs[1]
-
-    first_read = pathlib.Path(first_read)
-    second_read = pathlib.Path(second_read)
-    if first_read.exists() or second_read.exists():
+    fastqs = fastq_outpaths(spring_path)
+    first_read = pathlib.Path(first_read or fastqs[0])
+    second_read = pathlib.Path(second_read or fastqs[1])
+    outputs = [first_read, second_read] if not mate else [[first_read, second_read][mate - 1]]
+    if any(output.exists() for output in outputs):
         LOG.error("Outpath(s) already exists! Specify new with '-f', '-s'")
         raise click.Abort()
 
@@ -70,6 +94,8 @@ def spring(ctx, spring_path, first_read, second_read, first_checksum, second_che
         second=second_read,
         spring_api=spring_api,
         dry_run=dry_run,
+        read_range=tuple(read_range) if read_range else None,
+        mate=mate,
     )
 
     if not (first_checksum and second_checksum):
@@ -77,8 +103,14 @@ def spring(ctx, spring_path, first_read, second_read, first_checksum, second_che
         return
 
     try:
-        ctx.invoke(compare, first=str(first_read), checksum=first_checksum, dry_run=dry_run)
-        ctx.invoke(compare, first=str(second_read), checksum=second_checksum, dry_run=dry_run)
+        ctx.invoke(
+            compare,
+            first=str(first_read),
+            second=str(second_read),
+            checksum=first_checksum,
+            second_checksum=second_checksum,
+            dry_run=dry_run,
+        )
     except click.Abort:
         LOG.error("Uncompressed spring differ from given checksum")
         LOG.info("Deleting decompressed fastq files")
@@ -103,19 +135,42 @@ def spring(ctx, spring_path, first_read, second_read, first_checksum, second_che
     is_flag=True,
     help="Skip deleting original files",
 )
+@click.option(
+    "--region",
+    multiple=True,
+    help="Only decompress reads that overlap a region like chr1:1000-2000, can be repeated",
+)
+@click.option(
+    "--regions-file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Only decompress reads that overlap the regions in a BED file",
+)
+@click.option(
+    "--index",
+    is_flag=True,
+    help="Index the bam file",
+)
 @click.pass_context
-def cram(ctx, cram_path, bam_path, dry_run):
+def cram(ctx, cram_path, bam_path, dry_run, region, regions_file, index):
     """Decompress a cram file to bam file"""
     LOG.info("Running decompress cram")
     cram_api = ctx.obj.get("cram_api")
     cram_path = pathlib.Path(cram_path)
     bam_path = pathlib.Path(bam_path)
+    try:
+        regions = [parse_region(text) for text in region]
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--region") from error
+    if regions_file:
+        regions.extend(read_regions_file(pathlib.Path(regions_file)))
 
     decompress_cram(
         cram_path=cram_path,
         bam_path=bam_path,
         cram_api=cram_api,
         dry_run=dry_run,
+        regions=regions,
+        index=index,
     )
 
 
@@ -5,6 +5,8 @@ import pathlib
 
 import click
 
+from crunchy.integrity import DEFAULT_BUFFER_SIZE, DEFAULT_INFLATE_WORKERS, DEFAULT_WORKERS
+
 LOG = logging.getLogger(__name__)
 
 
@@ -24,3 +26,20 @@ def file_exists(file_path: pathlib.Path, exists: bool = True) -> bool:
             raise click.Abort
 
     return True
+
+
+def checksum_options(ctx: click.Context) -> dict:
+    """Return the checksum settings given to the base command as keyword arguments."""
+    obj = ctx.obj or {}
+    return {
+        "buffer_size": obj.get("buffer_size", DEFAULT_BUFFER_SIZE),
+        "cache": obj.get("checksum_cache"),
+        "inflate_workers": obj.get("inflate_workers", DEFAULT_INFLATE_WORKERS),
+        "inflate_backend": obj.get("inflate_backend", "auto"),
+    }
+
+
+def checksum_workers(ctx: click.Context) -> int:
+    """Return the number of files that should be hashed at the same time."""
+    obj = ctx.obj or {}
+    return obj.get("checksum_workers", DEFAULT_WORKERS)
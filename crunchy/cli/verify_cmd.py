@@ -0,0 +1,58 @@
+"""Code for verify cli command"""
+
+import json
+import logging
+import pathlib
+
+import click
+
+from crunchy.cli.utils import checksum_options, checksum_workers
+from crunchy.manifest import verify_spring_reads
+
+LOG = logging.getLogger(__name__)
+
+
+@click.command()
+@click.argument("metadata-file", type=click.Path(exists=True))
+@click.option(
+    "--first-read", "-f", type=click.Path(exists=True), required=True, help="First read in pair"
+)
+@click.option(
+    "--second-read", "-s", type=click.Path(exists=True), required=True, help="Second read in pair"
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    help=(
+        "Number of chunks to verify at the same time, defaults to --checksum-workers. Only "
+        "applies to uncompressed files, gzipped files are unzipped and verified in order"
+    ),
+)
+@click.option(
+    "--resume/--no-resume",
+    default=True,
+    show_default=True,
+    help="Skip chunks that were verified by an earlier, interrupted, run",
+)
+@click.pass_context
+def verify(ctx, metadata_file, first_read, second_read, workers, resume):
+    """Verify a pair of FASTQ files against the spring metadata they were compressed with.
+
+    Files with chunk manifests in the metadata are verified chunk by chunk in parallel and the
+    chunks that differ are reported. Other files are compared to their whole file checksums.
+    """
+    LOG.info("Running verify")
+    with open(metadata_file, "r") as infile:
+        metadata = json.load(infile)
+    success = verify_spring_reads(
+        metadata,
+        first_read=pathlib.Path(first_read),
+        second_read=pathlib.Path(second_read),
+        workers=workers or checksum_workers(ctx),
+        resume=resume,
+        **checksum_options(ctx),
+    )
+    if not success:
+        LOG.warning("Files are NOT the same as in the metadata")
+        raise click.Abort
+    LOG.info("All files are the same as in the metadata")
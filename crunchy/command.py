@@ -2,30 +2,181 @@
 Code to handle communications to the shell.
 """
 
+import asyncio
 import copy
 import logging
+import os
+import re
+import shutil
+import signal
 import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 from subprocess import CalledProcessError
-from typing import Generator, List, Optional
+from typing import IO, Any, Callable, Deque, Dict, Generator, List, NamedTuple, Optional, Tuple
+
+from crunchy.integrity import DEFAULT_FINGERPRINT_WORKERS, SamSetHasher
+from crunchy.profiles import CRAM_PROFILES, DEFAULT_CRAM_PROFILE, CramProfile
+from crunchy.reference import ReferenceCache
+from crunchy.regions import Region, merge_regions
 
 LOG = logging.getLogger(__name__)
 
+DEFAULT_MAX_OUTPUT_LINES = 10000
+ASYNC_LINE_LIMIT = 1024 * 1024
+DIRECTORY_POLL_SECONDS = 5
+KIBIBYTE = 1024
+STREAM_READ_SIZE = 1024 * KIBIBYTE
+SPRING_STEP = re.compile(r"^(?:Starting )?(?P<step>[\w ]+?)\s*\.\.\.$")
+SPRING_STEP_TIME = re.compile(r"^Time for this step: (?P<seconds>[\d.]+) s")
+SPRING_TOTAL_TIME = re.compile(r"^Total time for (?P<step>\w+): (?P<seconds>[\d.]+) s")
+SAMTOOLS_VERSION = re.compile(r"^samtools (?P<major>\d+)\.(?P<minor>\d+)")
+WRITE_INDEX_VERSION = (1, 10)
+FILTER_VERSION = (1, 12)
+DECOMPRESS_RANGE_PARAMETER = "--decompress-range"
+
+
+def kill_process_group(pid: int):
+    """Kill a process group, a group that has already exited is not an error."""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        LOG.info(f"Process group {pid} has already exited")
+
+
+class ResourceUsage(NamedTuple):
+    """Resources used by a command, None for what could not be measured.
+
+    CPU times and max RSS come from the rusage of the child, and include the children it waited
+    for. Bytes read and written are what the child itself caused to be fetched from and sent to
+    storage, from /proc/<pid>/io.
+    """
+
+    wall_seconds: float
+    user_seconds: Optional[float] = None
+    system_seconds: Optional[float] = None
+    max_rss_bytes: Optional[int] = None
+    read_bytes: Optional[int] = None
+    write_bytes: Optional[int] = None
+    working_dir_peak_bytes: Optional[int] = None
+
+
+class ProcessResult(NamedTuple):
+    """The exit code, the last lines of output and the resource usage of a command."""
+
+    returncode: int
+    stdout: str
+    stderr: str
+    resources: Optional[ResourceUsage] = None
+
+
+def read_proc_io(pid: int) -> Dict[str, int]:
+    """Return the I/O counters of a process, empty if they are not available."""
+    try:
+        with open(f"/proc/{pid}/io", "r") as io_file:
+            return {
+                name: int(value) for name, value in (line.split(":") for line in io_file if line)
+            }
+    except (OSError, ValueError):
+        return {}
+
+
+def wait_with_rusage(process: subprocess.Popen) -> Tuple[int, Optional[object], Dict[str, int]]:
+    """Wait for a child process and return its exit code, rusage and I/O counters.
+
+    The child is first waited for without being reaped, so that /proc/<pid>/io can still be
+    read, and then reaped with os.wait4 to get its rusage.
+    """
+    if not hasattr(os, "wait4"):
+        return process.wait(), None, {}
+    io_counters: Dict[str, int] = {}
+    if hasattr(os, "waitid") and hasattr(os, "WNOWAIT"):
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        io_counters = read_proc_io(process.pid)
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, rusage, io_counters
+
+
+def get_directory_usage(path: Path) -> int:
+    """Return the disk space used by the files in a directory tree, files may vanish meanwhile."""
+    usage = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                usage += os.lstat(os.path.join(dirpath, filename)).st_blocks * 512
+            except FileNotFoundError:
+                continue
+    return usage
+
+
+class DirectoryMonitor:
+    """Poll the disk usage of a directory in a thread and keep the peak.
+
+    Use as a context manager around the command that writes to the directory.
+    """
+
+    def __init__(self, path: Path, interval: float = DIRECTORY_POLL_SECONDS):
+        self.path = Path(path)
+        self.interval: float = interval
+        self.peak_bytes: int = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+
+    def _poll(self):
+        while True:
+            self.peak_bytes = max(self.peak_bytes, get_directory_usage(self.path))
+            if self._stopped.wait(self.interval):
+                break
+        self.peak_bytes = max(self.peak_bytes, get_directory_usage(self.path))
+
+    def __enter__(self) -> "DirectoryMonitor":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+
+class ProgressEvent(NamedTuple):
+    """A step of a running process, parsed from a line of its output."""
+
+    step: str
+    status: str
+    seconds: Optional[float] = None
+
 
 class Process:
     """Class to handle communication with other programs via the shell.
 
     The other parts of the code should not need to have any knowledge about how the processes are
     called, that will be handled in this module.Output form stdout and stdin will be handeld here.
+
+    Output is read line by line while the process runs. Only the last max_output_lines lines of
+    stdout and stderr are kept, and lines that describe progress are passed on as ProgressEvents
+    to progress_callback, or logged if there is no callback, as soon as they are written.
     """
 
     def __init__(
-        self, binary: str, config: Optional[str] = None, config_parameter: str = "--config"
+        self,
+        binary: str,
+        config: Optional[str] = None,
+        config_parameter: str = "--config",
+        progress_callback: Optional[Callable[[ProgressEvent], None]] = None,
+        max_output_lines: int = DEFAULT_MAX_OUTPUT_LINES,
     ):
         """
         Args:
             binary(str): Path to binary for the process to use
             config(str): Path to config if used by process
+            progress_callback(callable): Called with each ProgressEvent, from a reader thread
+            max_output_lines(int): Number of lines of stdout and stderr to keep
         """
         super(Process, self).__init__()
         self.binary: str = binary
@@ -34,30 +185,222 @@ class Process:
         if config:
             self.base_call.extend([config_parameter, config])
         LOG.info(f"Use base call {self.base_call}")
+        self.progress_callback: Optional[Callable[[ProgressEvent], None]] = progress_callback
+        self.max_output_lines: int = max_output_lines
         self._stdout: str = ""
         self._stderr: str = ""
+        self.last_result: Optional[ProcessResult] = None
+        self.env: Dict[str, str] = {}
+
+    def clone(self) -> "Process":
+        """Return a copy of the process to run a command in another thread.
 
-    def run_command(self, parameters=None):
+        The output and resources of a command are stored on the process that ran it, so commands
+        that run at the same time need a process each.
+        """
+        process = copy.copy(self)
+        process.env = dict(self.env)
+        return process
+
+    def get_env(self) -> Optional[Dict[str, str]]:
+        """Return the environment for commands, the current one updated with self.env."""
+        if not self.env:
+            return None
+        return {**os.environ, **self.env}
+
+    def run_command(
+        self,
+        parameters=None,
+        monitor_dir: Optional[Path] = None,
+        stdout_consumer: Optional[Callable[[bytes], None]] = None,
+    ):
         """Execute a command in the shell.
 
+        stdout and stderr are read in one thread each while the command runs, so that neither
+        pipe fills up and progress is reported as it happens. The resources used by the command,
+        and the peak disk usage of monitor_dir if given, are stored in last_result.
+
         Args:
             parameters(list)
+            monitor_dir(Path): Directory that the command uses for temporary files
+            stdout_consumer(callable): Called with each block of stdout instead of keeping lines,
+                an error from it is raised when the command has finished
         """
+        command = self.get_command(parameters)
+        LOG.info("Running command %s", " ".join(command))
+        progress_state: Dict[str, Any] = {}
+        consumer_errors: List[BaseException] = []
+        monitor = DirectoryMonitor(monitor_dir) if monitor_dir else None
+        start = time.monotonic()
+        process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self.get_env()
+        )
+        stdout_lines: Deque[str] = deque(maxlen=self.max_output_lines)
+        stderr_lines: Deque[str] = deque(maxlen=self.max_output_lines)
+        readers = [
+            (
+                threading.Thread(
+                    target=self._read_output, args=(process.stdout, stdout_lines, progress_state)
+                )
+                if stdout_consumer is None
+                else threading.Thread(
+                    target=self._stream_output,
+                    args=(process.stdout, stdout_consumer, consumer_errors),
+                )
+            ),
+            threading.Thread(
+                target=self._read_output, args=(process.stderr, stderr_lines, progress_state)
+            ),
+        ]
+        for reader in readers:
+            reader.start()
+        with monitor or nullcontext():
+            returncode, rusage, io_counters = wait_with_rusage(process)
+        wall_seconds = time.monotonic() - start
+        for reader in readers:
+            reader.join()
+
+        self.stdout = "\n".join(stdout_lines).rstrip()
+        self.stderr = "\n".join(stderr_lines).rstrip()
+        resources = ResourceUsage(
+            wall_seconds=wall_seconds,
+            user_seconds=rusage.ru_utime if rusage else None,
+            system_seconds=rusage.ru_stime if rusage else None,
+            max_rss_bytes=rusage.ru_maxrss * KIBIBYTE if rusage else None,
+            read_bytes=io_counters.get("read_bytes"),
+            write_bytes=io_counters.get("write_bytes"),
+            working_dir_peak_bytes=monitor.peak_bytes if monitor else None,
+        )
+        self.last_result = ProcessResult(returncode, self.stdout, self.stderr, resources)
+        LOG.info(f"Resources used by {self.binary}: {resources}")
+        if returncode != 0:
+            LOG.critical(f"Call {command} exit with a non zero exit code")
+            LOG.critical(self.stderr)
+            raise CalledProcessError(command, returncode)
+        if consumer_errors:
+            raise consumer_errors[0]
+
+        return returncode
+
+    def get_command(self, parameters: Optional[List[str]] = None) -> List[str]:
+        """Return the full command for a list of parameters."""
         command = copy.deepcopy(self.base_call)
         if parameters:
             command.extend(parameters)
+        return command
 
-        LOG.info("Running command %s", " ".join(command))
-        res = subprocess.run(command, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    async def run_command_async(self, parameters: Optional[List[str]] = None) -> ProcessResult:
+        """Execute a command in the shell without blocking the event loop.
 
-        self.stdout = res.stdout.decode("utf-8").rstrip()
-        self.stderr = res.stderr.decode("utf-8").rstrip()
-        if res.returncode != 0:
+        The command is started in a new process group. If the task is cancelled, or reading the
+        output fails, the whole group, including any children of the command, is killed and
+        reaped before the error is passed on. The output is returned, as well as stored in stdout
+        and stderr, so that several commands can run at the same time with one Process. Each run
+        parses its progress with a state of its own. The event loop reaps the child, so only the
+        wall time of the resources is measured.
+        """
+        command = self.get_command(parameters)
+        LOG.info("Running command %s", " ".join(command))
+        progress_state: Dict[str, Any] = {}
+        start = time.monotonic()
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+            limit=ASYNC_LINE_LIMIT,
+            env=self.get_env(),
+        )
+        stdout_lines: Deque[str] = deque(maxlen=self.max_output_lines)
+        stderr_lines: Deque[str] = deque(maxlen=self.max_output_lines)
+        readers = [
+            asyncio.ensure_future(self._read_output_async(stream, lines, progress_state))
+            for stream, lines in [(process.stdout, stdout_lines), (process.stderr, stderr_lines)]
+        ]
+        try:
+            await asyncio.gather(*readers)
+            returncode = await process.wait()
+        except BaseException as error:
+            for reader in readers:
+                reader.cancel()
+            if process.returncode is None:
+                LOG.warning(
+                    f"Command {command} stopped by {error!r}, killing process group {process.pid}"
+                )
+                kill_process_group(process.pid)
+                await process.wait()
+            raise
+
+        result = ProcessResult(
+            returncode=returncode,
+            stdout="\n".join(stdout_lines).rstrip(),
+            stderr="\n".join(stderr_lines).rstrip(),
+            resources=ResourceUsage(wall_seconds=time.monotonic() - start),
+        )
+        self.stdout = result.stdout
+        self.stderr = result.stderr
+        if returncode != 0:
             LOG.critical(f"Call {command} exit with a non zero exit code")
-            LOG.critical(self.stderr)
-            raise CalledProcessError(command, res.returncode)
+            LOG.critical(result.stderr)
+            raise CalledProcessError(command, returncode)
+        return result
+
+    def _read_output(self, stream: IO[bytes], lines: Deque[str], progress_state: Dict[str, Any]):
+        """Read a pipe line by line until it is closed, keep the last lines and report progress."""
+        with stream:
+            for raw_line in iter(stream.readline, b""):
+                self._handle_line(raw_line, lines, progress_state)
+
+    @staticmethod
+    def _stream_output(
+        stream: IO[bytes], consumer: Callable[[bytes], None], errors: List[BaseException]
+    ):
+        """Pass a pipe to a consumer block by block until it is closed.
 
-        return res.returncode
+        If the consumer fails the error is added to errors and the rest of the pipe is read and
+        dropped, so that the command is not blocked on a full pipe.
+        """
+        with stream:
+            for block in iter(lambda: stream.read1(STREAM_READ_SIZE), b""):
+                if errors:
+                    continue
+                try:
+                    consumer(block)
+                except Exception as error:  # pylint: disable=broad-except
+                    errors.append(error)
+
+    async def _read_output_async(
+        self, stream: asyncio.StreamReader, lines: Deque[str], progress_state: Dict[str, Any]
+    ):
+        """Read a pipe of a subprocess started with asyncio, like _read_output."""
+        async for raw_line in stream:
+            self._handle_line(raw_line, lines, progress_state)
+
+    def _handle_line(self, raw_line: bytes, lines: Deque[str], progress_state: Dict[str, Any]):
+        line = raw_line.decode("utf-8", errors="replace").rstrip("\n")
+        lines.append(line)
+        event = self.parse_progress(line, progress_state)
+        if event:
+            self.report_progress(event)
+
+    def parse_progress(self, line: str, state: Dict[str, Any]) -> Optional[ProgressEvent]:
+        """Return a ProgressEvent if a line of output describes progress.
+
+        state is a dict of its own for each run of a command, where subclasses can keep what
+        they have parsed so far. Generic processes do not report progress, subclasses parse the
+        output of their tools.
+        """
+        return None
+
+    def report_progress(self, event: ProgressEvent):
+        """Pass a ProgressEvent to the progress callback, or log it."""
+        if self.progress_callback:
+            self.progress_callback(event)
+            return
+        if event.seconds is None:
+            LOG.info(f"{event.step}: {event.status}")
+        else:
+            LOG.info(f"{event.step}: {event.status} in {event.seconds} s")
 
     @property
     def stdout(self):
@@ -105,39 +448,61 @@ class SpringProcess(Process):
         super().__init__(binary)
         self.threads: int = threads
         self.tmp: Optional[str] = tmp_dir
-
-    def decompress(self, spring_path: Path, first: Path, second: Path) -> bool:
-        """Run the spring decompress command."""
+        self.range_support: Optional[bool] = None
+
+    def supports_decompress_range(self) -> bool:
+        """Check if spring can decompress a range of reads, from its help text."""
+        if self.range_support is None:
+            try:
+                self.run_command(["--help"])
+                self.range_support = DECOMPRESS_RANGE_PARAMETER in self.stdout
+            except (CalledProcessError, OSError) as error:
+                LOG.warning(f"Could not get the spring options: {error}")
+                self.range_support = False
+            LOG.info(f"Spring supports decompressing a range of reads: {self.range_support}")
+        return self.range_support
+
+    @contextmanager
+    def working_dir(self) -> Generator[Optional[str], None, None]:
+        """Create a working directory of its own for one spring run in self.tmp.
+
+        Jobs that share a temporary directory then do not count each others files, the directory
+        is removed when the run is done.
+        """
+        if not self.tmp:
+            yield None
+            return
+        path = tempfile.mkdtemp(prefix="spring_", dir=self.tmp)
+        try:
+            yield path
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def decompress_parameters(
+        self,
+        spring_path: Path,
+        first: Path,
+        second: Path,
+        read_range: Optional[Tuple[int, int]] = None,
+        working_dir: Optional[str] = None,
+    ) -> List[str]:
+        """Return the parameters to decompress a spring file, or the read pairs in read_range."""
         parameters = ["-d", "-i", str(spring_path), "-o", str(first), str(second)]
-        if first.suffix == ".gz":
+        if ".gz" in (first.suffix, second.suffix):
             LOG.info("Compressing to gzipped format")
             parameters.append("-g")
-
-        if self.tmp:
-            parameters.extend(["--working-dir", self.tmp])
-
-        LOG.info("Decompressing Spring compressed file")
-        self.run_command(parameters)
-        success = False
-        time_to_decompress = "unknown"
-        for line in self.stdout_lines():
-            line = line.lower()
-            if "decompression done" in line:
-                success = True
-            if "total time for decompression" in line:
-                time_to_decompress = line.split(" ")[-2]
-
-        if success:
-            LOG.info("Spring decompression successfully completed!")
-            LOG.info(f"Time to decompress: {time_to_decompress}")
-            return True
-
-        LOG.error("Spring decompression failed")
-        LOG.error(self.stderr)
-        return False
-
-    def compress(self, first: Path, second: Path, outfile: Path) -> bool:
-        """Run the spring compression command."""
+        if read_range:
+            parameters.extend([DECOMPRESS_RANGE_PARAMETER, str(read_range[0]), str(read_range[1])])
+
+        working_dir = working_dir or self.tmp
+        if working_dir:
+            parameters.extend(["--working-dir", working_dir])
+        return parameters
+
+    def compress_parameters(
+        self, first: Path, second: Path, outfile: Path, working_dir: Optional[str] = None
+    ) -> List[str]:
+        """Return the parameters to compress a pair of FASTQ files."""
         parameters = [
             "-c",
             "-i",
@@ -153,71 +518,341 @@ class SpringProcess(Process):
             LOG.info("File(s) are gzipped")
             parameters.append("-g")
 
-        if self.tmp:
-            parameters.extend(["--working-dir", self.tmp])
+        working_dir = working_dir or self.tmp
+        if working_dir:
+            parameters.extend(["--working-dir", working_dir])
+        return parameters
 
-        LOG.info("Compressing FASTQ to Spring")
-        self.run_command(parameters)
+    @staticmethod
+    def check_output(stdout: str, stderr: str, operation: str) -> bool:
+        """Check that spring reports that the operation, compression or decompression, is done."""
         success = False
-        time_to_compress = "unknown"
-        for line in self.stdout_lines():
+        time_used = "unknown"
+        for line in stdout.split("\n"):
             line = line.lower()
-            if "compression done" in line:
+            if f"{operation} done" in line:
                 success = True
-            if "total time for compression" in line:
-                time_to_compress = line.split(" ")[-2]
+            if f"total time for {operation}" in line:
+                time_used = line.split(" ")[-2]
 
         if success:
-            LOG.info("Spring compression successfully completed!")
-            LOG.info(f"Time to compress: {time_to_compress}")
+            LOG.info(f"Spring {operation} successfully completed!")
+            LOG.info(f"Time for {operation}: {time_used}")
             return True
 
-        LOG.error("Spring compression failed")
-        LOG.error(self.stderr)
+        LOG.error(f"Spring {operation} failed")
+        LOG.error(stderr)
         return False
 
+    def decompress(
+        self,
+        spring_path: Path,
+        first: Path,
+        second: Path,
+        read_range: Optional[Tuple[int, int]] = None,
+    ) -> bool:
+        """Run the spring decompress command."""
+        LOG.info("Decompressing Spring compressed file")
+        with self.working_dir() as working_dir:
+            parameters = self.decompress_parameters(
+                spring_path, first, second, read_range, working_dir=working_dir
+            )
+            self.run_command(parameters, monitor_dir=working_dir)
+        return self.check_output(self.stdout, self.stderr, "decompression")
+
+    async def decompress_async(self, spring_path: Path, first: Path, second: Path) -> bool:
+        """Run the spring decompress command without blocking the event loop."""
+        LOG.info("Decompressing Spring compressed file")
+        with self.working_dir() as working_dir:
+            parameters = self.decompress_parameters(
+                spring_path, first, second, working_dir=working_dir
+            )
+            result = await self.run_command_async(parameters)
+        return self.check_output(result.stdout, result.stderr, "decompression")
+
+    def compress(self, first: Path, second: Path, outfile: Path) -> bool:
+        """Run the spring compression command."""
+        LOG.info("Compressing FASTQ to Spring")
+        with self.working_dir() as working_dir:
+            parameters = self.compress_parameters(first, second, outfile, working_dir=working_dir)
+            self.run_command(parameters, monitor_dir=working_dir)
+        return self.check_output(self.stdout, self.stderr, "compression")
+
+    async def compress_async(self, first: Path, second: Path, outfile: Path) -> bool:
+        """Run the spring compression command without blocking the event loop."""
+        LOG.info("Compressing FASTQ to Spring")
+        with self.working_dir() as working_dir:
+            parameters = self.compress_parameters(first, second, outfile, working_dir=working_dir)
+            result = await self.run_command_async(parameters)
+        return self.check_output(result.stdout, result.stderr, "compression")
+
+    def parse_progress(self, line: str, state: Dict[str, Any]) -> Optional[ProgressEvent]:
+        """Parse the step and timing lines that Spring writes.
+
+        A step starts with a line like 'Reordering ...' and finishes with 'Time for this step: 12
+        s', the whole run with 'Total time for compression: 340 s'.
+        """
+        line = line.strip()
+        match = SPRING_TOTAL_TIME.match(line)
+        if match:
+            return ProgressEvent(
+                step=match["step"], status="finished", seconds=float(match["seconds"])
+            )
+        match = SPRING_STEP_TIME.match(line)
+        if match:
+            return ProgressEvent(
+                step=state.get("step") or "step",
+                status="finished",
+                seconds=float(match["seconds"]),
+            )
+        match = SPRING_STEP.match(line)
+        if match:
+            state["step"] = match["step"].lower()
+            return ProgressEvent(step=state["step"], status="started")
+        return None
+
     def __repr__(self):
         return f"SpringProcess:base_call:{self.base_call}"
 
 
 class CramProcess(Process):
-    """Process to deal with CRAM commands."""
+    """Process to deal with CRAM commands.
+
+    samtools is run with threads threads for the BGZF and CRAM codecs. CRAM files are indexed
+    while they are written if samtools is new enough to support --write-index. With a
+    reference_cache the cache is warmed before the first command and samtools finds the reference
+    sequences there, by MD5, through REF_PATH and REF_CACHE. CRAM files are then decoded without
+    opening the FASTA reference.
+    """
 
-    def __init__(self, binary: str, refgenome_path: str, threads: int = 8):
+    def __init__(
+        self,
+        binary: str,
+        refgenome_path: str,
+        threads: int = 8,
+        reference_cache: Optional[ReferenceCache] = None,
+    ):
         """Initialise a spring process."""
         super().__init__(binary)
         self.refgenome_path: str = refgenome_path
         self.threads: int = threads
+        self.version: Optional[Tuple[int, int]] = None
+        self.reference_cache: Optional[ReferenceCache] = reference_cache
+        self._reference_cache_warm: bool = False
+
+    def warm_reference_cache(self):
+        """Fill the reference cache, once, and export its environment to all samtools commands."""
+        if self.reference_cache is None or self._reference_cache_warm:
+            return
+        self.reference_cache.warm()
+        self.env.update(self.reference_cache.environment())
+        self._reference_cache_warm = True
+
+    def clone(self) -> "CramProcess":
+        """Return a copy of the process to run a command in another thread.
+
+        The reference cache is warmed first so that the copies do not all warm it.
+        """
+        self.warm_reference_cache()
+        return super().clone()
 
-    def decompress(self, cram_path: Path, bam_path: Path) -> bool:
-        """Convert CRAM to BAM."""
-        LOG.info(f"Decompressing cram {cram_path} to bam {bam_path}")
-        parameters = [
+    def reference_parameters(self, decode: bool = False) -> List[str]:
+        """Return the parameters that point samtools to the reference.
+
+        Encoding always needs the FASTA, decoding uses the reference cache if there is one.
+        """
+        self.warm_reference_cache()
+        if decode and self.reference_cache is not None:
+            return []
+        return ["-T", self.refgenome_path]
+
+    def get_version(self) -> Tuple[int, int]:
+        """Return the major and minor version of samtools, (0, 0) if it is unknown."""
+        if self.version is None:
+            try:
+                self.run_command(["--version"])
+                match = SAMTOOLS_VERSION.match(self.stdout)
+            except (CalledProcessError, OSError) as error:
+                LOG.warning(f"Could not get the samtools version: {error}")
+                match = None
+            self.version = (int(match["major"]), int(match["minor"])) if match else (0, 0)
+            LOG.info(f"Use samtools version {self.version[0]}.{self.version[1]}")
+        return self.version
+
+    def supports_write_index(self) -> bool:
+        """Check if samtools can index a file while writing it."""
+        return self.get_version() >= WRITE_INDEX_VERSION
+
+    def decompress_parameters(self, cram_path: Path, bam_path: Path) -> List[str]:
+        """Return the parameters to convert CRAM to BAM."""
+        return [
             "view",
             "-b",
+            "-@",
+            str(self.threads),
             "-o",
             str(bam_path),
-            "-T",
-            self.refgenome_path,
+            *self.reference_parameters(decode=True),
             str(cram_path),
         ]
-        self.run_command(parameters)
-        return True
 
-    def compress(self, bam_path: Path, cram_path: Path) -> bool:
-        """Convert BAM to CRAM."""
-        LOG.info(f"Compressing BAN {bam_path} to CRAM {cram_path}")
+    def region_parameters(
+        self,
+        cram_path: Path,
+        bam_path: Path,
+        regions: List[Region],
+        threads: int,
+        after: Optional[int] = None,
+    ) -> List[str]:
+        """Return the parameters to convert the reads of a CRAM that overlap regions to BAM.
+
+        Reads that start at or before position after are left out, they belong to the region
+        before. Several regions are read with the multi region iterator that outputs each read
+        once.
+        """
         parameters = [
             "view",
-            "-C",
-            "-T",
-            self.refgenome_path,
+            "-b",
+            "-@",
+            str(threads),
+            "-o",
+            str(bam_path),
+            *self.reference_parameters(decode=True),
+        ]
+        if after is not None:
+            parameters.extend(["-e", f"pos > {after}"])
+        if len(regions) > 1:
+            parameters.append("-M")
+        parameters.append(str(cram_path))
+        parameters.extend(str(region) for region in regions)
+        return parameters
+
+    def merge_parameters(self, bam_path: Path, parts: List[Path]) -> List[str]:
+        """Return the parameters to merge sorted BAM files into one."""
+        return [
+            "merge",
+            "-f",
+            "-@",
+            str(self.threads),
+            str(bam_path),
+            *[str(part) for part in parts],
+        ]
+
+    def compress_parameters(
+        self,
+        bam_path: Path,
+        cram_path: Path,
+        write_index: bool = False,
+        profile: Optional[CramProfile] = None,
+    ) -> List[str]:
+        """Return the parameters to convert BAM to CRAM, and index it if write_index is set.
+
+        The CRAM is written with the samtools defaults unless a profile is given.
+        """
+        parameters = [
+            "view",
+            *(profile or CRAM_PROFILES[DEFAULT_CRAM_PROFILE]).view_parameters(),
+            "-@",
+            str(self.threads),
+            *self.reference_parameters(),
             str(bam_path),
             "-o",
             str(cram_path),
         ]
-        self.run_command(parameters)
-        self.index(cram_path)
+        if write_index:
+            parameters.append("--write-index")
+        return parameters
+
+    def index_parameters(self, file_path: Path) -> List[str]:
+        """Return the parameters to index a BAM or CRAM file."""
+        return [
+            "index",
+            "-@",
+            str(self.threads),
+            str(file_path),
+            str(self.get_index_path(file_path)),
+        ]
+
+    def decompress(self, cram_path: Path, bam_path: Path) -> bool:
+        """Convert CRAM to BAM."""
+        LOG.info(f"Decompressing cram {cram_path} to bam {bam_path}")
+        self.run_command(self.decompress_parameters(cram_path, bam_path))
+        return True
+
+    def decompress_regions(
+        self, cram_path: Path, bam_path: Path, regions: List[Region], index: bool = False
+    ) -> bool:
+        """Convert the reads of a CRAM that overlap regions to BAM, and index it if index is set.
+
+        Only the slices that overlap the regions are decoded, found with the index of the CRAM
+        that is created first if it is missing. Overlapping regions are merged and the rest are
+        decoded in parallel, sharing the threads, into BAM files that are merged. samtools older
+        than 1.12 can not leave out the reads that were already written for the region before, it
+        decodes all regions in one process.
+        """
+        regions = merge_regions(regions)
+        LOG.info(f"Decompressing {len(regions)} regions of cram {cram_path} to bam {bam_path}")
+        if not self.get_index_path(cram_path).exists():
+            self.index(cram_path)
+        if len(regions) == 1 or self.get_version() < FILTER_VERSION:
+            self.run_command(self.region_parameters(cram_path, bam_path, regions, self.threads))
+        else:
+            jobs = []
+            for position, region in enumerate(regions):
+                previous = regions[position - 1] if position else None
+                after = previous.end if previous and previous.contig == region.contig else None
+                jobs.append((region, after))
+            workers = min(len(jobs), self.threads)
+            threads = max(self.threads // workers, 1)
+            with tempfile.TemporaryDirectory(prefix="crunchy_", dir=bam_path.parent) as tmp_dir:
+                parts = [Path(tmp_dir, f"region_{position}.bam") for position in range(len(jobs))]
+                commands = [
+                    self.region_parameters(cram_path, part, [region], threads, after=after)
+                    for part, (region, after) in zip(parts, jobs)
+                ]
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    list(
+                        executor.map(
+                            lambda parameters: self.clone().run_command(parameters), commands
+                        )
+                    )
+                self.run_command(self.merge_parameters(bam_path, parts))
+        if index:
+            self.index(bam_path)
+        return True
+
+    async def decompress_async(self, cram_path: Path, bam_path: Path) -> bool:
+        """Convert CRAM to BAM without blocking the event loop."""
+        LOG.info(f"Decompressing cram {cram_path} to bam {bam_path}")
+        await self.run_command_async(self.decompress_parameters(cram_path, bam_path))
+        return True
+
+    def compress(
+        self, bam_path: Path, cram_path: Path, profile: Optional[CramProfile] = None
+    ) -> bool:
+        """Convert BAM to CRAM and index it, in the same pass if samtools supports it."""
+        LOG.info(f"Compressing BAN {bam_path} to CRAM {cram_path}")
+        write_index = self.supports_write_index()
+        self.run_command(
+            self.compress_parameters(bam_path, cram_path, write_index=write_index, profile=profile)
+        )
+        if not write_index:
+            LOG.info("samtools can not index while writing, index in a separate pass")
+            self.index(cram_path)
+        return True
+
+    async def compress_async(
+        self, bam_path: Path, cram_path: Path, profile: Optional[CramProfile] = None
+    ) -> bool:
+        """Convert BAM to CRAM and index it without blocking the event loop."""
+        LOG.info(f"Compressing BAN {bam_path} to CRAM {cram_path}")
+        write_index = self.supports_write_index()
+        await self.run_command_async(
+            self.compress_parameters(bam_path, cram_path, write_index=write_index, profile=profile)
+        )
+        if not write_index:
+            LOG.info("samtools can not index while writing, index in a separate pass")
+            await self.index_async(cram_path)
         return True
 
     @staticmethod
@@ -229,9 +864,39 @@ class CramProcess(Process):
     def index(self, file_path: Path):
         """Index a BAM or CRAM file."""
         LOG.info(f"Creating index for {file_path}")
-        index_path = self.get_index_path(file_path)
-        parameters = ["index", str(file_path), str(index_path)]
-        self.run_command(parameters)
+        self.run_command(self.index_parameters(file_path))
+
+    async def index_async(self, file_path: Path):
+        """Index a BAM or CRAM file without blocking the event loop."""
+        LOG.info(f"Creating index for {file_path}")
+        await self.run_command_async(self.index_parameters(file_path))
+
+    def records_parameters(self, file_path: Path) -> List[str]:
+        """Return the parameters to write the records of a BAM or CRAM file as SAM to stdout.
+
+        MD and NM are left out since they are calculated from the reference when a CRAM file is
+        decoded, and are then not calculated at all.
+        """
+        parameters = ["view", "-@", str(self.threads), "-x", "MD", "-x", "NM"]
+        if file_path.suffix == ".cram":
+            parameters.extend(
+                [*self.reference_parameters(decode=True), "--input-fmt-option", "decode_md=0"]
+            )
+        parameters.append(str(file_path))
+        return parameters
+
+    def records_fingerprint(
+        self, file_path: Path, workers: int = DEFAULT_FINGERPRINT_WORKERS
+    ) -> str:
+        """Return an order independent fingerprint of the records in a BAM or CRAM file.
+
+        The records are streamed from samtools and hashed as they arrive, nothing is written to
+        disk.
+        """
+        LOG.info(f"Creating fingerprint of the records in {file_path}")
+        with SamSetHasher(workers=workers) as hasher:
+            self.run_command(self.records_parameters(file_path), stdout_consumer=hasher.update)
+            return hasher.hexdigest()
 
     def self_check(self):
         """Run a check and see that all parameters are valid."""
@@ -242,6 +907,7 @@ class CramProcess(Process):
         if not Path(self.refgenome_path).exists():
             LOG.warning("Reference genome %s does not exist", self.refgenome_path)
             raise FileNotFoundError
+        self.warm_reference_cache()
 
     def __repr__(self):
         return f"CramProcess:base_call:{self.base_call}, refgenome_path:{self.refgenome_path}"
@@ -1,9 +1,14 @@
 """Code to compress a pair of fastq files"""
 
 import logging
+import os
 import pathlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 from .command import CramProcess, SpringProcess
+from .integrity import DEFAULT_FINGERPRINT_WORKERS, get_record_count
+from .profiles import CramProfile
 
 LOG = logging.getLogger(__name__)
 
@@ -15,7 +20,11 @@ def compress_spring(
     outfile: pathlib.Path,
     dry_run: bool = False,
 ) -> bool:
-    """Compress file(s)"""
+    """Compress file(s)
+
+    Spring writes to a partial file that is renamed to outfile when it is complete, so that an
+    interrupted compression never leaves a file that looks complete.
+    """
     first_read = first_read.absolute()
     second_read = second_read.absolute()
     outfile = outfile.absolute()
@@ -23,7 +32,22 @@ def compress_spring(
     if dry_run:
         return True
 
-    return spring_api.compress(first=first_read, second=second_read, outfile=outfile)
+    partial_path = get_partial_path(outfile)
+    success = False
+    try:
+        success = spring_api.compress(first=first_read, second=second_read, outfile=partial_path)
+        if success:
+            os.replace(partial_path, outfile)
+    finally:
+        if not success and partial_path.exists():
+            LOG.info(f"Deleting partial spring file {partial_path}")
+            partial_path.unlink()
+    return success
+
+
+def get_partial_path(outfile: pathlib.Path) -> pathlib.Path:
+    """Return the path that a file is written to until it is complete."""
+    return outfile.with_name(outfile.name + ".partial")
 
 
 def compress_cram(
@@ -31,8 +55,9 @@ def compress_cram(
     cram_path: pathlib.Path,
     cram_api: CramProcess,
     dry_run: bool = False,
+    profile: Optional[CramProfile] = None,
 ) -> bool:
-    """Compress bam file"""
+    """Compress bam file, with the samtools defaults unless a profile is given"""
     bam_path = bam_path.absolute()
     cram_path = cram_path.absolute()
 
@@ -40,4 +65,42 @@ def compress_cram(
     if dry_run:
         return True
 
-    return cram_api.compress(bam_path=bam_path, cram_path=cram_path)
+    return cram_api.compress(bam_path=bam_path, cram_path=cram_path, profile=profile)
+
+
+def check_cram_integrity(
+    bam_path: pathlib.Path,
+    cram_path: pathlib.Path,
+    cram_api: CramProcess,
+    dry_run: bool = False,
+    workers: int = DEFAULT_FINGERPRINT_WORKERS,
+) -> bool:
+    """Check that a CRAM file has the same records as the BAM file it was created from.
+
+    Both files are decoded at the same time, to SAM streams that are fingerprinted as they are
+    read, so no decompressed file is written to disk. The workers are shared by the two files, and
+    each file is read by a copy of cram_api since a process keeps the output of its last command.
+    """
+    LOG.info("Comparing the records of %s and %s", bam_path, cram_path)
+    if dry_run:
+        return True
+
+    processes = [cram_api.clone() for _ in range(2)]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        bam_fingerprint, cram_fingerprint = executor.map(
+            lambda process, file_path: process.records_fingerprint(
+                file_path, workers=max(workers // 2, 1)
+            ),
+            processes,
+            [bam_path, cram_path],
+        )
+    bam_records = get_record_count(bam_fingerprint)
+    cram_records = get_record_count(cram_fingerprint)
+    if bam_records != cram_records:
+        LOG.error(f"{bam_path} has {bam_records} records and {cram_path} has {cram_records}")
+        return False
+    if bam_fingerprint != cram_fingerprint:
+        LOG.error(f"The records of {bam_path} and {cram_path} differ")
+        return False
+    LOG.info(f"{bam_records} records are identical in {bam_path} and {cram_path}")
+    return True
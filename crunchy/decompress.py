@@ -1,9 +1,28 @@
 """Functions to decompress files."""
 
+import errno
+import gzip
 import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
 from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 from .command import CramProcess, SpringProcess
+from .integrity import (
+    DEFAULT_BUFFER_SIZE,
+    DEFAULT_FINGERPRINT_WORKERS,
+    FASTQ_RECORD_LINES,
+    close_hash_objs,
+    generate_checksums,
+    get_hash_obj,
+)
+from .regions import Region
 
 LOG = logging.getLogger(__name__)
 
@@ -14,15 +33,180 @@ def decompress_spring(
     second: Path,
     spring_api: SpringProcess,
     dry_run: bool = False,
+    read_range: Optional[Tuple[int, int]] = None,
+    mate: Optional[int] = None,
 ) -> bool:
-    """Decompress a spring file into two fastq files."""
+    """Decompress a spring file into two fastq files.
+
+    With a read_range only the read pairs from start to end, 1-based and inclusive, are
+    decompressed, by Spring itself if it supports it and otherwise by truncating its output while
+    it is streamed through named pipes. With mate only the first or second read is written.
+    """
     spring_path = spring_path.absolute()
-    first = first.absolute()
-    second = second.absolute()
-    LOG.info(f"Decompressing {spring_path} to {first} and {second}")
+    outputs: List[Optional[Path]] = [first.absolute(), second.absolute()]
+    if mate:
+        outputs[2 - mate] = None
+    LOG.info(f"Decompressing {spring_path} to {' and '.join(str(out) for out in outputs if out)}")
+    if read_range:
+        LOG.info(f"Only decompress read pairs {read_range[0]} to {read_range[1]}")
     if dry_run:
         return True
-    return spring_api.decompress(spring_path=spring_path, first=first, second=second)
+    if read_range and not spring_api.supports_decompress_range():
+        LOG.info("Spring can not decompress a range of reads, truncate the output instead")
+        success, _ = decompress_spring_to_fifos(
+            spring_path=spring_path,
+            spring_api=spring_api,
+            readers=[
+                partial(copy_fifo_records, outfile=outfile, read_range=read_range)
+                for outfile in outputs
+            ],
+        )
+        return success
+    return spring_api.decompress(
+        spring_path=spring_path,
+        first=outputs[0] or Path(os.devnull),
+        second=outputs[1] or Path(os.devnull),
+        read_range=read_range,
+    )
+
+
+def decompress_spring_to_checksums(
+    spring_path: Path,
+    spring_api: SpringProcess,
+    algorithms: Iterable[str],
+    dry_run: bool = False,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    fingerprint_workers: Optional[int] = None,
+) -> List[Dict[str, str]]:
+    """Decompress a spring file into named pipes and return the checksums of the two reads.
+
+    Spring writes the reads into two FIFOs that are hashed while Spring is running, this means
+    that the decompressed reads are never written to disk. The processes for fastq-set
+    fingerprints are split between the two reads unless fingerprint_workers is given.
+
+    Returns:
+        checksums(list): One dict with checksums per read
+    """
+    spring_path = spring_path.absolute()
+    algorithms = list(algorithms)
+    LOG.info(f"Decompressing {spring_path} into named pipes")
+    if dry_run:
+        return [{algorithm: "dummy_checksum" for algorithm in algorithms} for _ in range(2)]
+
+    if fingerprint_workers is None:
+        fingerprint_workers = max(DEFAULT_FINGERPRINT_WORKERS // 2, 1)
+    reader = partial(
+        checksum_fifo,
+        algorithms=algorithms,
+        buffer_size=buffer_size,
+        fingerprint_workers=fingerprint_workers,
+    )
+    _, checksums = decompress_spring_to_fifos(spring_path, spring_api, readers=[reader, reader])
+    return checksums
+
+
+def decompress_spring_to_fifos(
+    spring_path: Path,
+    spring_api: SpringProcess,
+    readers: List[Callable[[Path, threading.Event], Any]],
+) -> Tuple[bool, List[Any]]:
+    """Decompress a spring file into two named pipes.
+
+    Each reader is called with a pipe and an event to set when it has opened the pipe, and reads
+    it in a thread while Spring is running.
+
+    Returns:
+        if Spring succeeded, and what each reader returned
+    """
+    with tempfile.TemporaryDirectory(prefix="crunchy_") as fifo_dir:
+        fifos = [Path(fifo_dir, "first_read.fastq"), Path(fifo_dir, "second_read.fastq")]
+        opened = [threading.Event() for _ in fifos]
+        for fifo in fifos:
+            os.mkfifo(fifo)
+        # Both pipes have to be read at the same time or Spring could block on a full pipe
+        with ThreadPoolExecutor(max_workers=len(fifos)) as executor:
+            futures = [
+                executor.submit(reader, fifo, event)
+                for reader, fifo, event in zip(readers, fifos, opened)
+            ]
+            try:
+                success = spring_api.decompress(
+                    spring_path=spring_path, first=fifos[0], second=fifos[1]
+                )
+            finally:
+                for fifo, event, future in zip(fifos, opened, futures):
+                    release_fifo(fifo=fifo, opened=event, future=future)
+            return success, [future.result() for future in futures]
+
+
+def copy_fifo_records(
+    fifo: Path,
+    opened: threading.Event,
+    outfile: Optional[Path],
+    read_range: Tuple[int, int],
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+):
+    """Copy the FASTQ records in a read range from a named pipe to a file, gzipped for .gz.
+
+    Without an outfile nothing is copied. The rest of the pipe is read and thrown away so that
+    the writer can finish.
+    """
+    with open(fifo, "rb") as content:
+        opened.set()
+        if outfile:
+            LOG.info(f"Copy records {read_range[0]} to {read_range[1]} from {fifo} to {outfile}")
+            opener = gzip.open if outfile.suffix == ".gz" else open
+            with opener(outfile, "wb") as out:
+                out.writelines(
+                    islice(
+                        content,
+                        (read_range[0] - 1) * FASTQ_RECORD_LINES,
+                        read_range[1] * FASTQ_RECORD_LINES,
+                    )
+                )
+        while content.read(buffer_size):
+            continue
+
+
+def checksum_fifo(
+    fifo: Path,
+    opened: threading.Event,
+    algorithms: List[str],
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    fingerprint_workers: int = DEFAULT_FINGERPRINT_WORKERS,
+) -> Dict[str, str]:
+    """Read a named pipe until the writer closes it and return the checksums of the content."""
+    hash_objs = {
+        algorithm: get_hash_obj(algorithm, fingerprint_workers=fingerprint_workers)
+        for algorithm in algorithms
+    }
+    try:
+        with open(fifo, "rb") as content:
+            opened.set()
+            LOG.info(f"Create checksum for {fifo}")
+            return generate_checksums(content, hash_objs, buffer_size=buffer_size)
+    finally:
+        close_hash_objs(hash_objs)
+
+
+def release_fifo(fifo: Path, opened: threading.Event, future: Future):
+    """Make sure that a reader blocking on a named pipe gets to the end of the file.
+
+    If the writer never opened the pipe, e.g. if Spring failed, the reader would wait forever.
+    Opening and closing the pipe for writing gives the reader an empty file instead.
+    """
+    while not (opened.is_set() or future.done()):
+        try:
+            file_descriptor = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as error:
+            # ENXIO means that the reader has not opened the pipe yet
+            if error.errno != errno.ENXIO:
+                raise
+            time.sleep(0.1)
+            continue
+        os.close(file_descriptor)
+        LOG.warning(f"Nothing was written to {fifo}")
+        return
 
 
 def decompress_cram(
@@ -30,11 +214,23 @@ def decompress_cram(
     bam_path: Path,
     cram_api: CramProcess,
     dry_run: bool = False,
+    regions: Optional[List[Region]] = None,
+    index: bool = False,
 ) -> bool:
-    """Decompress a cram file into a bam file."""
+    """Decompress a cram file into a bam file, or only the reads that overlap regions.
+
+    The bam file is indexed if index is set.
+    """
     cram_path = cram_path.absolute()
     bam_path = bam_path.absolute()
     LOG.info(f"Decompressing {cram_path} to {bam_path}")
     if dry_run:
         return True
-    return cram_api.decompress(cram_path=cram_path, bam_path=bam_path)
+    if regions:
+        return cram_api.decompress_regions(
+            cram_path=cram_path, bam_path=bam_path, regions=regions, index=index
+        )
+    success = cram_api.decompress(cram_path=cram_path, bam_path=bam_path)
+    if index:
+        cram_api.index(bam_path)
+    return success
@@ -2,48 +2,793 @@
 
 import gzip
 import hashlib
+import importlib.util
 import logging
+import mmap
+import multiprocessing
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+import zlib
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 
-from typing import Any
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from crunchy.cache import ChecksumCache, get_file_identity
 
 LOG = logging.getLogger(__name__)
 
+MEBIBYTE = 1024 * 1024
+DEFAULT_BUFFER_SIZE = 8 * MEBIBYTE
+LEGACY_CHUNK_SIZE = 4096
+ALGORITHMS = ["md5", "sha1", "sha256", "fastq-set"]
+DEFAULT_WORKERS = 2
+DEFAULT_FINGERPRINT_WORKERS = os.cpu_count() or 1
+FINGERPRINT_CHUNK_SIZE = 16 * MEBIBYTE
+RECORD_HASH_BITS = 128
+DEFAULT_INFLATE_WORKERS = min(4, os.cpu_count() or 1)
+
+GZIP_MAGIC = b"\x1f\x8b\x08"
+GZIP_HEADER_SIZE = 10
+GZIP_WBITS = 31
+FEXTRA = 4
+BGZF_HEADER_SIZE = 18
+
+INFLATE_COMMANDS = {"igzip": ["igzip", "-dc"], "pigz": ["pigz", "-dc"]}
+INFLATE_BACKENDS = ["auto", "isal", "igzip", "pigz", "zlib"]
+AUTO_INFLATE_BACKENDS = ["isal", "zlib"]
+FASTQ_RECORD_LINES = 4
+
+
+class Difference(NamedTuple):
+    """Where the uncompressed content of two files first differ.
+
+    The offset and the 1-based FASTQ record are None when the files were found to differ from
+    their sizes alone.
+    """
+
+    reason: str
+    offset: Optional[int] = None
+    record: Optional[int] = None
+
+
+class FastqStats:
+    """Collect read statistics and per field checksums of uncompressed FASTQ content.
+
+    Has the update and hexdigest methods of a hash object so that it can be fed the content in
+    the same pass as the checksums. Lines are split across chunks, the position of a line in its
+    record is kept from the number of lines seen so far.
+    """
+
+    FIELDS = ["headers", "sequences", "qualities"]
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget all content fed so far."""
+        self.nr_lines: int = 0
+        self.read_lengths: Counter = Counter()
+        self.hash_objs: Dict[str, "hashlib._HASH"] = {
+            field: hashlib.sha256() for field in self.FIELDS
+        }
+        self._partial_line: bytes = b""
+
+    def update(self, data):
+        """Feed more content, chunks do not have to end at a line or a record."""
+        lines = (self._partial_line + bytes(data)).split(b"\n")
+        self._partial_line = lines.pop()
+        self._update_lines(lines)
+
+    def _update_lines(self, lines: List[bytes]):
+        first = -self.nr_lines % FASTQ_RECORD_LINES
+        headers = lines[first::FASTQ_RECORD_LINES]
+        sequences = lines[(first + 1) % FASTQ_RECORD_LINES :: FASTQ_RECORD_LINES]
+        qualities = lines[(first + 3) % FASTQ_RECORD_LINES :: FASTQ_RECORD_LINES]
+        for field, field_lines in zip(self.FIELDS, [headers, sequences, qualities]):
+            if field_lines:
+                self.hash_objs[field].update(b"\n".join(field_lines) + b"\n")
+        self.read_lengths.update(map(len, sequences))
+        self.nr_lines += len(lines)
+
+    def finish(self):
+        """Count a last line that does not end with a newline."""
+        if self._partial_line:
+            self._update_lines([self._partial_line])
+            self._partial_line = b""
+
+    def hexdigest(self) -> str:
+        """Return a checksum of the per field checksums."""
+        digests = self.stats()["digests"]
+        return hashlib.sha256("".join(digests[field] for field in self.FIELDS).encode()).hexdigest()
+
+    def stats(self) -> dict:
+        """Return the statistics to store in the metadata."""
+        self.finish()
+        return {
+            "reads": -(-self.nr_lines // FASTQ_RECORD_LINES),
+            "bases": sum(length * count for length, count in self.read_lengths.items()),
+            "read_lengths": {
+                str(length): count for length, count in sorted(self.read_lengths.items())
+            },
+            "digests": {field: hash_obj.hexdigest() for field, hash_obj in self.hash_objs.items()},
+        }
+
+
+def hash_fastq_records(chunk: bytes) -> Tuple[int, int]:
+    """Return the sum of the 128 bit hashes of the records in a chunk and the number of records.
+
+    A record is hashed from its header, sequence and quality lines, the separator line is left
+    out since tools differ in whether they repeat the header there.
+    """
+    lines = chunk.split(b"\n")
+    if lines[-1] == b"":
+        lines.pop()
+    total = 0
+    for header, sequence, quality in zip(lines[0::4], lines[1::4], lines[3::4]):
+        record_hash = hashlib.blake2b(
+            b"\n".join((header, sequence, quality)), digest_size=RECORD_HASH_BITS // 8
+        )
+        total += int.from_bytes(record_hash.digest(), "big")
+    return total % 2**RECORD_HASH_BITS, -(-len(lines) // FASTQ_RECORD_LINES)
+
+
+def hash_sam_records(chunk: bytes) -> Tuple[int, int]:
+    """Return the sum of the 128 bit hashes of the SAM records in a chunk and the number of records.
+
+    Each line is one record.
+    """
+    lines = chunk.split(b"\n")
+    if lines[-1] == b"":
+        lines.pop()
+    total = 0
+    for line in lines:
+        record_hash = hashlib.blake2b(line, digest_size=RECORD_HASH_BITS // 8)
+        total += int.from_bytes(record_hash.digest(), "big")
+    return total % 2**RECORD_HASH_BITS, len(lines)
+
+
+class FastqSetHasher:
+    """Order independent fingerprint of the records in uncompressed FASTQ content.
+
+    The fingerprint is the sum of the 128 bit hashes of all records together with the number of
+    records, so it does not change when records are reordered. The content is cut at record
+    boundaries into chunks of about chunk_size that are hashed in a pool of worker processes and
+    merged. Has the update and hexdigest methods of a hash object, the pool is only started for
+    content larger than one chunk. Subclasses set the lines per record and how they are hashed.
+    Use it as a context manager, or call close, so that the pool is shut down if hashing fails.
+    """
+
+    record_lines: int = FASTQ_RECORD_LINES
+    hash_records = staticmethod(hash_fastq_records)
+
+    def __init__(
+        self, workers: int = DEFAULT_FINGERPRINT_WORKERS, chunk_size: int = FINGERPRINT_CHUNK_SIZE
+    ):
+        self.workers: int = workers
+        self.chunk_size: int = chunk_size
+        self._futures: deque = deque()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.reset()
+
+    def reset(self):
+        """Forget all content fed so far."""
+        self._futures.clear()
+        self.total: int = 0
+        self.nr_records: int = 0
+        self._pending = bytearray()
+
+    def close(self):
+        """Shut down the pool of workers, chunks that are not hashed yet are dropped."""
+        self._futures.clear()
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def update(self, data):
+        """Feed more content, chunks do not have to end at a record."""
+        self._pending.extend(data)
+        if len(self._pending) < self.chunk_size:
+            return
+        cut = self._find_record_end()
+        if cut:
+            self._submit(bytes(self._pending[:cut]))
+            del self._pending[:cut]
+
+    def _find_record_end(self) -> int:
+        """Return the position after the last complete record in the pending content."""
+        nr_lines = self._pending.count(b"\n")
+        end = len(self._pending)
+        for _ in range(nr_lines % self.record_lines + 1):
+            end = self._pending.rfind(b"\n", 0, end)
+        return end + 1 if nr_lines >= self.record_lines else 0
+
+    def _submit(self, chunk: bytes):
+        if self.workers <= 1:
+            self._merge(self.hash_records(chunk))
+            return
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        self._futures.append(self._executor.submit(self.hash_records, chunk))
+        while len(self._futures) > 2 * self.workers:
+            self._merge(self._futures.popleft().result())
+
+    def _merge(self, result: Tuple[int, int]):
+        total, nr_records = result
+        self.total = (self.total + total) % 2**RECORD_HASH_BITS
+        self.nr_records += nr_records
+
+    def hexdigest(self) -> str:
+        """Hash the remaining content, wait for the workers and return the fingerprint."""
+        if self._pending:
+            self._merge(self.hash_records(bytes(self._pending)))
+            self._pending = bytearray()
+        try:
+            while self._futures:
+                self._merge(self._futures.popleft().result())
+        finally:
+            self.close()
+        return f"{self.total:032x}{self.nr_records:016x}"
+
+
+class SamSetHasher(FastqSetHasher):
+    """Order independent fingerprint of the records in SAM text, like FastqSetHasher."""
+
+    record_lines: int = 1
+    hash_records = staticmethod(hash_sam_records)
+
+
+def get_record_count(fingerprint: str) -> int:
+    """Return the number of records in a fingerprint from a FastqSetHasher or SamSetHasher."""
+    return int(fingerprint[-16:], 16)
+
+
+def compare_fastq_stats(expected: dict, found: dict) -> List[str]:
+    """Return a description of each way two FASTQ files differ according to their statistics."""
+    differences = [
+        f"number of {name} differ, {expected[name]} != {found[name]}"
+        for name in ["reads", "bases"]
+        if expected[name] != found[name]
+    ]
+    differences.extend(
+        f"{field} differ"
+        for field in FastqStats.FIELDS
+        if expected["digests"][field] != found["digests"][field]
+    )
+    return differences
+
 
 def compare_elements(elements: list) -> bool:
     """Check if all elements are the same."""
     return len(set(elements)) == 1
 
 
-def get_checksum(infile: Path, algorithm: str = "sha256") -> str:
-    """Get the checksum for a file."""
-    LOG.info(f"Create checksum for {infile}")
+def is_gzipped(infile: Path) -> bool:
+    """Check if a file should be unzipped before counting checksum."""
+    return infile.suffix in [".gz", ".gzip"]
+
+
+def is_regular_file(infile: Path) -> bool:
+    """Check if a path points to a regular file, i.e. not a pipe or a device."""
+    return stat.S_ISREG(os.stat(infile).st_mode)
+
+
+def get_hash_obj(
+    algorithm: str = "sha256", fingerprint_workers: int = DEFAULT_FINGERPRINT_WORKERS
+) -> "hashlib._HASH":
+    """Return a new hash object for the given algorithm.
+
+    fingerprint_workers is the number of processes for the fastq-set fingerprint.
+    """
     if algorithm == "sha1":
         LOG.info("Use sha1")
-        hash_obj = hashlib.sha1()
-    elif algorithm == "md5":
+        return hashlib.sha1()
+    if algorithm == "md5":
         LOG.info("Use md5")
-        hash_obj = hashlib.md5()
-    else:
-        LOG.info("Use sha256")
-        hash_obj = hashlib.sha256()
+        return hashlib.md5()
+    if algorithm == "fastq-set":
+        LOG.info("Use order independent FASTQ fingerprint")
+        return FastqSetHasher(workers=fingerprint_workers)
+    LOG.info("Use sha256")
+    return hashlib.sha256()
+
+
+def get_checksum(infile: Path, algorithm: str = "sha256", **checksum_kwargs) -> str:
+    """Get the checksum for a file."""
+    return get_checksums(infile, [algorithm], **checksum_kwargs)[algorithm]
+
 
-    content: Any = open(infile, "rb")
-    if infile.suffix in [".gz", ".gzip"]:
-        LOG.info("Unzip before counting checksum")
-        content = gzip.open(infile, "rb")
+def get_checksums(
+    infile: Path,
+    algorithms: Iterable[str],
+    cache: Optional[ChecksumCache] = None,
+    **read_kwargs,
+) -> Dict[str, str]:
+    """Get the checksums for a file with several algorithms, using a cache if one is given.
 
-    return generate_checksum(content, hash_obj)
+    Only checksums that are missing from the cache are created and then stored in it. Files that
+    are not regular files, like named pipes, are never cached. A file that changes while it is
+    hashed is not stored. The read_kwargs are passed on to create_checksums, the cache is not
+    used when there are consumers since they need to see the content.
 
+    Returns:
+        checksums(dict): The hex digest for each algorithm
+    """
+    algorithms = list(algorithms)
+    if cache is None or read_kwargs.get("consumers") or not is_regular_file(infile):
+        return create_checksums(infile, algorithms, **read_kwargs)
+
+    identity = get_file_identity(infile)
+    checksums = {}
+    for algorithm in algorithms:
+        cached_checksum = cache.get(identity, algorithm, infile)
+        if cached_checksum:
+            checksums[algorithm] = cached_checksum
+    missing = [algorithm for algorithm in algorithms if algorithm not in checksums]
+    if not missing:
+        return checksums
+
+    checksums.update(create_checksums(infile, missing, **read_kwargs))
+    if get_file_identity(infile) != identity:
+        LOG.warning(f"{infile} changed while creating checksum, it will not be cached")
+        return {algorithm: checksums[algorithm] for algorithm in algorithms}
+    for algorithm in missing:
+        cache.set(identity, algorithm, infile, checksums[algorithm])
+    return {algorithm: checksums[algorithm] for algorithm in algorithms}
+
+
+def create_checksums(
+    infile: Path,
+    algorithms: Iterable[str],
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    inflate_workers: int = DEFAULT_INFLATE_WORKERS,
+    inflate_backend: str = "auto",
+    consumers: Optional[List[Any]] = None,
+    fingerprint_workers: int = DEFAULT_FINGERPRINT_WORKERS,
+) -> Dict[str, str]:
+    """Create the checksums for a file with several algorithms in one pass.
+
+    Gzipped files are unzipped with inflate_backend before counting the checksums, BGZF files are
+    unzipped block by block in inflate_workers threads. Uncompressed regular files are memory
+    mapped, everything else is read into a reused buffer of size buffer_size. Each chunk is fed
+    to all hash objects so that the file is only read, and unzipped, once.
+
+    Consumers are extra objects with the same update and hexdigest methods as a hash object, like
+    a ChunkHasher. They are fed the same chunks but are not part of the returned checksums. They
+    also need a reset method, a BGZF file that turns out to have blocks that are not BGZF is read
+    again from the start.
+    """
+    LOG.info(f"Create checksum for {infile}")
+    algorithms = list(algorithms)
+    consumers = consumers or []
+    hash_objs = {
+        algorithm: get_hash_obj(algorithm, fingerprint_workers=fingerprint_workers)
+        for algorithm in algorithms
+    }
+    try:
+        hash_objs.update(
+            {f"consumer_{index}": consumer for index, consumer in enumerate(consumers)}
+        )
+        if is_gzipped(infile) and inflate_workers > 1 and is_bgzf(infile):
+            LOG.info(f"Unzip BGZF blocks in {inflate_workers} threads before counting checksum")
+            try:
+                checksums = update_checksums(
+                    iter_bgzf_inflated(
+                        infile,
+                        workers=inflate_workers,
+                        chunk_size=buffer_size,
+                        backend=inflate_backend,
+                    ),
+                    hash_objs,
+                )
+                return {algorithm: checksums[algorithm] for algorithm in algorithms}
+            except ValueError as error:
+                LOG.warning(f"Could not unzip {infile} block by block: {error}")
+                close_hash_objs(hash_objs)
+                for consumer in consumers:
+                    consumer.reset()
+                for algorithm in algorithms:
+                    hash_objs[algorithm] = get_hash_obj(
+                        algorithm, fingerprint_workers=fingerprint_workers
+                    )
 
-def generate_checksum(content: Any, hash_obj: "hashlib._HASH") -> str:
+        if is_gzipped(infile):
+            LOG.info("Unzip before counting checksum")
+            with open_gzipped(infile, backend=inflate_backend) as content:
+                checksums = generate_checksums(content, hash_objs, buffer_size=buffer_size)
+        elif is_regular_file(infile) and infile.stat().st_size > 0:
+            checksums = generate_mmap_checksums(infile, hash_objs, buffer_size=buffer_size)
+        else:
+            with open(infile, "rb") as content:
+                checksums = generate_checksums(content, hash_objs, buffer_size=buffer_size)
+        return {algorithm: checksums[algorithm] for algorithm in algorithms}
+    finally:
+        close_hash_objs({algorithm: hash_objs[algorithm] for algorithm in algorithms})
+
+
+def close_hash_objs(hash_objs: Dict[str, Any]):
+    """Shut down hash objects that run workers, like a FastqSetHasher."""
+    for hash_obj in hash_objs.values():
+        if hasattr(hash_obj, "close"):
+            hash_obj.close()
+
+
+def get_checksums_concurrently(
+    infiles: List[Path],
+    algorithms: Iterable[str],
+    workers: int = DEFAULT_WORKERS,
+    **checksum_kwargs,
+) -> List[Dict[str, str]]:
+    """Get the checksums for several files at the same time in a thread pool.
+
+    Hashing and unzipping of large buffers release the GIL so the files are processed in
+    parallel. The processes for fastq-set fingerprints are split between the files hashed at the
+    same time, unless fingerprint_workers is given.
+
+    Returns:
+        checksums(list): One dict with checksums per file, in the same order as infiles
+    """
+    algorithms = list(algorithms)
+    LOG.info(f"Create checksums for {len(infiles)} files using {workers} workers")
+    concurrent_files = max(min(workers, len(infiles)), 1)
+    checksum_kwargs.setdefault(
+        "fingerprint_workers", max(DEFAULT_FINGERPRINT_WORKERS // concurrent_files, 1)
+    )
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        return list(
+            executor.map(
+                lambda infile: get_checksums(infile, algorithms, **checksum_kwargs), infiles
+            )
+        )
+
+
+def generate_checksum(
+    content: Any, hash_obj: "hashlib._HASH", buffer_size: int = DEFAULT_BUFFER_SIZE
+) -> str:
     """Return the checksum of a file.
 
     Args:
-        content(iterable)
+        content(binary file object): Object that supports readinto
         hash_obj
+        buffer_size(int): Number of bytes to read per chunk
+    """
+    return generate_checksums(content, {"checksum": hash_obj}, buffer_size=buffer_size)["checksum"]
+
+
+def generate_checksums(
+    content: Any, hash_objs: Dict[str, "hashlib._HASH"], buffer_size: int = DEFAULT_BUFFER_SIZE
+) -> Dict[str, str]:
+    """Return the checksums of a file for all hash objects.
+
+    The content is read into one preallocated buffer that is reused for every chunk, this avoids
+    allocating a new bytes object per read.
+    """
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    while True:
+        nr_bytes = content.readinto(buffer)
+        if not nr_bytes:
+            break
+        for hash_obj in hash_objs.values():
+            hash_obj.update(view[:nr_bytes])
+    LOG.info("Checksum created")
+    return {name: hash_obj.hexdigest() for name, hash_obj in hash_objs.items()}
+
+
+def update_checksums(
+    chunks: Iterable[bytes], hash_objs: Dict[str, "hashlib._HASH"]
+) -> Dict[str, str]:
+    """Return the checksums of content that is given in consecutive chunks."""
+    for chunk in chunks:
+        for hash_obj in hash_objs.values():
+            hash_obj.update(chunk)
+    LOG.info("Checksum created")
+    return {name: hash_obj.hexdigest() for name, hash_obj in hash_objs.items()}
+
+
+def generate_mmap_checksums(
+    infile: Path, hash_objs: Dict[str, "hashlib._HASH"], buffer_size: int = DEFAULT_BUFFER_SIZE
+) -> Dict[str, str]:
+    """Return the checksums of an uncompressed file by memory mapping it.
+
+    The mapped file is fed to the hash objects in slices of buffer_size to let the kernel page
+    in and out the file while hashing.
     """
-    for chunk in iter(lambda: content.read(4096), b""):
-        hash_obj.update(chunk)
+    with open(infile, "rb") as content:
+        with mmap.mmap(content.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mapped)
+            try:
+                for start in range(0, len(mapped), buffer_size):
+                    chunk = view[start : start + buffer_size]
+                    for hash_obj in hash_objs.values():
+                        hash_obj.update(chunk)
+                    chunk.release()
+            finally:
+                view.release()
     LOG.info("Checksum created")
-    return hash_obj.hexdigest()
+    return {name: hash_obj.hexdigest() for name, hash_obj in hash_objs.items()}
+
+
+def get_bgzf_block_size(header: bytes) -> Optional[int]:
+    """Return the total size of a BGZF block from its gzip header.
+
+    The size is stored in the BC subfield of the extra field. None is returned if the header does
+    not belong to a BGZF block.
+    """
+    if len(header) < GZIP_HEADER_SIZE + 2 or header[:3] != GZIP_MAGIC or not header[3] & FEXTRA:
+        return None
+    extra_length = int.from_bytes(header[10:12], "little")
+    extra = header[12 : 12 + extra_length]
+    if len(extra) < extra_length:
+        return None
+    position = 0
+    while position + 4 <= len(extra):
+        subfield_length = int.from_bytes(extra[position + 2 : position + 4], "little")
+        if extra[position : position + 2] == b"BC" and subfield_length == 2:
+            return int.from_bytes(extra[position + 4 : position + 6], "little") + 1
+        position += 4 + subfield_length
+    return None
+
+
+def is_bgzf(infile: Path) -> bool:
+    """Check if a gzipped file is BGZF, i.e. consists of independent blocks with known sizes."""
+    with open(infile, "rb") as content:
+        return get_bgzf_block_size(content.read(BGZF_HEADER_SIZE)) is not None
+
+
+def iter_bgzf_chunks(content: Any, chunk_size: int = DEFAULT_BUFFER_SIZE) -> Iterator[tuple]:
+    """Split a BGZF file into chunks of whole blocks without unzipping it.
+
+    Yields:
+        tuples with the compressed chunk and the offsets where each block starts and ends
+    """
+    data = b""
+    while True:
+        new_data = content.read(chunk_size)
+        data += new_data
+        offsets = []
+        position = 0
+        while position < len(data):
+            block_size = get_bgzf_block_size(data[position : position + BGZF_HEADER_SIZE])
+            if block_size is None:
+                if len(data) - position < BGZF_HEADER_SIZE and new_data:
+                    break
+                raise ValueError(f"No BGZF block at offset {position} of chunk")
+            if position + block_size > len(data):
+                break
+            offsets.append((position, position + block_size))
+            position += block_size
+        if offsets:
+            yield data[:position], offsets
+        data = data[position:]
+        if not new_data:
+            if data:
+                raise ValueError("File ends with an incomplete BGZF block")
+            return
+
+
+def inflate_bgzf_blocks(data: bytes, offsets: List[tuple], zlib_module: Any = zlib) -> bytes:
+    """Unzip a chunk of BGZF blocks, the gzip trailer of each block is checked by zlib."""
+    view = memoryview(data)
+    return b"".join(
+        zlib_module.decompress(view[start:end], wbits=GZIP_WBITS) for start, end in offsets
+    )
+
+
+def iter_bgzf_inflated(
+    infile: Path,
+    workers: int = DEFAULT_INFLATE_WORKERS,
+    chunk_size: int = DEFAULT_BUFFER_SIZE,
+    backend: str = "auto",
+) -> Iterator[bytes]:
+    """Unzip a BGZF file in a thread pool and yield the unzipped chunks in order.
+
+    The blocks are unzipped with ISA-L if that is the chosen backend, otherwise with zlib. At most
+    two chunks per worker are kept in memory at the same time.
+    """
+    zlib_module = get_zlib_module(backend)
+    with open(infile, "rb") as content, ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for data, offsets in iter_bgzf_chunks(content, chunk_size=chunk_size):
+            pending.append(executor.submit(inflate_bgzf_blocks, data, offsets, zlib_module))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def get_available_inflate_backends() -> List[str]:
+    """Return the backends that can be used to unzip files, in order of preference.
+
+    zlib is always available. ISA-L is used if the isal python package is installed, igzip and
+    pigz if the binaries are found in PATH.
+    """
+    available = []
+    if importlib.util.find_spec("isal") is not None:
+        available.append("isal")
+    for backend, command in INFLATE_COMMANDS.items():
+        if shutil.which(command[0]):
+            available.append(backend)
+    available.append("zlib")
+    return available
+
+
+def resolve_inflate_backend(backend: str = "auto") -> str:
+    """Return the backend to use.
+
+    auto picks the fastest available backend that unzips in this process, the igzip and pigz
+    subprocesses are only used when they are asked for.
+    """
+    available = get_available_inflate_backends()
+    if backend == "auto":
+        backend = next(name for name in available if name in AUTO_INFLATE_BACKENDS)
+        LOG.info(f"Inflate backend auto uses {backend}")
+        return backend
+    if backend not in available:
+        LOG.warning(f"Inflate backend {backend} is not available, use zlib")
+        return "zlib"
+    return backend
+
+
+def get_zlib_module(backend: str = "auto") -> Any:
+    """Return a module with a zlib compatible decompress function for the backend."""
+    if resolve_inflate_backend(backend) == "isal":
+        from isal import isal_zlib  # pylint: disable=import-outside-toplevel
+
+        return isal_zlib
+    return zlib
+
+
+@contextmanager
+def open_gzipped(infile: Path, backend: str = "auto") -> Iterator[Any]:
+    """Open a gzipped file for reading the unzipped content with the chosen backend.
+
+    The igzip and pigz backends run as subprocesses that stream the unzipped content through a
+    pipe, it is an error if they exit with a non zero exit code. Their stderr goes to a temporary
+    file, so that a lot of error output can not block them while stdout is read. A subprocess
+    that is not read to the end is killed.
+
+    Yields:
+        a binary file object that supports read and readinto
+    """
+    backend = resolve_inflate_backend(backend)
+    LOG.info(f"Unzip {infile} with {backend}")
+    if backend == "zlib":
+        with gzip.open(infile, "rb") as content:
+            yield content
+        return
+    if backend == "isal":
+        from isal import igzip  # pylint: disable=import-outside-toplevel
+
+        with igzip.open(infile, "rb") as content:
+            yield content
+        return
+
+    command = INFLATE_COMMANDS[backend] + [str(infile)]
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file)
+        read_to_end = True
+        try:
+            yield process.stdout
+            if process.stdout.read(1):
+                LOG.info(f"Stop unzipping {infile} before the end")
+                read_to_end = False
+                process.kill()
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            process.stdout.close()
+            process.wait()
+        if read_to_end and process.returncode != 0:
+            stderr_file.seek(0)
+            LOG.critical(f"Call {command} exit with a non zero exit code")
+            LOG.critical(stderr_file.read().decode("utf-8", errors="replace").rstrip())
+            raise subprocess.CalledProcessError(process.returncode, command)
+
+
+@contextmanager
+def open_content(infile: Path, backend: str = "auto") -> Iterator[Any]:
+    """Open a file for reading its uncompressed content, gzipped files are unzipped."""
+    if is_gzipped(infile):
+        with open_gzipped(infile, backend=backend) as content:
+            yield content
+        return
+    with open(infile, "rb") as content:
+        yield content
+
+
+def read_into_full(content: Any, view: memoryview) -> int:
+    """Fill a buffer from a file object, pipes and unzipped streams may return short reads.
+
+    Returns:
+        the number of bytes read, less than the buffer size only at the end of the content
+    """
+    nr_bytes = 0
+    while nr_bytes < len(view):
+        nr_read = content.readinto(view[nr_bytes:])
+        if not nr_read:
+            break
+        nr_bytes += nr_read
+    return nr_bytes
+
+
+def find_first_difference(first: memoryview, second: memoryview) -> int:
+    """Return the index of the first differing byte of two equally long, differing buffers.
+
+    The range that holds the difference is halved with slice comparisons, which run in C, instead
+    of comparing byte by byte in python.
+    """
+    low, high = 0, len(first)
+    while high - low > 1:
+        middle = (low + high) // 2
+        if first[low:middle] == second[low:middle]:
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def compare_files(
+    first: Path,
+    second: Path,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    inflate_backend: str = "auto",
+) -> Optional[Difference]:
+    """Compare the uncompressed content of two files byte by byte.
+
+    Uncompressed regular files of different sizes differ without being read. Otherwise both files
+    are streamed in chunks of buffer_size and the comparison stops at the first differing chunk.
+
+    Returns:
+        None if the files are identical, otherwise where they first differ
+    """
+    if not (is_gzipped(first) or is_gzipped(second)) and is_regular_file(first):
+        first_size, second_size = first.stat().st_size, second.stat().st_size
+        if is_regular_file(second) and first_size != second_size:
+            LOG.info(f"Sizes differ, {first} has {first_size} and {second} {second_size} bytes")
+            return Difference(reason="size")
+
+    LOG.info(f"Compare {first} and {second} byte by byte")
+    first_buffer = bytearray(buffer_size)
+    first_view = memoryview(first_buffer)
+    second_view = memoryview(bytearray(buffer_size))
+    offset = 0
+    nr_lines = 0
+    with open_content(first, inflate_backend) as first_content:
+        with open_content(second, inflate_backend) as second_content:
+            while True:
+                first_bytes = read_into_full(first_content, first_view)
+                second_bytes = read_into_full(second_content, second_view)
+                nr_common = min(first_bytes, second_bytes)
+                if first_view[:nr_common] != second_view[:nr_common]:
+                    index = find_first_difference(first_view[:nr_common], second_view[:nr_common])
+                elif first_bytes != second_bytes:
+                    index = nr_common
+                elif first_bytes == 0:
+                    return None
+                else:
+                    nr_lines += first_buffer.count(b"\n", 0, first_bytes)
+                    offset += first_bytes
+                    continue
+                nr_lines += first_buffer.count(b"\n", 0, index)
+                return Difference(
+                    reason="content",
+                    offset=offset + index,
+                    record=nr_lines // FASTQ_RECORD_LINES + 1,
+                )
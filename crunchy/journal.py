@@ -0,0 +1,96 @@
+"""Code to keep a journal of how far each job of an auto run has come, to resume after a crash.
+
+The journal is an append-only JSON lines file. Each line is written with one write to a file
+opened for appending and synced to disk, so concurrent workers do not mix their lines and a crash
+can at most leave the last line unfinished. An unfinished line is ignored when the journal is read,
+and ended before the next line is appended. A stage that failed after it had finished, so that its
+output is gone, is recorded as failed and is done again when the run is resumed.
+"""
+
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple
+
+LOG = logging.getLogger(__name__)
+
+JOURNAL_NAME = "crunchy_journal.jsonl"
+SHARD_JOURNAL_NAME = "crunchy_journal.{index}of{count}.jsonl"
+STARTED = "started"
+FINISHED = "finished"
+FAILED = "failed"
+
+
+class JobState(NamedTuple):
+    """The stages a job has started and finished, and the outputs it has recorded."""
+
+    started: Tuple[str, ...] = ()
+    finished: Tuple[str, ...] = ()
+    outputs: Optional[dict] = None
+
+
+class Journal:
+    """An append-only journal of the stages that jobs have started and finished."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def record(self, name: str, stage: str, status: str = FINISHED, **outputs):
+        """Append that a job has started, finished or failed a stage, with any outputs to keep."""
+        entry = {"name": name, "stage": stage, "status": status, "time": time.time()}
+        if outputs:
+            entry["outputs"] = outputs
+        line = (json.dumps(entry) + "\n").encode()
+        file_descriptor = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            size = os.fstat(file_descriptor).st_size
+            if size and os.pread(file_descriptor, 1, size - 1) != b"\n":
+                # End a line that a crash left unfinished, or this line would be lost with it
+                line = b"\n" + line
+            os.write(file_descriptor, line)
+            os.fsync(file_descriptor)
+        finally:
+            os.close(file_descriptor)
+
+    def reset(self):
+        """Start a new journal, the entries of an earlier run are removed."""
+        if self.path.exists():
+            LOG.info(f"Starting a new journal {self.path}")
+            self.path.unlink()
+
+    def read(self) -> Dict[str, JobState]:
+        """Return the state of each job in the journal, empty if there is no journal."""
+        states: Dict[str, JobState] = {}
+        if not self.path.exists():
+            return states
+        with open(self.path, "r") as journal_file:
+            for line_number, line in enumerate(journal_file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    LOG.warning(f"Ignoring unfinished line {line_number} in {self.path}")
+                    continue
+                state = states.get(entry["name"], JobState())
+                if entry["status"] == STARTED:
+                    state = state._replace(started=(*state.started, entry["stage"]))
+                elif entry["status"] == FAILED:
+                    state = state._replace(
+                        started=tuple(stage for stage in state.started if stage != entry["stage"]),
+                        finished=tuple(
+                            stage for stage in state.finished if stage != entry["stage"]
+                        ),
+                    )
+                else:
+                    state = state._replace(finished=(*state.finished, entry["stage"]))
+                if "outputs" in entry:
+                    state = state._replace(outputs={**(state.outputs or {}), **entry["outputs"]})
+                states[entry["name"]] = state
+        LOG.info(f"Read the state of {len(states)} jobs from {self.path}")
+        return states
+
+    def __repr__(self) -> str:
+        return f"Journal:path:{self.path}"
@@ -0,0 +1,315 @@
+"""Code to create and verify chunked checksum manifests.
+
+A manifest holds the checksums of fixed size chunks of the uncompressed content of a file and a
+merkle root over those checksums. The chunks can be verified independently, in parallel and
+resumed after an interruption.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from crunchy.cache import get_file_identity
+from crunchy.integrity import (
+    DEFAULT_BUFFER_SIZE,
+    DEFAULT_WORKERS,
+    MEBIBYTE,
+    FastqStats,
+    compare_fastq_stats,
+    get_checksums,
+    is_gzipped,
+)
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 64 * MEBIBYTE
+MANIFEST_ALGORITHM = "sha256"
+PROGRESS_INTERVAL = 10
+
+
+def merkle_root(digests: Iterable[str], algorithm: str = MANIFEST_ALGORITHM) -> str:
+    """Return the root of a merkle tree with the chunk digests as leaves.
+
+    Pairs of nodes are hashed together level by level, a node without a pair is hashed alone.
+    """
+    level = [bytes.fromhex(digest) for digest in digests]
+    if not level:
+        return hashlib.new(algorithm).hexdigest()
+    while len(level) > 1:
+        level = [
+            hashlib.new(algorithm, b"".join(level[index : index + 2])).digest()
+            for index in range(0, len(level), 2)
+        ]
+    return level[0].hex()
+
+
+class ChunkHasher:
+    """Hash content in chunks of chunk_size bytes.
+
+    Has the update and hexdigest methods of a hash object so that it can be fed the content
+    together with the whole file checksums. Chunks with an index in skip are not hashed, their
+    digest is None. on_chunk is called with the index and digest of each finished chunk.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        algorithm: str = MANIFEST_ALGORITHM,
+        skip: Optional[Set[int]] = None,
+        on_chunk: Optional[Callable[[int, Optional[str]], None]] = None,
+    ):
+        self.chunk_size: int = chunk_size
+        self.algorithm: str = algorithm
+        self.skip: Set[int] = skip or set()
+        self.on_chunk = on_chunk
+        self.reset()
+
+    def reset(self):
+        """Forget all content fed so far, chunks are reported to on_chunk again when refed."""
+        self.digests: List[Optional[str]] = []
+        self.size: int = 0
+        self._chunk_filled: int = 0
+        self._hash_obj = self._new_chunk_hash()
+
+    def _new_chunk_hash(self):
+        if len(self.digests) in self.skip:
+            return None
+        return hashlib.new(self.algorithm)
+
+    def update(self, data):
+        """Feed more content, the chunk boundaries do not have to match the data."""
+        view = memoryview(data)
+        while len(view):
+            nr_bytes = min(self.chunk_size - self._chunk_filled, len(view))
+            if self._hash_obj is not None:
+                self._hash_obj.update(view[:nr_bytes])
+            self._chunk_filled += nr_bytes
+            self.size += nr_bytes
+            view = view[nr_bytes:]
+            if self._chunk_filled == self.chunk_size:
+                self._finish_chunk()
+
+    def _finish_chunk(self):
+        digest = self._hash_obj.hexdigest() if self._hash_obj is not None else None
+        self.digests.append(digest)
+        if self.on_chunk:
+            self.on_chunk(len(self.digests) - 1, digest)
+        self._chunk_filled = 0
+        self._hash_obj = self._new_chunk_hash()
+
+    def finish(self):
+        """Finish the last, partial, chunk. Call when all content has been fed."""
+        if self._chunk_filled:
+            self._finish_chunk()
+
+    def hexdigest(self) -> str:
+        """Finish the last chunk and return the merkle root of all chunks."""
+        self.finish()
+        return merkle_root(self.digests, self.algorithm)
+
+    def manifest(self) -> dict:
+        """Return the manifest to store in the metadata."""
+        return {
+            "algorithm": self.algorithm,
+            "chunk_size": self.chunk_size,
+            "size": self.size,
+            "chunks": self.digests,
+            "root": self.hexdigest(),
+        }
+
+
+def get_progress_path(infile: Path) -> Path:
+    """Return the path to the file where verified chunks are stored for a file."""
+    return infile.with_name(infile.name + ".verify.json")
+
+
+def read_progress(progress_path: Path, infile: Path, manifest: dict) -> Set[int]:
+    """Return the chunks that were verified before for this version of the file."""
+    if not progress_path.exists():
+        return set()
+    with open(progress_path, "r") as progress_file:
+        progress = json.load(progress_file)
+    if progress.get("root") != manifest["root"] or progress.get("identity") != list(
+        get_file_identity(infile)
+    ):
+        LOG.info(f"Ignoring outdated progress in {progress_path}")
+        return set()
+    LOG.info(f"Resume verification of {infile}, {len(progress['verified'])} chunks are verified")
+    return set(progress["verified"])
+
+
+def write_progress(progress_path: Path, infile: Path, manifest: dict, verified: Set[int]):
+    """Store the verified chunks, the file is replaced atomically."""
+    progress = {
+        "root": manifest["root"],
+        "identity": list(get_file_identity(infile)),
+        "verified": sorted(verified),
+    }
+    tmp_path = progress_path.with_name(progress_path.name + ".tmp")
+    with open(tmp_path, "w") as progress_file:
+        json.dump(progress, progress_file)
+    os.replace(tmp_path, progress_path)
+
+
+def hash_file_range(
+    infile: Path,
+    start: int,
+    length: int,
+    algorithm: str = MANIFEST_ALGORITHM,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+) -> str:
+    """Return the checksum of a byte range of an uncompressed file."""
+    hash_obj = hashlib.new(algorithm)
+    file_descriptor = os.open(infile, os.O_RDONLY)
+    try:
+        position = start
+        end = start + length
+        while position < end:
+            data = os.pread(file_descriptor, min(buffer_size, end - position), position)
+            if not data:
+                break
+            hash_obj.update(data)
+            position += len(data)
+    finally:
+        os.close(file_descriptor)
+    return hash_obj.hexdigest()
+
+
+def verify_manifest(
+    infile: Path,
+    manifest: dict,
+    workers: int = DEFAULT_WORKERS,
+    progress_path: Optional[Path] = None,
+    **read_kwargs,
+) -> List[int]:
+    """Verify a file against a manifest, chunk by chunk.
+
+    Chunks of uncompressed files are read and hashed in parallel. Gzipped files have to be
+    unzipped in order, chunks that were verified before are then unzipped but not hashed. If a
+    progress_path is given the verified chunks are stored there every PROGRESS_INTERVAL seconds
+    and when chunks differ, so that an interrupted verification continues where it stopped.
+
+    Returns:
+        indexes of the chunks that differ from the manifest, empty if the file is identical
+    """
+    if merkle_root(manifest["chunks"], manifest["algorithm"]) != manifest["root"]:
+        raise ValueError(f"Manifest for {infile} does not match its root checksum")
+
+    expected: List[str] = manifest["chunks"]
+    verified: Set[int] = read_progress(progress_path, infile, manifest) if progress_path else set()
+    mismatches: Set[int] = set()
+    last_written = [time.monotonic()]
+
+    def check_chunk(index: int, digest: Optional[str]):
+        if digest is None:
+            return
+        if index < len(expected) and digest == expected[index]:
+            verified.add(index)
+            if progress_path and time.monotonic() - last_written[0] > PROGRESS_INTERVAL:
+                write_progress(progress_path, infile, manifest, verified)
+                last_written[0] = time.monotonic()
+            return
+        LOG.warning(f"Chunk {index} of {infile} differs from the manifest")
+        mismatches.add(index)
+
+    if is_gzipped(infile):
+        hasher = ChunkHasher(
+            chunk_size=manifest["chunk_size"],
+            algorithm=manifest["algorithm"],
+            skip=set(verified),
+            on_chunk=check_chunk,
+        )
+        get_checksums(infile, [], consumers=[hasher], **read_kwargs)
+        hasher.finish()
+        nr_chunks = len(hasher.digests)
+    else:
+        size = infile.stat().st_size
+        chunk_size = manifest["chunk_size"]
+        nr_chunks = -(-size // chunk_size)
+        todo = [index for index in range(nr_chunks) if index not in verified]
+        LOG.info(f"Verify {len(todo)} chunks of {infile} using {workers} workers")
+        buffer_size = read_kwargs.get("buffer_size", DEFAULT_BUFFER_SIZE)
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            futures = {
+                executor.submit(
+                    hash_file_range,
+                    infile,
+                    index * chunk_size,
+                    chunk_size,
+                    manifest["algorithm"],
+                    buffer_size,
+                ): index
+                for index in todo
+            }
+            for future in as_completed(futures):
+                check_chunk(futures[future], future.result())
+
+    mismatches.update(range(min(nr_chunks, len(expected)), max(nr_chunks, len(expected))))
+    if progress_path and mismatches:
+        write_progress(progress_path, infile, manifest, verified)
+    elif progress_path and progress_path.exists():
+        progress_path.unlink()
+    return sorted(mismatches)
+
+
+def get_manifests(metadata: list) -> Dict[str, dict]:
+    """Return the manifests in spring metadata, by file tag."""
+    return {
+        file_info["file"]: file_info["chunks"] for file_info in metadata if "chunks" in file_info
+    }
+
+
+def verify_spring_reads(
+    metadata: list,
+    first_read: Path,
+    second_read: Path,
+    workers: int = DEFAULT_WORKERS,
+    resume: bool = False,
+    **read_kwargs,
+) -> bool:
+    """Verify decompressed reads against the spring metadata they were compressed with.
+
+    Reads with a manifest are verified chunk by chunk, the first differing chunk is logged. Reads
+    from metadata without manifests are compared to their whole file checksum. If the metadata
+    has FASTQ statistics it is logged whether headers, sequences or qualities differ.
+    """
+    reads = {"first_read": first_read, "second_read": second_read}
+    success = True
+    for file_info in metadata:
+        infile = reads.get(file_info["file"])
+        if infile is None:
+            continue
+        manifest = file_info.get("chunks")
+        stats = FastqStats() if "stats" in file_info else None
+        if manifest is None:
+            LOG.info(f"No manifest for {file_info['file']}, compare whole file checksum")
+            algorithm = file_info["algorithm"]
+            consumers = [stats] if stats else None
+            checksums = get_checksums(infile, [algorithm], consumers=consumers, **read_kwargs)
+            if checksums[algorithm] == file_info["checksum"]:
+                continue
+            LOG.warning(f"Checksum for {infile} is NOT the same as in the metadata")
+        else:
+            progress_path = get_progress_path(infile) if resume else None
+            mismatches = verify_manifest(
+                infile, manifest, workers=workers, progress_path=progress_path, **read_kwargs
+            )
+            if not mismatches:
+                continue
+            first_offset = mismatches[0] * manifest["chunk_size"]
+            LOG.warning(
+                f"{infile} differs in {len(mismatches)} of {len(manifest['chunks'])} chunks, "
+                f"first difference in chunk {mismatches[0]} at byte {first_offset}"
+            )
+            if stats:
+                get_checksums(infile, [], consumers=[stats], **read_kwargs)
+        success = False
+        if stats:
+            for difference in compare_fastq_stats(file_info["stats"], stats.stats()):
+                LOG.warning(f"{infile}: {difference}")
+    return success
@@ -2,38 +2,99 @@
 
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import List, Optional, Union
 
-from crunchy.integrity import get_checksum
+from crunchy.command import ProcessResult
+from crunchy.integrity import DEFAULT_WORKERS, FastqStats, get_checksums
+from crunchy.manifest import ChunkHasher
+from crunchy.profiles import CramProfile
 
 LOG = logging.getLogger(__name__)
 
 
-def get_fastq_info(fastq: Path, tag: str, algorithm) -> dict:
-    """Get the necessary information about a fastq file and return it in a dict"""
+def get_fastq_info(
+    fastq: Path,
+    tag: str,
+    algorithm: Union[str, List[str]],
+    chunk_size: Optional[int] = None,
+    fastq_stats: bool = False,
+    **checksum_kwargs,
+) -> dict:
+    """Get the necessary information about a fastq file and return it in a dict
+
+    If several algorithms are given all checksums are created in one pass over the file. The
+    first algorithm is the one stored under "checksum" and "algorithm". With a chunk_size a
+    manifest of chunk checksums is created in the same pass and stored under "chunks". With
+    fastq_stats the number of reads and bases, the read length histogram and checksums of the
+    headers, sequences and qualities are stored under "stats".
+    """
+    algorithms = [algorithm] if isinstance(algorithm, str) else list(algorithm)
+    chunk_hasher = ChunkHasher(chunk_size=chunk_size) if chunk_size else None
+    stats = FastqStats() if fastq_stats else None
+    consumers = [consumer for consumer in [chunk_hasher, stats] if consumer]
+    if consumers:
+        checksum_kwargs["consumers"] = consumers
+    checksums = get_checksums(infile=fastq, algorithms=algorithms, **checksum_kwargs)
     fastq_info = {"file": tag}
-    fastq_info["checksum"] = get_checksum(infile=fastq, algorithm=algorithm)
+    fastq_info["checksum"] = checksums[algorithms[0]]
     fastq_info["path"] = str(fastq.absolute())
-    fastq_info["algorithm"] = algorithm
+    fastq_info["algorithm"] = algorithms[0]
+    fastq_info["checksums"] = checksums
+    if chunk_hasher:
+        fastq_info["chunks"] = chunk_hasher.manifest()
+    if stats:
+        fastq_info["stats"] = stats.stats()
 
     return fastq_info
 
 
 def fetch_spring_metadata(
-    first_read: Path, second_read: Path, spring: Path, algorithm: str = "sha256"
+    first_read: Path,
+    second_read: Path,
+    spring: Path,
+    algorithm: Union[str, List[str]] = "sha256",
+    workers: int = DEFAULT_WORKERS,
+    chunk_size: Optional[int] = None,
+    fastq_stats: bool = False,
+    **checksum_kwargs,
 ) -> list:
     """Create metadata for a spring archive
 
-    This means that for each file the original paths and checksums are stored in a dict.
+    This means that for each file the original paths and checksums are stored in a dict. The
+    reads are hashed concurrently when more than one worker is used.
     """
-    metadata = []
-    metadata.append(get_fastq_info(first_read, "first_read", algorithm))
-    metadata.append(get_fastq_info(second_read, "second_read", algorithm))
+    reads = [(first_read, "first_read"), (second_read, "second_read")]
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        metadata = list(
+            executor.map(
+                lambda read: get_fastq_info(
+                    read[0],
+                    read[1],
+                    algorithm,
+                    chunk_size=chunk_size,
+                    fastq_stats=fastq_stats,
+                    **checksum_kwargs,
+                ),
+                reads,
+            )
+        )
     metadata.append({"path": str(spring.absolute()), "file": "spring"})
 
     return metadata
 
 
+def add_resource_usage(metadata: list, tag: str, result: Optional[ProcessResult]):
+    """Add the resources used by the command that created a file to its metadata."""
+    if result is None or result.resources is None:
+        LOG.warning(f"No resource usage was recorded for {tag}")
+        return
+    for file_info in metadata:
+        if file_info["file"] == tag:
+            file_info["resources"] = result.resources._asdict()
+
+
 def dump_spring_metadata(metadata: list) -> Path:
     """Write spring metadata to json file
 
@@ -42,13 +103,43 @@ def dump_spring_metadata(metadata: list) -> Path:
     Returns:
         metadata_path
     """
-    spring_path = None
+    return dump_metadata(metadata, "spring")
+
+
+def fetch_cram_metadata(bam_path: Path, cram_path: Path, profile: CramProfile) -> list:
+    """Create metadata for a CRAM file
+
+    The original BAM path and size are stored together with the CRAM and the profile it was
+    written with.
+    """
+    return [
+        {"file": "bam", "path": str(bam_path.absolute()), "size": bam_path.stat().st_size},
+        {
+            "file": "cram",
+            "path": str(cram_path.absolute()),
+            "profile": profile._asdict(),
+        },
+    ]
+
+
+def dump_cram_metadata(metadata: list) -> Path:
+    """Write CRAM metadata to a json file with the path of the CRAM file and suffix .json"""
+    return dump_metadata(metadata, "cram")
+
+
+def dump_metadata(metadata: list, tag: str) -> Path:
+    """Write metadata to a json file next to the file with the given tag
+
+    Returns:
+        metadata_path
+    """
+    outfile_path = None
     for file_info in metadata:
-        if file_info["file"] == "spring":
-            spring_path = Path(file_info["path"])
+        if file_info["file"] == tag:
+            outfile_path = Path(file_info["path"])
 
-    metadata_path = spring_path.with_suffix(".json")
+    metadata_path = outfile_path.with_suffix(".json")
     with open(metadata_path, "w") as out:
-        LOG.info("Dumping spring metadata to %s", metadata_path)
+        LOG.info("Dumping %s metadata to %s", tag, metadata_path)
         json.dump(metadata, out, indent=2)
     return metadata_path
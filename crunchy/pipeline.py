@@ -0,0 +1,238 @@
+"""Code to run jobs through stages, connected by bounded queues, so that the stages overlap.
+
+While one job is in a CPU bound stage the next can be in an I/O bound stage. Each stage has its
+own worker threads, the stages call external programs or hash files which release the GIL.
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from crunchy.scheduler import JobResult
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_DEPTH = 2
+_DONE = object()
+
+
+class StageReport(NamedTuple):
+    """What a stage did, and how long its workers worked, waited for jobs and were blocked."""
+
+    name: str
+    workers: int
+    processed: int
+    failed: int
+    busy_seconds: float
+    idle_seconds: float
+    blocked_seconds: float
+    queue_depth: int
+    queue_peak: int
+
+
+class Stage:
+    """A step that each job goes through, function takes a job and returns it for the next stage.
+
+    A job fails in a stage if function raises, it then does not go on to the next stage.
+    """
+
+    def __init__(self, name: str, function: Callable[[Any], Any], workers: int = 1):
+        self.name: str = name
+        self.function: Callable[[Any], Any] = function
+        self.workers: int = workers
+        self.processed: int = 0
+        self.failed: int = 0
+        self.busy_seconds: float = 0.0
+        self.idle_seconds: float = 0.0
+        self.blocked_seconds: float = 0.0
+        self.queue_peak: int = 0
+        self._lock = threading.Lock()
+
+    def add(self, **seconds: float):
+        """Add to the counters of the stage from one of its workers."""
+        with self._lock:
+            for name, value in seconds.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def record_queue_size(self, size: int):
+        """Keep the largest number of jobs that have been waiting in front of the stage."""
+        with self._lock:
+            self.queue_peak = max(self.queue_peak, size)
+
+    def report(self, queue_depth: int) -> StageReport:
+        """Return what the stage did."""
+        return StageReport(
+            name=self.name,
+            workers=self.workers,
+            processed=self.processed,
+            failed=self.failed,
+            busy_seconds=self.busy_seconds,
+            idle_seconds=self.idle_seconds,
+            blocked_seconds=self.blocked_seconds,
+            queue_depth=queue_depth,
+            queue_peak=self.queue_peak,
+        )
+
+
+class Pipeline:
+    """Run jobs through stages, with a bounded queue in front of each stage.
+
+    Jobs are read from the source, the discover stage, only as fast as the first stage can take
+    them. A worker that can not hand a job to a full queue is blocked, which is reported so that
+    the stage that holds the others back can be given more workers.
+    """
+
+    def __init__(self, stages: List[Stage], queue_depth: int = DEFAULT_QUEUE_DEPTH):
+        self.stages: List[Stage] = stages
+        self.queue_depth: int = queue_depth
+        self.discover = Stage("discover", lambda job: job)
+        self._queues: List[queue.Queue] = [queue.Queue(maxsize=queue_depth) for _ in stages]
+        self._results: Dict[int, JobResult] = {}
+        self._errors: List[BaseException] = []
+        self._lock = threading.Lock()
+        self._remaining: List[int] = []
+        self._done_received: List[int] = []
+
+    def _put(self, stage: Stage, position: int, entry: Any):
+        """Hand a job to the stage at position, blocking while its queue is full."""
+        start = time.monotonic()
+        self._queues[position].put(entry)
+        stage.add(blocked_seconds=time.monotonic() - start)
+        self.stages[position].record_queue_size(self._queues[position].qsize())
+
+    def _finish(self, index: int, name: str, started: float, error: Optional[str] = None):
+        with self._lock:
+            self._results[index] = JobResult(name, error is None, time.monotonic() - started, error)
+
+    def _discover(self, jobs: Iterable[Tuple[str, Any]], names: List[str]):
+        try:
+            for name, job in jobs:
+                names.append(name)
+                self.discover.add(processed=1)
+                self._put(self.discover, 0, (len(names) - 1, name, job, time.monotonic()))
+        except BaseException as error:  # pylint: disable=broad-except
+            LOG.error(f"Finding jobs failed: {error!r}")
+            with self._lock:
+                self._errors.append(error)
+        finally:
+            for _ in range(self.stages[0].workers):
+                self._queues[0].put(_DONE)
+
+    def _get(self, position: int) -> Any:
+        """Take the next entry for the stage at position, count the end markers."""
+        start = time.monotonic()
+        entry = self._queues[position].get()
+        self.stages[position].add(idle_seconds=time.monotonic() - start)
+        if entry is _DONE:
+            with self._lock:
+                self._done_received[position] += 1
+        return entry
+
+    def _process(self, position: int):
+        """Run the function of a stage for jobs until the end marker is taken."""
+        stage = self.stages[position]
+        is_last = position == len(self.stages) - 1
+        while True:
+            entry = self._get(position)
+            if entry is _DONE:
+                return
+            index, name, job, started = entry
+            start = time.monotonic()
+            try:
+                job = stage.function(job)
+            except Exception as error:  # pylint: disable=broad-except
+                LOG.warning(f"{name} failed in stage {stage.name}: {error!r}")
+                stage.add(busy_seconds=time.monotonic() - start, failed=1)
+                self._finish(
+                    index, name, started, f"{stage.name}: {str(error) or type(error).__name__}"
+                )
+                continue
+            except BaseException as error:
+                stage.add(busy_seconds=time.monotonic() - start, failed=1)
+                self._finish(index, name, started, f"{stage.name}: {error!r}")
+                raise
+            stage.add(busy_seconds=time.monotonic() - start, processed=1)
+            if is_last:
+                self._finish(index, name, started)
+            else:
+                self._put(stage, position + 1, (index, name, job, started))
+
+    def _drain(self, position: int):
+        """Fail the jobs left for a stage whose workers have all stopped.
+
+        Jobs are taken until the stage before has sent all its end markers, so that it is never
+        blocked on a full queue.
+        """
+        stage = self.stages[position]
+        while self._done_received[position] < stage.workers:
+            entry = self._get(position)
+            if entry is _DONE:
+                continue
+            index, name, _, started = entry
+            stage.add(failed=1)
+            self._finish(index, name, started, f"{stage.name}: no workers left")
+
+    def _work(self, position: int):
+        """Run a worker of a stage, the stage after always gets its end markers."""
+        finished = False
+        try:
+            self._process(position)
+            finished = True
+        except BaseException as error:  # pylint: disable=broad-except
+            LOG.error(f"Worker of stage {self.stages[position].name} stopped: {error!r}")
+            with self._lock:
+                self._errors.append(error)
+        finally:
+            with self._lock:
+                self._remaining[position] -= 1
+                last_worker = self._remaining[position] == 0
+            if last_worker:
+                if not finished:
+                    self._drain(position)
+                if position < len(self.stages) - 1:
+                    for _ in range(self.stages[position + 1].workers):
+                        self._queues[position + 1].put(_DONE)
+
+    def run(self, jobs: Iterable[Tuple[str, Any]]) -> List[JobResult]:
+        """Run named jobs through all stages.
+
+        An error while finding the jobs, or one that stops a worker, is raised when all workers
+        are done.
+
+        Returns:
+            the result of each job, in the order they were discovered
+        """
+        names: List[str] = []
+        self._remaining = [stage.workers for stage in self.stages]
+        self._done_received = [0 for _ in self.stages]
+        threads = [threading.Thread(target=self._discover, args=(jobs, names))]
+        for position, stage in enumerate(self.stages):
+            LOG.info(f"Stage {stage.name} has {stage.workers} workers")
+            threads.extend(
+                threading.Thread(target=self._work, args=(position,)) for _ in range(stage.workers)
+            )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
+        return [self._results[index] for index in range(len(names))]
+
+    def reports(self) -> List[StageReport]:
+        """Return what each stage did, starting with the discovery of jobs."""
+        return [stage.report(self.queue_depth) for stage in [self.discover, *self.stages]]
+
+
+def log_reports(reports: List[StageReport]):
+    """Log what each stage of a pipeline did."""
+    for report in reports:
+        LOG.info(
+            f"Stage {report.name}: {report.workers} workers, {report.processed} done, "
+            f"{report.failed} failed, busy {report.busy_seconds:.1f} s, "
+            f"waiting for jobs {report.idle_seconds:.1f} s, "
+            f"blocked by next stage {report.blocked_seconds:.1f} s, "
+            f"queue peak {report.queue_peak} of {report.queue_depth}"
+        )
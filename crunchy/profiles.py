@@ -0,0 +1,99 @@
+"""CRAM compression profiles, trading compression speed for size."""
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+CRAM_PRESETS = ("fast", "normal", "small", "archive")
+CRAM_CODECS = ("use_bzip2", "use_lzma", "use_rans", "use_tok", "use_fqz", "use_arith")
+
+
+class CramProfile(NamedTuple):
+    """How samtools should write a CRAM file.
+
+    The fields are written as CRAM output format options. profile is one of the samtools preset
+    keywords fast, normal, small or archive that the other fields refine, codecs are extra codec
+    options like use_bzip2 or use_lzma. embed_ref stores the reference in the CRAM file, so that
+    it can be decoded without the reference.
+    """
+
+    name: str
+    version: Optional[str] = None
+    profile: Optional[str] = None
+    level: Optional[int] = None
+    codecs: Tuple[str, ...] = ()
+    seqs_per_slice: Optional[int] = None
+    embed_ref: bool = False
+
+    def output_format(self) -> Optional[str]:
+        """Return the samtools --output-fmt value, None for the samtools defaults."""
+        options = []
+        if self.version:
+            options.append(f"version={self.version}")
+        if self.profile:
+            options.append(self.profile)
+        if self.level is not None:
+            options.append(f"level={self.level}")
+        options.extend(self.codecs)
+        if self.seqs_per_slice:
+            options.append(f"seqs_per_slice={self.seqs_per_slice}")
+        if self.embed_ref:
+            options.append("embed_ref=1")
+        if not options:
+            return None
+        return ",".join(["cram"] + options)
+
+    def with_options(self, options: Iterable[str]) -> "CramProfile":
+        """Return the profile with options given as KEY=VALUE changed.
+
+        The keys are version, profile, level, seqs_per_slice, embed_ref and the codecs, a codec is
+        used with use_lzma=1 and not used with use_lzma=0.
+        """
+        profile = self
+        for option in options:
+            key, _, value = option.partition("=")
+            if key in ("version", "profile", "level", "seqs_per_slice") and not value:
+                raise ValueError(f"Missing value in CRAM option {option}")
+            if key == "version":
+                profile = profile._replace(version=value)
+            elif key == "profile":
+                if value not in CRAM_PRESETS:
+                    raise ValueError(f"Unknown CRAM preset {value}, use one of {CRAM_PRESETS}")
+                profile = profile._replace(profile=value)
+            elif key in ("level", "seqs_per_slice"):
+                if not value.isdigit():
+                    raise ValueError(f"CRAM option {key} has to be a number, not {value}")
+                profile = profile._replace(**{key: int(value)})
+            elif key == "embed_ref" and value in ("0", "1"):
+                profile = profile._replace(embed_ref=value == "1")
+            elif key in CRAM_CODECS and value in ("0", "1"):
+                codecs = tuple(codec for codec in profile.codecs if codec != key)
+                profile = profile._replace(codecs=codecs + ((key,) if value == "1" else ()))
+            else:
+                raise ValueError(f"Invalid CRAM option {option}")
+        return profile
+
+    def view_parameters(self) -> List[str]:
+        """Return the samtools view parameters that select CRAM output with this profile."""
+        output_format = self.output_format()
+        if output_format is None:
+            return ["-C"]
+        return ["--output-fmt", output_format]
+
+
+DEFAULT_CRAM_PROFILE = "default"
+CRAM_PROFILES: Dict[str, CramProfile] = {
+    profile.name: profile
+    for profile in [
+        CramProfile(name="default"),
+        CramProfile(name="fast", version="3.0", profile="fast", level=1),
+        CramProfile(name="normal", version="3.0", profile="normal"),
+        CramProfile(name="small", version="3.1", profile="small", codecs=("use_bzip2",)),
+        CramProfile(
+            name="archive",
+            version="3.1",
+            profile="archive",
+            level=9,
+            codecs=("use_bzip2", "use_lzma"),
+            seqs_per_slice=100000,
+        ),
+    ]
+}
@@ -0,0 +1,258 @@
+"""Code to manage a local MD5 cache of reference sequences for samtools.
+
+samtools finds the reference sequences of a CRAM file by the MD5 checksums in its header, in the
+directories of REF_PATH, and stores sequences that it had to fetch in REF_CACHE. The cache is
+filled from the FASTA reference once and is then shared by all samtools processes and crunchy runs
+that use the same cache directory. Without a local cache samtools may try to download missing
+sequences from the EBI reference server, which stalls or fails on compute nodes.
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from crunchy.cache import get_file_identity
+from crunchy.integrity import is_gzipped
+
+LOG = logging.getLogger(__name__)
+
+REF_CACHE_PATTERN = "%2s/%2s/%s"
+LOCK_NAME = ".lock"
+MARKER_DIR = ".references"
+
+
+class FastaSequence(NamedTuple):
+    """A sequence of a FASTA file, with the fields of its line in the .fai index."""
+
+    name: str
+    length: int
+    offset: int
+    line_bases: int
+    line_width: int
+    md5: str
+
+    def fai_line(self) -> str:
+        """Return the line of the sequence in a .fai index."""
+        return f"{self.name}\t{self.length}\t{self.offset}\t{self.line_bases}\t{self.line_width}\n"
+
+
+def get_fai_path(reference: Path) -> Path:
+    """Return the path to the samtools index of a FASTA file."""
+    return reference.with_name(reference.name + ".fai")
+
+
+def get_cache_path(cache_dir: Path, md5: str) -> Path:
+    """Return where samtools looks for a sequence in a cache, see REF_CACHE_PATTERN."""
+    return Path(cache_dir, md5[:2], md5[2:4], md5[4:])
+
+
+class _SequenceWriter:
+    """Collect one FASTA sequence, its checksum and its index fields while it is read."""
+
+    def __init__(self, name: str, offset: int, cache_dir: Optional[Path]):
+        self.name: str = name
+        self.offset: int = offset
+        self.cache_dir: Optional[Path] = cache_dir
+        self.length: int = 0
+        self.line_bases: int = 0
+        self.line_width: int = 0
+        self._md5 = hashlib.md5()
+        self._tmp_file = (
+            tempfile.NamedTemporaryFile(dir=cache_dir, prefix=".tmp_", delete=False)
+            if cache_dir
+            else None
+        )
+
+    def add_line(self, line: bytes):
+        bases = line.rstrip(b"\r\n")
+        if not self.line_width:
+            self.line_bases = len(bases)
+            self.line_width = len(line)
+        # The checksum is of the upper case sequence without any whitespace, as in the SAM spec
+        bases = b"".join(bases.split()).upper()
+        self.length += len(bases)
+        self._md5.update(bases)
+        if self._tmp_file:
+            self._tmp_file.write(bases)
+
+    def finish(self) -> FastaSequence:
+        md5 = self._md5.hexdigest()
+        if self._tmp_file:
+            self._tmp_file.close()
+            cache_path = get_cache_path(self.cache_dir, md5)
+            if cache_path.exists():
+                os.unlink(self._tmp_file.name)
+            else:
+                try:
+                    cache_path.parent.mkdir(parents=True, exist_ok=True)
+                    os.chmod(self._tmp_file.name, 0o644)
+                    os.replace(self._tmp_file.name, cache_path)
+                except BaseException:
+                    self.discard()
+                    raise
+        return FastaSequence(
+            name=self.name,
+            length=self.length,
+            offset=self.offset,
+            line_bases=self.line_bases,
+            line_width=self.line_width,
+            md5=md5,
+        )
+
+    def discard(self):
+        """Close and remove the temporary file of a sequence that could not be read to the end."""
+        if not self._tmp_file:
+            return
+        self._tmp_file.close()
+        try:
+            os.unlink(self._tmp_file.name)
+        except FileNotFoundError:
+            pass
+
+
+def read_fasta(reference: Path, cache_dir: Optional[Path] = None) -> List[FastaSequence]:
+    """Read a FASTA file and return its sequences.
+
+    The file is streamed line by line. If a cache_dir is given each sequence is written there,
+    under its MD5 checksum, in the layout that samtools expects. A sequence is written to a
+    temporary file first and moved into place when it is complete, so that other processes never
+    see part of a sequence.
+    """
+    sequences = []
+    current: Optional[_SequenceWriter] = None
+    offset = 0
+    try:
+        with open(reference, "rb") as fasta:
+            for line in fasta:
+                offset += len(line)
+                if line.startswith(b">"):
+                    if current:
+                        sequences.append(current.finish())
+                        current = None
+                    name = line[1:].split()[0].decode() if line[1:].strip() else ""
+                    current = _SequenceWriter(name, offset, cache_dir)
+                elif current and line.strip():
+                    current.add_line(line)
+        if current:
+            sequences.append(current.finish())
+    except BaseException:
+        if current:
+            current.discard()
+        raise
+    return sequences
+
+
+class ReferenceCache:
+    """A REF_PATH/REF_CACHE directory filled from a FASTA reference.
+
+    The cache is filled, and a missing or outdated .fai index of the reference is created, the
+    first time it is warmed. Concurrent processes wait for each other on a lock in the cache
+    directory, and a marker with the identity of the reference makes later runs skip the work.
+    """
+
+    def __init__(self, reference: Path, cache_dir: Path):
+        self.reference = Path(reference).absolute()
+        self.cache_dir = Path(cache_dir).absolute()
+        self.sequences: Dict[str, str] = {}
+
+    @property
+    def marker_path(self) -> Path:
+        """Return the path to the marker that the reference has been added to the cache."""
+        key = hashlib.sha1(str(self.reference).encode()).hexdigest()
+        return Path(self.cache_dir, MARKER_DIR, f"{key}.json")
+
+    def read_marker(self) -> Optional[Dict[str, str]]:
+        """Return the sequence checksums if this version of the reference is in the cache."""
+        if not self.marker_path.exists():
+            return None
+        with open(self.marker_path, "r") as marker_file:
+            marker = json.load(marker_file)
+        if marker.get("identity") != list(get_file_identity(self.reference)):
+            LOG.info(f"{self.reference} has changed since it was added to the reference cache")
+            return None
+        if not all(
+            get_cache_path(self.cache_dir, md5).exists() for md5 in marker["sequences"].values()
+        ):
+            LOG.warning(f"Sequences of {self.reference} are missing from the reference cache")
+            return None
+        return marker["sequences"]
+
+    def write_marker(self, sequences: List[FastaSequence]):
+        """Store that the reference has been added to the cache, the file is replaced atomically."""
+        marker = {
+            "reference": str(self.reference),
+            "identity": list(get_file_identity(self.reference)),
+            "sequences": {sequence.name: sequence.md5 for sequence in sequences},
+        }
+        self.marker_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.marker_path.with_name(self.marker_path.name + ".tmp")
+        with open(tmp_path, "w") as marker_file:
+            json.dump(marker, marker_file)
+        os.replace(tmp_path, self.marker_path)
+
+    def fai_is_current(self) -> bool:
+        """Check that the reference has an index that is newer than the reference itself."""
+        fai_path = get_fai_path(self.reference)
+        return (
+            fai_path.exists() and fai_path.stat().st_mtime_ns >= self.reference.stat().st_mtime_ns
+        )
+
+    def write_fai(self, sequences: List[FastaSequence]):
+        """Write the .fai index of the reference, a read only reference directory is not an error."""
+        fai_path = get_fai_path(self.reference)
+        LOG.info(f"Creating index {fai_path}")
+        tmp_path = fai_path.with_name(f"{fai_path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, "w") as fai_file:
+                fai_file.writelines(sequence.fai_line() for sequence in sequences)
+            os.replace(tmp_path, fai_path)
+        except OSError as error:
+            LOG.warning(f"Could not create index {fai_path}: {error}")
+
+    def warm(self) -> Dict[str, str]:
+        """Make sure that all sequences of the reference are in the cache and that it is indexed.
+
+        Returns:
+            the MD5 checksum of each sequence, by name
+        """
+        if not self.reference.exists():
+            raise FileNotFoundError(f"Reference genome {self.reference} does not exist")
+        if is_gzipped(self.reference):
+            raise ValueError(f"Reference genome {self.reference} has to be uncompressed")
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(Path(self.cache_dir, LOCK_NAME), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                sequences = self.read_marker()
+                fai_is_current = self.fai_is_current()
+                if sequences is not None and fai_is_current:
+                    LOG.info(f"Reference cache {self.cache_dir} is up to date")
+                    self.sequences = sequences
+                    return self.sequences
+                fill_cache = sequences is None
+                if fill_cache:
+                    LOG.info(f"Adding {self.reference} to reference cache {self.cache_dir}")
+                fasta_sequences = read_fasta(
+                    self.reference, cache_dir=self.cache_dir if fill_cache else None
+                )
+                if not fai_is_current:
+                    self.write_fai(fasta_sequences)
+                if fill_cache:
+                    self.write_marker(fasta_sequences)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self.sequences = {sequence.name: sequence.md5 for sequence in fasta_sequences}
+        return self.sequences
+
+    def environment(self) -> Dict[str, str]:
+        """Return the environment variables that make samtools use the cache, and only the cache."""
+        cache_pattern = str(Path(self.cache_dir, REF_CACHE_PATTERN))
+        return {"REF_PATH": cache_pattern, "REF_CACHE": cache_pattern}
+
+    def __repr__(self) -> str:
+        return f"ReferenceCache:reference:{self.reference}, cache_dir:{self.cache_dir}"
@@ -0,0 +1,83 @@
+"""Code to handle genomic regions for region restricted decompression."""
+
+import logging
+import re
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+LOG = logging.getLogger(__name__)
+
+REGION_RANGE = re.compile(r"^(?P<contig>.+):(?P<start>[\d,]+)(?:-(?P<end>[\d,]*))?$")
+BED_HEADERS = ("#", "track", "browser")
+
+
+class Region(NamedTuple):
+    """A region of a contig, with 1-based inclusive coordinates. None means to the contig end."""
+
+    contig: str
+    start: int = 1
+    end: Optional[int] = None
+
+    def __str__(self) -> str:
+        """Return the region in the format that samtools expects."""
+        contig = f"{{{self.contig}}}" if ":" in self.contig else self.contig
+        if self.start == 1 and self.end is None:
+            return contig
+        if self.end is None:
+            return f"{contig}:{self.start}"
+        return f"{contig}:{self.start}-{self.end}"
+
+
+def parse_region(region: str) -> Region:
+    """Parse a region like chr1, chr1:1000 or chr1:1,000-2,000"""
+    match = REGION_RANGE.match(region.strip())
+    if not match:
+        return Region(contig=region.strip())
+    start = int(match["start"].replace(",", ""))
+    end = int(match["end"].replace(",", "")) if match["end"] else None
+    if start < 1 or (end is not None and end < start):
+        raise ValueError(f"Invalid region {region}")
+    return Region(contig=match["contig"], start=start, end=end)
+
+
+def read_regions_file(regions_file: Path) -> List[Region]:
+    """Read regions from a BED file, or a file with one region like chr1:1000-2000 per line."""
+    regions = []
+    with open(regions_file, "r") as regions_lines:
+        for line in regions_lines:
+            if not line.strip() or line.startswith(BED_HEADERS):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 3:
+                regions.append(parse_region(fields[0]))
+                continue
+            # BED coordinates are 0-based and half open
+            regions.append(Region(contig=fields[0], start=int(fields[1]) + 1, end=int(fields[2])))
+    LOG.info(f"Read {len(regions)} regions from {regions_file}")
+    return regions
+
+
+def merge_regions(regions: List[Region]) -> List[Region]:
+    """Merge regions that overlap or touch, sorted by start within each contig.
+
+    Contigs are kept in the order they are first seen.
+    """
+    by_contig: Dict[str, List[Region]] = {}
+    for region in regions:
+        by_contig.setdefault(region.contig, []).append(region)
+
+    merged = []
+    for contig_regions in by_contig.values():
+        contig_regions.sort(key=lambda region: region.start)
+        current = contig_regions[0]
+        for region in contig_regions[1:]:
+            if current.end is not None and region.start > current.end + 1:
+                merged.append(current)
+                current = region
+                continue
+            end = (
+                None if current.end is None or region.end is None else max(current.end, region.end)
+            )
+            current = current._replace(end=end)
+        merged.append(current)
+    return merged
@@ -0,0 +1,203 @@
+"""Code to run independent jobs, like the compression of FASTQ pairs, at the same time."""
+
+import hashlib
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, TypeVar
+
+import coloredlogs
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_MAX_JOBS = 1
+JOB_ORDERS = ("largest", "smallest", "oldest", "found")
+DEFAULT_JOB_ORDER = "largest"
+
+Job = TypeVar("Job")
+
+
+class JobResult(NamedTuple):
+    """How a job went, error describes why it failed."""
+
+    name: str
+    success: bool
+    seconds: float
+    error: Optional[str] = None
+
+
+class JobCost(NamedTuple):
+    """What a job has to work on, the total size and the oldest modification time of its files."""
+
+    size: int
+    mtime: float
+
+
+def get_job_cost(paths: Sequence[Path]) -> JobCost:
+    """Return the cost of a job from the files it works on, missing files do not count."""
+    sizes = []
+    mtimes = []
+    for path in paths:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        sizes.append(stat.st_size)
+        mtimes.append(stat.st_mtime)
+    return JobCost(size=sum(sizes), mtime=min(mtimes, default=0.0))
+
+
+def read_priority_file(priority_file: Path) -> List[Path]:
+    """Read paths to run first, one per line, lines starting with # are ignored."""
+    with open(priority_file, "r") as priority_lines:
+        priorities = [
+            Path(line.strip()).absolute()
+            for line in priority_lines
+            if line.strip() and not line.startswith("#")
+        ]
+    LOG.info(f"Read {len(priorities)} prioritised paths from {priority_file}")
+    return priorities
+
+
+def order_jobs(
+    jobs: List[Job],
+    get_paths: Callable[[Job], Sequence[Path]],
+    order: str = DEFAULT_JOB_ORDER,
+    priorities: Optional[List[Path]] = None,
+) -> List[Job]:
+    """Order jobs by the cost of the files that get_paths returns for each job.
+
+    The default is to start with the largest jobs, longest processing time first, so that a large
+    job found last does not run alone at the end while the other workers are done. Jobs with any
+    path in priorities come first, in the order of the priorities. The order is stable, jobs with
+    the same cost keep the order they were found in.
+    """
+    if order not in JOB_ORDERS:
+        raise ValueError(f"Unknown job order {order}, use one of {', '.join(JOB_ORDERS)}")
+    costs = [get_job_cost(get_paths(job)) for job in jobs]
+    ranks: Dict[Path, int] = {}
+    for rank, path in enumerate(priorities or []):
+        ranks.setdefault(path, rank)
+
+    def sort_key(position: int) -> tuple:
+        rank = min(
+            (ranks.get(path.absolute(), len(ranks)) for path in get_paths(jobs[position])),
+            default=len(ranks),
+        )
+        cost = costs[position]
+        if order == "largest":
+            return (rank, -cost.size)
+        if order == "smallest":
+            return (rank, cost.size)
+        if order == "oldest":
+            return (rank, cost.mtime)
+        return (rank,)
+
+    positions = sorted(range(len(jobs)), key=sort_key)
+    LOG.info(f"Ordered {len(jobs)} jobs of {sum(cost.size for cost in costs)} bytes by {order}")
+    return [jobs[position] for position in positions]
+
+
+class Shard(NamedTuple):
+    """Shard index of count, the part of the jobs that one of count independent runs does."""
+
+    index: int
+    count: int
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+
+def parse_shard(shard: str) -> Shard:
+    """Parse a shard given as K/N, where K is from 1 to N."""
+    index, _, count = shard.partition("/")
+    if not (index.isdigit() and count.isdigit()) or not 1 <= int(index) <= int(count):
+        raise ValueError(f"Invalid shard {shard}, use K/N with K from 1 to N")
+    return Shard(index=int(index), count=int(count))
+
+
+def get_shard(key: str, count: int) -> Shard:
+    """Return the shard of a job from a stable hash of its key.
+
+    The same key is in the same shard in every run and on every node, without any shared state.
+    """
+    digest = hashlib.sha1(key.encode()).digest()
+    return Shard(index=int.from_bytes(digest[:8], "big") % count + 1, count=count)
+
+
+def get_threads_per_job(
+    total_threads: int, max_jobs: int, threads_per_job: Optional[int] = None
+) -> int:
+    """Return the threads for each job, the total is split evenly unless threads_per_job is set."""
+    if threads_per_job:
+        return threads_per_job
+    return max(total_threads // max(max_jobs, 1), 1)
+
+
+def run_job(function: Callable[..., None], name: str, args: tuple) -> JobResult:
+    """Run a job and return how it went, any exception is a failure of this job only."""
+    LOG.info(f"Start job {name}")
+    start = time.monotonic()
+    try:
+        function(*args)
+    except Exception as error:  # pylint: disable=broad-except
+        LOG.warning(f"Job {name} failed: {error!r}")
+        return JobResult(name, False, time.monotonic() - start, str(error) or type(error).__name__)
+    return JobResult(name, True, time.monotonic() - start)
+
+
+def init_worker(log_level: int):
+    """Log from the worker processes like from the main process."""
+    coloredlogs.install(level=log_level)
+
+
+def run_jobs(
+    function: Callable[..., None],
+    jobs: List[Tuple[str, tuple]],
+    max_jobs: int = DEFAULT_MAX_JOBS,
+) -> List[JobResult]:
+    """Run function with the arguments of each job, max_jobs at a time in a pool of processes.
+
+    The function and its arguments have to be picklable. With one job at a time the jobs run in
+    this process. A job that fails, even by killing its worker process, does not stop the others.
+
+    Returns:
+        the result of each job, in the order of the jobs
+    """
+    if max_jobs <= 1 or len(jobs) <= 1:
+        return [run_job(function, name, args) for name, args in jobs]
+
+    LOG.info(f"Run {len(jobs)} jobs, {max_jobs} at a time")
+    results: Dict[int, JobResult] = {}
+    with ProcessPoolExecutor(
+        max_workers=min(max_jobs, len(jobs)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(logging.getLogger().getEffectiveLevel(),),
+    ) as executor:
+        futures = {
+            executor.submit(run_job, function, name, args): index
+            for index, (name, args) in enumerate(jobs)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            name = jobs[index][0]
+            try:
+                results[index] = future.result()
+            except Exception as error:  # pylint: disable=broad-except
+                LOG.warning(f"Worker for job {name} failed: {error!r}")
+                results[index] = JobResult(name, False, 0.0, repr(error))
+    return [results[index] for index in range(len(jobs))]
+
+
+def log_summary(results: List[JobResult]):
+    """Log how each job went and how many succeeded."""
+    for result in results:
+        if result.success:
+            LOG.info(f"{result.name}: succeeded in {result.seconds:.1f} s")
+        else:
+            LOG.error(f"{result.name}: FAILED after {result.seconds:.1f} s, {result.error}")
+    nr_failed = sum(not result.success for result in results)
+    LOG.info(f"{len(results) - nr_failed} of {len(results)} jobs succeeded, {nr_failed} failed")
@@ -1,10 +1,13 @@
 """Test for the auto functionality in crunchy"""
 
 import pathlib
+import shutil
 
 from click.testing import CliRunner
 
 from crunchy.cli.auto_cmd import auto, fastq
+from crunchy.compress import get_partial_path
+from crunchy.journal import JOURNAL_NAME, STARTED, Journal
 
 
 def nr_files(dirpath: pathlib.Path) -> int:
@@ -73,3 +76,258 @@ def test_auto_dir_nodir_dry_run(base_context, first_read):
     )
     # THEN assert it exits without running
     assert result.exit_code == 0
+
+
+def test_auto_dir_max_jobs(base_context, project_dir, first_read, second_read):
+    """Test auto fastq with several pairs compressed at the same time"""
+    # GIVEN a cli runner and a directory with two pairs
+    runner = CliRunner()
+    for sample in ["first", "second"]:
+        shutil.copy(first_read, pathlib.Path(project_dir, f"{sample}_S1_R1_001.fastq.gz"))
+        shutil.copy(second_read, pathlib.Path(project_dir, f"{sample}_S1_R2_001.fastq.gz"))
+    # WHEN running auto with two jobs at a time
+    result = runner.invoke(
+        fastq,
+        ["--indir", str(project_dir), "--yes", "--dry-run", "--max-jobs", "2"],
+        obj=base_context,
+    )
+    # THEN assert it exits without problems and the threads were not changed for the caller
+    assert result.exit_code == 0
+    assert nr_files(project_dir) == 4
+    assert base_context["spring_api"].threads == 8
+
+
+def test_auto_dir_pipeline(base_context, project_dir, first_read, second_read):
+    """Test auto fastq with the steps for the pairs in a pipeline"""
+    # GIVEN a cli runner and a directory with two pairs
+    runner = CliRunner()
+    for sample in ["first", "second"]:
+        shutil.copy(first_read, pathlib.Path(project_dir, f"{sample}_S1_R1_001.fastq.gz"))
+        shutil.copy(second_read, pathlib.Path(project_dir, f"{sample}_S1_R2_001.fastq.gz"))
+    # WHEN running auto as a pipeline with two workers for verification
+    result = runner.invoke(
+        fastq,
+        [
+            "--indir",
+            str(project_dir),
+            "--yes",
+            "--dry-run",
+            "--pipeline",
+            "--stage-workers",
+            "verify=2",
+        ],
+        obj=base_context,
+    )
+    # THEN assert it exits without problems
+    assert result.exit_code == 0
+    assert nr_files(project_dir) == 4
+
+
+def test_auto_invalid_stage_workers(base_context, project_dir):
+    """Test that workers for an unknown stage are rejected"""
+    # GIVEN a cli runner
+    runner = CliRunner()
+    # WHEN running auto with workers for a stage that does not exist
+    result = runner.invoke(
+        fastq,
+        ["--indir", str(project_dir), "--yes", "--pipeline", "--stage-workers", "upload=2"],
+        obj=base_context,
+    )
+    # THEN assert the command fails
+    assert result.exit_code == 2
+
+
+def test_auto_resume(base_context, project_dir, first_read, second_read):
+    """Test that a resumed run skips the stages that were done and removes partial files"""
+    # GIVEN a pair that was hashed and started to compress before the run was interrupted
+    runner = CliRunner()
+    first = pathlib.Path(project_dir, "first_S1_R1_001.fastq.gz")
+    second = pathlib.Path(project_dir, "first_S1_R2_001.fastq.gz")
+    shutil.copy(first_read, first)
+    shutil.copy(second_read, second)
+    spring_path = pathlib.Path(project_dir, "first_S1_001.spring")
+    partial_path = get_partial_path(spring_path)
+    partial_path.write_text("part of a spring file")
+    journal = Journal(pathlib.Path(project_dir, JOURNAL_NAME))
+    journal.record(str(spring_path), "hash", checksums=["abc", "def"])
+    journal.record(str(spring_path), "compress", STARTED)
+    # GIVEN a mock that decompresses the original reads
+    base_context["spring_api"]._create_output = True
+    base_context["spring_api"]._fastq1 = first_read
+    base_context["spring_api"]._fastq2 = second_read
+    # WHEN resuming the run
+    result = runner.invoke(
+        fastq,
+        [
+            "-f",
+            str(first),
+            "-s",
+            str(second),
+            "--spring-path",
+            str(spring_path),
+            "--resume",
+            "--yes",
+        ],
+        obj=base_context,
+    )
+    # THEN assert the partial file was removed and the stored checksums, which do not match the
+    # fastqs, were used instead of hashing the fastqs again
+    assert result.exit_code == 0
+    assert not partial_path.exists()
+    assert not spring_path.exists()
+    assert first.exists()
+    assert journal.read()[str(spring_path)].finished == ("hash",)
+
+
+def test_auto_resume_after_failed_verify(base_context, project_dir, first_read, second_read):
+    """Test that a pair whose Spring archive failed verification is compressed again on resume"""
+    # GIVEN a pair and a mock that decompresses the reads of the pair in the wrong order
+    runner = CliRunner()
+    first = pathlib.Path(project_dir, "first_S1_R1_001.fastq.gz")
+    second = pathlib.Path(project_dir, "first_S1_R2_001.fastq.gz")
+    shutil.copy(first_read, first)
+    shutil.copy(second_read, second)
+    spring_path = pathlib.Path(project_dir, "first_S1_001.spring")
+    arguments = ["-f", str(first), "-s", str(second), "--spring-path", str(spring_path), "--yes"]
+    base_context["spring_api"]._create_output = True
+    base_context["spring_api"]._fastq1 = second_read
+    base_context["spring_api"]._fastq2 = first_read
+    # GIVEN a run where the verification failed and the Spring archive was deleted
+    runner.invoke(fastq, arguments, obj=base_context)
+    assert not spring_path.exists()
+    assert first.exists()
+    # WHEN resuming the run with a mock that decompresses the reads correctly
+    base_context["spring_api"]._fastq1 = first_read
+    base_context["spring_api"]._fastq2 = second_read
+    result = runner.invoke(fastq, [*arguments, "--resume"], obj=base_context)
+    # THEN assert that the pair was compressed again before the fastqs were deleted
+    assert result.exit_code == 0
+    assert spring_path.exists()
+    assert not first.exists()
+    journal = Journal(pathlib.Path(project_dir, JOURNAL_NAME))
+    assert journal.read()[str(spring_path)].finished == ("hash", "compress", "verify", "delete")
+
+
+def test_auto_resume_missing_spring(base_context, project_dir, first_read, second_read):
+    """Test that a pair is compressed again if its Spring archive is gone"""
+    # GIVEN a pair that was compressed, but whose Spring archive is missing
+    runner = CliRunner()
+    first = pathlib.Path(project_dir, "first_S1_R1_001.fastq.gz")
+    second = pathlib.Path(project_dir, "first_S1_R2_001.fastq.gz")
+    shutil.copy(first_read, first)
+    shutil.copy(second_read, second)
+    spring_path = pathlib.Path(project_dir, "first_S1_001.spring")
+    journal = Journal(pathlib.Path(project_dir, JOURNAL_NAME))
+    journal.record(str(spring_path), "hash", checksums=["abc", "def"])
+    journal.record(str(spring_path), "compress")
+    journal.record(str(spring_path), "verify")
+    base_context["spring_api"]._create_output = True
+    base_context["spring_api"]._fastq1 = first_read
+    base_context["spring_api"]._fastq2 = second_read
+    # WHEN resuming the run
+    result = runner.invoke(
+        fastq,
+        [
+            "-f",
+            str(first),
+            "-s",
+            str(second),
+            "--spring-path",
+            str(spring_path),
+            "--resume",
+            "--yes",
+        ],
+        obj=base_context,
+    )
+    # THEN assert the pair was compressed and verified again, which fails with the stored
+    # checksums, instead of deleting the fastqs
+    assert result.exit_code == 0
+    assert first.exists()
+    assert second.exists()
+    assert journal.read()[str(spring_path)].finished == ("hash",)
+
+
+def test_auto_list_shard(base_context, project_dir, first_read, second_read):
+    """Test that the pairs are split between the shards and listed"""
+    # GIVEN a cli runner and a directory with four pairs
+    runner = CliRunner()
+    for sample in ["first", "second", "third", "fourth"]:
+        shutil.copy(first_read, pathlib.Path(project_dir, f"{sample}_S1_R1_001.fastq.gz"))
+        shutil.copy(second_read, pathlib.Path(project_dir, f"{sample}_S1_R2_001.fastq.gz"))
+    # WHEN listing the shards of two runs
+    result = runner.invoke(
+        fastq,
+        ["--indir", str(project_dir), "--yes", "--shard", "1/2", "--list-shard"],
+        obj=base_context,
+    )
+    # THEN assert each pair is listed once with its shard and nothing was compressed
+    assert result.exit_code == 0
+    shards = [line.split("\t")[0] for line in result.output.splitlines() if "\t" in line]
+    assert len(shards) == 4
+    assert set(shards) <= {"1/2", "2/2"}
+    assert nr_files(project_dir) == 8
+
+
+def test_auto_invalid_shard(base_context, project_dir):
+    """Test that a shard outside the number of shards is rejected"""
+    # GIVEN a cli runner
+    runner = CliRunner()
+    # WHEN running auto with shard 3 of 2
+    result = runner.invoke(
+        fastq, ["--indir", str(project_dir), "--yes", "--shard", "3/2"], obj=base_context
+    )
+    # THEN assert the command fails
+    assert result.exit_code == 2
+
+
+def test_auto_shards_keep_own_journals(base_context, project_dir, first_read, second_read):
+    """Test that two shards of one directory do not remove each other's journal"""
+    # GIVEN a cli runner, a directory with four pairs and a mock that decompresses the reads
+    runner = CliRunner()
+    for sample in ["first", "second", "third", "fourth"]:
+        shutil.copy(first_read, pathlib.Path(project_dir, f"{sample}_S1_R1_001.fastq.gz"))
+        shutil.copy(second_read, pathlib.Path(project_dir, f"{sample}_S1_R2_001.fastq.gz"))
+    base_context["spring_api"]._create_output = True
+    base_context["spring_api"]._fastq1 = first_read
+    base_context["spring_api"]._fastq2 = second_read
+    # WHEN running both shards, one after the other
+    for shard in ["1/2", "2/2"]:
+        result = runner.invoke(
+            fastq, ["--indir", str(project_dir), "--yes", "--shard", shard], obj=base_context
+        )
+        assert result.exit_code == 0
+    # THEN assert that each shard has a journal of its own with the pairs it finished
+    journals = [
+        Journal(pathlib.Path(project_dir, f"crunchy_journal.{index}of2.jsonl")).read()
+        for index in [1, 2]
+    ]
+    assert not set(journals[0]) & set(journals[1])
+    assert len(journals[0]) + len(journals[1]) == 4
+    assert all("delete" in state.finished for journal in journals for state in journal.values())
+
+
+def test_auto_list_shard_without_yes(base_context, project_dir, first_read, second_read):
+    """Test that listing the shards does not ask to compress and delete the fastqs"""
+    # GIVEN a cli runner and a directory with a pair
+    runner = CliRunner()
+    shutil.copy(first_read, pathlib.Path(project_dir, "first_S1_R1_001.fastq.gz"))
+    shutil.copy(second_read, pathlib.Path(project_dir, "first_S1_R2_001.fastq.gz"))
+    # WHEN listing the shards without --yes
+    result = runner.invoke(
+        fastq, ["--indir", str(project_dir), "--shard", "1/2", "--list-shard"], obj=base_context
+    )
+    # THEN assert the pair is listed without a question
+    assert result.exit_code == 0
+    assert "Are you sure" not in result.output
+    assert "first_S1.spring" in result.output
+
+
+def test_auto_without_yes(base_context, project_dir):
+    """Test that the user is asked before fastqs are compressed and deleted"""
+    # GIVEN a cli runner
+    runner = CliRunner()
+    # WHEN running auto without --yes and answering no
+    result = runner.invoke(fastq, ["--indir", str(project_dir)], input="n\n", obj=base_context)
+    # THEN assert the command is aborted
+    assert "Are you sure" in result.output
+    assert result.exit_code == 1
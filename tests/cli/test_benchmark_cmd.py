@@ -0,0 +1,58 @@
+"""Tests for benchmark CLI"""
+
+from click.testing import CliRunner
+
+from crunchy.cli.base import base_command
+from crunchy.cli.benchmark_cmd import cram, cram_calls
+
+
+def test_benchmark_checksum(first_read, checksum_first_read):
+    """Test to benchmark the checksum of a file"""
+    # GIVEN the path to a gzipped file and a cli runner
+    runner = CliRunner()
+    # WHEN running the benchmark checksum command
+    result = runner.invoke(
+        base_command, ["--buffer-size", "1", "benchmark", "checksum", str(first_read)]
+    )
+    # THEN assert the command was succesful
+    assert result.exit_code == 0
+    # THEN assert that one line per method was printed
+    assert result.output.count(checksum_first_read) == 2
+
+
+def test_benchmark_inflate(first_read):
+    """Test to benchmark the available inflate backends"""
+    # GIVEN the path to a gzipped file and a cli runner
+    runner = CliRunner()
+    # WHEN running the benchmark inflate command for zlib
+    result = runner.invoke(base_command, ["benchmark", "inflate", str(first_read), "-b", "zlib"])
+    # THEN assert the command was succesful
+    assert result.exit_code == 0
+    # THEN assert that the throughput was reported
+    assert "MiB/s" in result.output
+
+
+def test_benchmark_cram_calls(bam_path, base_context):
+    """Test to benchmark the samtools call patterns"""
+    # GIVEN the path to a bam file, a context with a cram api and a cli runner
+    runner = CliRunner()
+    # WHEN running the benchmark cram-calls command
+    result = runner.invoke(cram_calls, [str(bam_path)], obj=base_context)
+    # THEN assert the command was succesful
+    assert result.exit_code == 0
+    # THEN assert that both call patterns were reported
+    assert "legacy" in result.output
+    assert "threaded" in result.output
+
+
+def test_benchmark_cram(bam_path, real_base_context):
+    """Test to benchmark a CRAM profile"""
+    # GIVEN the path to a bam file, a cram api that does not run samtools and a cli runner
+    real_base_context["cram_api"].run_command = lambda parameters: None
+    runner = CliRunner()
+    # WHEN running the benchmark cram command for the fast profile
+    result = runner.invoke(cram, [str(bam_path), "-p", "fast"], obj=real_base_context)
+    # THEN assert the command was succesful
+    assert result.exit_code == 0
+    # THEN assert that the profile was reported
+    assert "fast" in result.output
@@ -0,0 +1,50 @@
+"""Tests for checksum CLI"""
+
+from click.testing import CliRunner
+
+from crunchy.cli.base import base_command
+from crunchy.cli.checksum_cmd import checksum
+from crunchy.integrity import get_checksum
+
+
+def test_checksum(first_read, checksum_first_read):
+    """Test to generate the checksum of a file"""
+    # GIVEN the path to a gzipped file and a cli runner
+    runner = CliRunner()
+    # WHEN running the checksum command
+    result = runner.invoke(checksum, [str(first_read)])
+    # THEN assert the command was succesful
+    assert result.exit_code == 0
+    # THEN assert that the checksum was printed
+    assert checksum_first_read in result.output
+
+
+def test_checksum_multiple_algorithms(first_read, checksum_first_read):
+    """Test to generate checksums with several algorithms at once"""
+    # GIVEN the path to a gzipped file, its md5 and a cli runner
+    md5 = get_checksum(first_read, "md5")
+    runner = CliRunner()
+    # WHEN running the checksum command with two algorithms
+    result = runner.invoke(checksum, [str(first_read), "-a", "md5", "-a", "sha256"])
+    # THEN assert the command was succesful
+    assert result.exit_code == 0
+    # THEN assert that one line per algorithm was printed
+    assert f"md5\t{md5}" in result.output
+    assert f"sha256\t{checksum_first_read}" in result.output
+
+
+def test_checksum_with_cache(first_tmp_file, checksum_first_read, project_dir):
+    """Test to generate the checksum of a file with a checksum cache"""
+    # GIVEN the path to a gzipped file, a path to a checksum cache and a cli runner
+    cache_path = project_dir / "cache.sqlite"
+    runner = CliRunner()
+    # WHEN running the checksum command twice with a cache
+    for _ in range(2):
+        result = runner.invoke(
+            base_command, ["--checksum-cache", str(cache_path), "checksum", str(first_tmp_file)]
+        )
+        # THEN assert the command was succesful
+        assert result.exit_code == 0
+        assert checksum_first_read in result.output
+    # THEN assert that the cache was created
+    assert cache_path.exists()
@@ -81,3 +81,73 @@ def test_check_logging(first_read):
             new_checksum = message.split(" ")[-1]
 
     assert checksum == new_checksum
+
+
+def test_compare_two_files_with_checksums(first_read, second_read):
+    """Test to compare two files with one checksum each"""
+    # GIVEN the paths to two gzipped files, their checksums and a cli runner
+    checksum = get_checksum(first_read)
+    second_checksum = get_checksum(second_read)
+    runner = CliRunner()
+    # WHEN running the compare command with both files and both checksums
+    result = runner.invoke(
+        base_command,
+        [
+            "compare",
+            "-f",
+            str(first_read),
+            "-s",
+            str(second_read),
+            "-c",
+            checksum,
+            "--second-checksum",
+            second_checksum,
+        ],
+    )
+    # THEN assert the command was succesful
+    assert result.exit_code == 0
+
+
+def test_compare_two_files_with_wrong_second_checksum(first_read, second_read):
+    """Test to compare two files where the second checksum is wrong"""
+    # GIVEN the paths to two gzipped files, the checksum of the first file and a cli runner
+    checksum = get_checksum(first_read)
+    runner = CliRunner()
+    # WHEN running the compare command with the first checksum given for both files
+    result = runner.invoke(
+        base_command,
+        [
+            "--checksum-workers",
+            "1",
+            "compare",
+            "-f",
+            str(first_read),
+            "-s",
+            str(second_read),
+            "-c",
+            checksum,
+            "--second-checksum",
+            checksum,
+        ],
+    )
+    # THEN assert the command fails since the second file differ from its checksum
+    assert result.exit_code == 1
+
+
+def test_compare_direct(first_read, second_read):
+    """Test to compare two files byte by byte"""
+    # GIVEN the paths to two different gzipped files and a cli runner
+    runner = CliRunner()
+    # WHEN comparing a file with itself directly
+    result = runner.invoke(
+        base_command, ["compare", "-f", str(first_read), "-s", str(first_read), "--direct"]
+    )
+    # THEN assert the command was succesful
+    assert result.exit_code == 0
+    # WHEN comparing two different files directly
+    result = runner.invoke(
+        base_command, ["compare", "-f", str(first_read), "-s", str(second_read), "--direct"]
+    )
+    # THEN assert the command fails and the first difference is reported
+    assert result.exit_code == 1
+    assert "first difference at byte" in result.output
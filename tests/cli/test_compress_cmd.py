@@ -205,3 +205,232 @@ def nr_files(dirpath: pathlib.Path) -> int:
             continue
         nr_files_indir += 1
     return nr_files_indir
+
+
+def test_compress_fastq_streaming_integrity(
+    first_read, second_read, spring_tmp_path, base_context, project_dir
+):
+    """Test to run the compress fastq command with integrity check through named pipes"""
+    # GIVEN the path a pair of fastqs, a non existing spring file and a cli runner
+    runner = CliRunner()
+    assert not spring_tmp_path.exists()
+    # GIVEN a mock that decompresses the original reads
+    base_context["spring_api"]._create_output = True
+    base_context["spring_api"]._fastq1 = first_read
+    base_context["spring_api"]._fastq2 = second_read
+    # WHEN running the compress command with a streaming integrity check
+    result = runner.invoke(
+        fastq,
+        [
+            "--first-read",
+            str(first_read),
+            "--second-read",
+            str(second_read),
+            "--spring-path",
+            str(spring_tmp_path),
+            "--check-integrity",
+            "--streaming",
+        ],
+        obj=base_context,
+    )
+    # THEN assert the command succedes
+    assert result.exit_code == 0
+    # THEN assert that no decompressed files were written, only the spring file
+    assert nr_files(project_dir) == 1
+    assert spring_tmp_path.exists()
+
+
+def test_compress_fastq_chunked_integrity(
+    first_read, second_read, spring_tmp_path, base_context, metadata_tmp_path
+):
+    """Test to run the compress fastq command with an integrity check of chunk manifests"""
+    # GIVEN the path a pair of fastqs, a non existing spring file and a cli runner
+    runner = CliRunner()
+    # GIVEN a mock that decompresses the original reads
+    base_context["spring_api"]._create_output = True
+    base_context["spring_api"]._fastq1 = first_read
+    base_context["spring_api"]._fastq2 = second_read
+    # WHEN running the compress command with chunk manifests
+    result = runner.invoke(
+        fastq,
+        [
+            "--first-read",
+            str(first_read),
+            "--second-read",
+            str(second_read),
+            "--spring-path",
+            str(spring_tmp_path),
+            "--check-integrity",
+            "--metadata-file",
+            "--chunk-size",
+            "1",
+        ],
+        obj=base_context,
+    )
+    # THEN assert the command succedes
+    assert result.exit_code == 0
+    # THEN assert that the metadata contains the manifests
+    assert '"chunks"' in metadata_tmp_path.read_text()
+
+
+def test_compress_fastq_stats_integrity(
+    first_read, second_read, spring_tmp_path, base_context, metadata_tmp_path
+):
+    """Test to run the compress fastq command with FASTQ statistics"""
+    # GIVEN the path a pair of fastqs, a non existing spring file and a cli runner
+    runner = CliRunner()
+    # GIVEN a mock that decompresses the original reads
+    base_context["spring_api"]._create_output = True
+    base_context["spring_api"]._fastq1 = first_read
+    base_context["spring_api"]._fastq2 = second_read
+    # WHEN running the compress command with FASTQ statistics
+    result = runner.invoke(
+        fastq,
+        [
+            "--first-read",
+            str(first_read),
+            "--second-read",
+            str(second_read),
+            "--spring-path",
+            str(spring_tmp_path),
+            "--check-integrity",
+            "--metadata-file",
+            "--fastq-stats",
+        ],
+        obj=base_context,
+    )
+    # THEN assert the command succedes
+    assert result.exit_code == 0
+    # THEN assert that the metadata contains the statistics
+    assert '"read_lengths"' in metadata_tmp_path.read_text()
+
+
+def test_compress_fastq_record_resources(
+    first_read, second_read, spring_tmp_path, base_context, metadata_tmp_path
+):
+    """Test to store the resources used by Spring in the metadata"""
+    # GIVEN the path a pair of fastqs, a non existing spring file and a cli runner
+    runner = CliRunner()
+    # WHEN running the compress command with metadata and resource recording
+    result = runner.invoke(
+        fastq,
+        [
+            "--first-read",
+            str(first_read),
+            "--second-read",
+            str(second_read),
+            "--spring-path",
+            str(spring_tmp_path),
+            "--metadata-file",
+            "--record-resources",
+        ],
+        obj=base_context,
+    )
+    # THEN assert the command succedes
+    assert result.exit_code == 0
+    # THEN assert that the resources are in the metadata
+    assert '"wall_seconds"' in metadata_tmp_path.read_text()
+
+
+def test_compress_bam_profile_metadata(base_context, bam_tmp_file, cram_tmp_path):
+    """Test to compress a bam file with a CRAM profile and write metadata"""
+    # GIVEN a bam file, a non existing cram path and a cli runner
+    runner = CliRunner()
+    # WHEN running the compress bam command with the archive profile and metadata
+    result = runner.invoke(
+        bam,
+        [
+            "--bam-path",
+            str(bam_tmp_file),
+            "--cram-path",
+            str(cram_tmp_path),
+            "--cram-profile",
+            "archive",
+            "--metadata-file",
+        ],
+        obj=base_context,
+    )
+    # THEN assert the command succedes
+    assert result.exit_code == 0
+    # THEN assert that the profile is in the metadata
+    assert '"archive"' in cram_tmp_path.with_suffix(".json").read_text()
+
+
+def test_compress_bam_cram_option(base_context, bam_tmp_file, cram_tmp_path):
+    """Test to compress a bam file with a changed setting of the CRAM profile"""
+    # GIVEN a bam file, a non existing cram path and a cli runner
+    runner = CliRunner()
+    # WHEN running the compress bam command with a lower level than the archive profile
+    result = runner.invoke(
+        bam,
+        [
+            "--bam-path",
+            str(bam_tmp_file),
+            "--cram-path",
+            str(cram_tmp_path),
+            "--cram-profile",
+            "archive",
+            "--cram-option",
+            "level=5",
+            "--metadata-file",
+        ],
+        obj=base_context,
+    )
+    # THEN assert the command succedes and the changed level is in the metadata
+    assert result.exit_code == 0
+    assert '"level": 5' in cram_tmp_path.with_suffix(".json").read_text()
+
+
+def test_compress_bam_invalid_cram_option(base_context, bam_tmp_file, cram_tmp_path):
+    """Test that an unknown CRAM setting is rejected"""
+    # GIVEN a bam file, a non existing cram path and a cli runner
+    runner = CliRunner()
+    # WHEN running the compress bam command with a setting that does not exist
+    result = runner.invoke(
+        bam,
+        [
+            "--bam-path",
+            str(bam_tmp_file),
+            "--cram-path",
+            str(cram_tmp_path),
+            "--cram-option",
+            "x=1",
+        ],
+        obj=base_context,
+    )
+    # THEN assert the command fails
+    assert result.exit_code == 2
+
+
+def test_compress_bam_check_integrity(base_context, bam_tmp_file, cram_tmp_path):
+    """Test to compress a bam file and compare the records of the cram file with it"""
+    # GIVEN a bam file, a non existing cram path and a cli runner
+    runner = CliRunner()
+    # WHEN running the compress bam command with an integrity check
+    result = runner.invoke(
+        bam,
+        ["--bam-path", str(bam_tmp_file), "--cram-path", str(cram_tmp_path), "--check-integrity"],
+        obj=base_context,
+    )
+    # THEN assert the command succedes
+    assert result.exit_code == 0
+
+
+def test_compress_bam_check_integrity_fails(base_context, bam_tmp_file, cram_tmp_path):
+    """Test that a cram file with other records than the bam file is deleted"""
+    # GIVEN a cram api that creates a cram file with a record missing
+    runner = CliRunner()
+    cram_api = base_context["cram_api"]
+    cram_api.compress = lambda bam_path, cram_path, profile=None: cram_path.touch()
+    cram_api.records_fingerprint = lambda file_path, workers=1: (
+        f"{0:032x}{1:016x}" if file_path.suffix == ".bam" else f"{0:032x}{0:016x}"
+    )
+    # WHEN running the compress bam command with an integrity check
+    result = runner.invoke(
+        bam,
+        ["--bam-path", str(bam_tmp_file), "--cram-path", str(cram_tmp_path), "--check-integrity"],
+        obj=base_context,
+    )
+    # THEN assert the command fails and the cram file is deleted
+    assert result.exit_code == 1
+    assert not cram_tmp_path.exists()
@@ -213,3 +213,68 @@ def test_decompress_spring_with_fastq_failing_integrity_check(
     assert result.exit_code == 1
     # THEN assert that the fastq files are deleted since check failed
     assert not (first_tmp_path.exists() or second_tmp_path.exists())
+
+
+def test_decompress_cram_regions(base_context, cram_tmp_file, bam_tmp_path, tmp_path):
+    """Test to decompress the reads of a cram file that overlap regions"""
+    # GIVEN a cli runner and a BED file
+    runner = CliRunner()
+    bed_path = Path(tmp_path, "regions.bed")
+    bed_path.write_text("chrM\t0\t100\n")
+    # WHEN running the decompress cram command with a region and a regions file
+    result = runner.invoke(
+        cram,
+        [
+            str(cram_tmp_file),
+            "-b",
+            str(bam_tmp_path),
+            "--region",
+            "chr16:1-100",
+            "--regions-file",
+            str(bed_path),
+            "--index",
+        ],
+        obj=base_context,
+    )
+    # THEN assert the command succeeds
+    assert result.exit_code == 0
+
+
+def test_decompress_cram_invalid_region(base_context, cram_tmp_file, bam_tmp_path):
+    """Test that an invalid region is rejected"""
+    # GIVEN a cli runner
+    runner = CliRunner()
+    # WHEN running the decompress cram command with a region that ends before it starts
+    result = runner.invoke(
+        cram,
+        [str(cram_tmp_file), "-b", str(bam_tmp_path), "--region", "chrM:200-100"],
+        obj=base_context,
+    )
+    # THEN assert the command fails
+    assert result.exit_code == 2
+
+
+def test_decompress_spring_read_range(spring_tmp_file, first_tmp_path, base_context):
+    """Test to decompress a range of reads of the first mate"""
+    # GIVEN a cli runner
+    runner = CliRunner()
+    # WHEN running the decompress command with a read range and a mate
+    result = runner.invoke(
+        spring,
+        [str(spring_tmp_file), "-f", str(first_tmp_path), "--read-range", "1", "10", "--mate", "1"],
+        obj=base_context,
+    )
+    # THEN assert the command was succesful
+    assert result.exit_code == 0
+
+
+def test_decompress_spring_invalid_read_range(spring_tmp_file, base_context):
+    """Test that a read range that ends before it starts is rejected"""
+    # GIVEN a cli runner
+    runner = CliRunner()
+    # WHEN running the decompress command with the end before the start
+    result = runner.invoke(
+        spring, [str(spring_tmp_file), "--read-range", "10", "1"], obj=base_context
+    )
+    # THEN assert the command fails
+    assert result.exit_code == 2
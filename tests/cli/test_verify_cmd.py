@@ -0,0 +1,38 @@
+"""Tests for verify CLI"""
+
+import json
+
+from click.testing import CliRunner
+
+from crunchy.cli.verify_cmd import verify
+from crunchy.metadata import fetch_spring_metadata
+
+
+def test_verify(first_tmp_file, second_tmp_file, spring_tmp_path, metadata_tmp_path):
+    """Test to verify a pair of reads against metadata with chunk manifests"""
+    # GIVEN a metadata file with chunk manifests and a cli runner
+    metadata = fetch_spring_metadata(
+        first_tmp_file, second_tmp_file, spring_tmp_path, chunk_size=1024
+    )
+    metadata_tmp_path.write_text(json.dumps(metadata))
+    runner = CliRunner()
+    # WHEN verifying the reads
+    result = runner.invoke(
+        verify, [str(metadata_tmp_path), "-f", str(first_tmp_file), "-s", str(second_tmp_file)]
+    )
+    # THEN assert the command was succesful
+    assert result.exit_code == 0
+
+
+def test_verify_swapped_reads(first_read, second_read, spring_tmp_path, metadata_tmp_path):
+    """Test that verify fails when the reads differ from the metadata"""
+    # GIVEN a metadata file without chunk manifests and a cli runner
+    metadata = fetch_spring_metadata(first_read, second_read, spring_tmp_path)
+    metadata_tmp_path.write_text(json.dumps(metadata))
+    runner = CliRunner()
+    # WHEN verifying the reads in the wrong order
+    result = runner.invoke(
+        verify, [str(metadata_tmp_path), "-f", str(second_read), "-s", str(first_read)]
+    )
+    # THEN assert the command fails
+    assert result.exit_code == 1
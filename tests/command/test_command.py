@@ -1,5 +1,18 @@
 """Tests for the command module"""
 
+import asyncio
+import os
+import shutil
+from pathlib import Path
+from subprocess import CalledProcessError
+
+import pytest
+
+from crunchy.command import CramProcess, Process, ProgressEvent, SpringProcess
+from crunchy.integrity import SamSetHasher
+from crunchy.reference import ReferenceCache
+from crunchy.regions import Region
+
 
 def test_get_index_path_cram(cram_api, cram_tmp_path):
     """test to create a index path"""
@@ -21,3 +34,375 @@ def test_get_index_path_bam(cram_api, bam_tmp_path):
     # THEN assert that the index has the correct suffix
     assert index.suffix == ".bai"
     assert set(index.suffixes) == set([".bam", ".bai"])
+
+
+def test_run_command_streams_output():
+    """Test that output is read while the command runs and only the last lines are kept"""
+    # GIVEN a process that keeps two lines of output
+    process = Process("sh", max_output_lines=2)
+    # WHEN running a command that writes three lines to stdout and one to stderr
+    process.run_command(["-c", "echo one; echo two; echo three; echo error >&2"])
+    # THEN assert that the last two lines of stdout are kept
+    assert list(process.stdout_lines()) == ["two", "three"]
+    assert process.stderr == "error"
+
+
+def test_run_command_fails():
+    """Test that a command with a non zero exit code raises an error"""
+    # GIVEN a process
+    process = Process("sh")
+    # WHEN running a command that fails
+    # THEN assert that an error is raised with the output available
+    with pytest.raises(CalledProcessError):
+        process.run_command(["-c", "echo failed >&2; exit 1"])
+    assert process.stderr == "failed"
+
+
+def test_spring_progress_events():
+    """Test that the steps and timings that Spring writes are reported as they arrive"""
+    # GIVEN a spring process with a progress callback
+    events = []
+    process = SpringProcess("sh")
+    process.progress_callback = events.append
+    output = "Starting preprocessing...\\nPreprocessing done!\\nTime for this step: 2 s\\n"
+    output += "Reordering ...\\nTime for this step: 5 s\\nTotal time for compression: 7 s\\n"
+    # WHEN running a command that writes Spring output
+    process.run_command(["-c", f"printf '{output}'"])
+    # THEN assert that the progress events were parsed
+    assert events == [
+        ProgressEvent(step="preprocessing", status="started"),
+        ProgressEvent(step="preprocessing", status="finished", seconds=2.0),
+        ProgressEvent(step="reordering", status="started"),
+        ProgressEvent(step="reordering", status="finished", seconds=5.0),
+        ProgressEvent(step="compression", status="finished", seconds=7.0),
+    ]
+
+
+def test_run_command_async():
+    """Test to run several commands at the same time from one event loop"""
+    # GIVEN a process
+    process = Process("sh")
+
+    # WHEN running two commands concurrently
+    async def run_both():
+        return await asyncio.gather(
+            process.run_command_async(["-c", "echo first"]),
+            process.run_command_async(["-c", "echo second"]),
+        )
+
+    results = asyncio.run(run_both())
+    # THEN assert that each command got its own output
+    assert [result.stdout for result in results] == ["first", "second"]
+
+
+def test_run_command_async_cancel(project_dir):
+    """Test that cancelling a command kills its whole process group"""
+    # GIVEN a process and a command that starts a child that would write a file after a while
+    process = Process("sh")
+    marker = project_dir / "marker"
+    parameters = ["-c", f"(sleep 1; touch {marker}) & wait"]
+
+    # WHEN cancelling the command before the child is done
+    async def run_and_cancel():
+        task = asyncio.create_task(process.run_command_async(parameters))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(1.2)
+
+    asyncio.run(run_and_cancel())
+    # THEN assert that the child was killed as well
+    assert not marker.exists()
+
+
+def test_run_command_async_long_line(project_dir):
+    """Test that a line longer than the limit kills and reaps the whole process group"""
+    # GIVEN a process and a command that writes a too long line and starts a child that would
+    # write a file after a while
+    process = Process("sh")
+    marker = project_dir / "marker"
+    parameters = ["-c", f"(sleep 1; touch {marker}) & head -c 2000000 /dev/zero; wait"]
+
+    # WHEN running the command
+    async def run_and_wait():
+        with pytest.raises(ValueError):
+            await process.run_command_async(parameters)
+        await asyncio.sleep(1.2)
+
+    asyncio.run(run_and_wait())
+    # THEN assert that the child was killed as well
+    assert not marker.exists()
+
+
+def test_spring_progress_events_async():
+    """Test that commands running at the same time keep track of their own Spring steps"""
+    # GIVEN a spring process with a progress callback
+    events = []
+    process = SpringProcess("sh")
+    process.progress_callback = events.append
+    first = "printf 'Reordering ...\\n'; sleep 0.3; printf 'Time for this step: 1 s\\n'"
+    second = "sleep 0.1; printf 'Encoding ...\\n'; sleep 0.4; printf 'Time for this step: 2 s\\n'"
+
+    # WHEN running two commands that write Spring output concurrently
+    async def run_both():
+        await asyncio.gather(
+            process.run_command_async(["-c", first]),
+            process.run_command_async(["-c", second]),
+        )
+
+    asyncio.run(run_both())
+    # THEN assert that each step finished in the command that started it
+    assert [event for event in events if event.seconds] == [
+        ProgressEvent(step="reordering", status="finished", seconds=1.0),
+        ProgressEvent(step="encoding", status="finished", seconds=2.0),
+    ]
+
+
+def test_cram_parameters_are_shared(real_cram_api, bam_path, cram_tmp_path):
+    """Test that the blocking and async compress use the same parameters"""
+    # GIVEN a cram api for an old samtools and a process that records the parameters of each call
+    real_cram_api.version = (1, 9)
+    calls = []
+
+    async def record_async(parameters=None):
+        calls.append(parameters)
+
+    real_cram_api.run_command = calls.append
+    real_cram_api.run_command_async = record_async
+    # WHEN compressing blocking and async
+    real_cram_api.compress(bam_path, cram_tmp_path)
+    asyncio.run(real_cram_api.compress_async(bam_path, cram_tmp_path))
+    # THEN assert that the same commands were run
+    assert calls[:2] == calls[2:]
+
+
+def test_run_command_resources(project_dir):
+    """Test that the resources used by a command are recorded"""
+    # GIVEN a process and a directory that the command writes to
+    process = Process("sh")
+    # WHEN running a command that writes a file in the monitored directory
+    process.run_command(
+        ["-c", f"head -c 100000 /dev/zero > {project_dir}/tmp; sleep 0.2"],
+        monitor_dir=project_dir,
+    )
+    # THEN assert that the time and memory used are recorded
+    resources = process.last_result.resources
+    assert resources.wall_seconds >= 0.2
+    assert resources.user_seconds is not None
+    assert resources.max_rss_bytes > 0
+    # THEN assert that the peak usage of the directory is recorded
+    assert resources.working_dir_peak_bytes >= 100000
+
+
+def test_cram_compress_write_index(real_cram_api, bam_path, cram_tmp_path):
+    """Test that a new samtools writes the index in the same pass with several threads"""
+    # GIVEN a cram api for samtools 1.17 that records the parameters of each call
+    real_cram_api.run_command = lambda parameters: calls.append(parameters)
+    real_cram_api.stdout = "samtools 1.17\nUsing htslib 1.17"
+    calls = []
+    # WHEN compressing
+    real_cram_api.compress(bam_path, cram_tmp_path)
+    # THEN assert that the version was checked and samtools ran once more, threaded with an index
+    assert calls[0] == ["--version"]
+    assert len(calls) == 2
+    assert "--write-index" in calls[1]
+    assert calls[1][calls[1].index("-@") + 1] == str(real_cram_api.threads)
+
+
+def test_cram_compress_unknown_version(real_cram_api, bam_path, cram_tmp_path):
+    """Test that the index is created in a separate pass if the samtools version is unknown"""
+    # GIVEN a cram api where the version can not be parsed
+    calls = []
+    real_cram_api.run_command = calls.append
+    real_cram_api.stdout = ""
+    # WHEN compressing
+    real_cram_api.compress(bam_path, cram_tmp_path)
+    # THEN assert that the CRAM was indexed separately
+    assert real_cram_api.version == (0, 0)
+    assert calls[-1][0] == "index"
+
+
+def test_run_command_env():
+    """Test that the environment of a process is exported to its commands"""
+    # GIVEN a process with an environment variable
+    process = Process("sh")
+    process.env["CRUNCHY_TEST"] = "exported"
+    # WHEN running a command that prints the variable and one from the current environment
+    process.run_command(["-c", 'echo "$CRUNCHY_TEST"; echo "$PATH"'])
+    # THEN assert that both are set
+    assert list(process.stdout_lines())[0] == "exported"
+    assert list(process.stdout_lines())[1]
+
+
+def test_cram_reference_cache(real_cram_api, reference_path, cram_path, bam_tmp_path, tmp_path):
+    """Test that CRAM files are decoded with the reference cache instead of the FASTA"""
+    # GIVEN a cram api with a reference cache
+    tmp_reference = Path(tmp_path, "reference.fasta")
+    shutil.copy(reference_path, tmp_reference)
+    real_cram_api.reference_cache = ReferenceCache(tmp_reference, Path(tmp_path, "cache"))
+    # WHEN getting the parameters to decompress a CRAM file
+    parameters = real_cram_api.decompress_parameters(cram_path, bam_tmp_path)
+    # THEN assert that the cache was warmed and is used by samtools instead of the FASTA
+    assert "-T" not in parameters
+    assert real_cram_api.env["REF_CACHE"].startswith(str(Path(tmp_path, "cache")))
+    assert Path(tmp_reference.with_suffix(".fasta.fai")).exists()
+
+
+def test_run_command_stdout_consumer():
+    """Test that stdout can be streamed to a consumer instead of being kept"""
+    # GIVEN a process and a consumer
+    blocks = []
+    process = Process("sh")
+    # WHEN running a command with the consumer
+    process.run_command(["-c", "echo one; echo two"], stdout_consumer=blocks.append)
+    # THEN assert that the consumer got all output and it was not kept
+    assert b"".join(blocks) == b"one\ntwo\n"
+    assert process.stdout == ""
+
+
+def test_run_command_stdout_consumer_fails():
+    """Test that an error in the consumer is raised without blocking the command"""
+    # GIVEN a process and a consumer that fails
+    process = Process("sh")
+
+    def failing_consumer(block):
+        raise ValueError("Consumer failed")
+
+    # WHEN running a command that writes more than a pipe buffer
+    # THEN assert that the error of the consumer is raised
+    with pytest.raises(ValueError):
+        process.run_command(["-c", "head -c 1048576 /dev/zero"], stdout_consumer=failing_consumer)
+
+
+def test_records_fingerprint_keeps_error(real_cram_api, cram_path, monkeypatch):
+    """Test that a failing samtools call is not replaced by an error from the fingerprint"""
+    # GIVEN a cram api where samtools fails and a fingerprint that can not be finished
+
+    def failing_command(parameters=None, **kwargs):
+        raise CalledProcessError(1, parameters)
+
+    def broken_hexdigest(self):
+        raise RuntimeError("Broken worker pool")
+
+    monkeypatch.setattr(real_cram_api, "run_command", failing_command)
+    monkeypatch.setattr(SamSetHasher, "hexdigest", broken_hexdigest)
+    # WHEN creating the fingerprint of the records
+    # THEN assert that the error from samtools is raised
+    with pytest.raises(CalledProcessError):
+        real_cram_api.records_fingerprint(cram_path)
+
+
+def test_cram_records_parameters(real_cram_api, bam_path, cram_path):
+    """Test that CRAM records are decoded without calculating MD and NM"""
+    # GIVEN a cram api
+    # WHEN getting the parameters to write the records of a BAM and a CRAM file
+    bam_parameters = real_cram_api.records_parameters(bam_path)
+    cram_parameters = real_cram_api.records_parameters(cram_path)
+    # THEN assert that MD and NM are left out of both and only the CRAM needs the reference
+    assert bam_parameters[-1] == str(bam_path)
+    assert "-T" not in bam_parameters
+    assert "decode_md=0" in cram_parameters
+    assert cram_parameters.count("-x") == bam_parameters.count("-x") == 2
+
+
+def test_cram_decompress_regions(real_cram_api, cram_path, bam_tmp_path):
+    """Test that regions are decoded in parallel without writing reads twice and merged"""
+    # GIVEN a cram api for samtools 1.17 that records the parameters of each call
+    real_cram_api.version = (1, 17)
+    calls = []
+    real_cram_api.run_command = calls.append
+    regions = [Region("chrM", 1, 100), Region("chrM", 50, 200), Region("chrM", 1000, 2000)]
+    # WHEN decompressing the regions with an index
+    real_cram_api.decompress_regions(cram_path, bam_tmp_path, regions, index=True)
+    # THEN assert that the merged regions were decoded apart, and the second without the reads
+    # THEN that start in the first
+    views = [call for call in calls if call[0] == "view"]
+    assert [view[-1] for view in views] == ["chrM:1-200", "chrM:1000-2000"]
+    assert "-e" not in views[0]
+    assert views[1][views[1].index("-e") + 1] == "pos > 200"
+    # THEN assert that the parts were merged into the bam file and indexed
+    assert calls[-2][0] == "merge"
+    assert calls[-2][3:5] == [str(real_cram_api.threads), str(bam_tmp_path)]
+    assert calls[-1][0] == "index"
+
+
+def test_cram_decompress_regions_own_process(real_cram_api, cram_path, bam_tmp_path, monkeypatch):
+    """Test that the regions that are decoded in parallel are run by a process each"""
+    # GIVEN a cram api for samtools 1.17 that records the process that runs each command
+    real_cram_api.version = (1, 17)
+    processes = {}
+
+    def run_command(process, parameters=None, **kwargs):
+        processes[parameters[-1]] = process
+
+    monkeypatch.setattr(CramProcess, "run_command", run_command)
+    # WHEN decompressing two regions
+    real_cram_api.decompress_regions(
+        cram_path, bam_tmp_path, [Region("chrM", 1, 100), Region("chr16", 1, 100)]
+    )
+    # THEN assert that each region was decoded by its own copy of the cram api
+    assert processes["chrM:1-100"] is not processes["chr16:1-100"]
+    assert real_cram_api not in (processes["chrM:1-100"], processes["chr16:1-100"])
+
+
+def test_cram_decompress_regions_old_samtools(real_cram_api, cram_path, bam_tmp_path):
+    """Test that samtools without filter expressions decodes all regions in one process"""
+    # GIVEN a cram api for samtools 1.9
+    real_cram_api.version = (1, 9)
+    calls = []
+    real_cram_api.run_command = calls.append
+    # WHEN decompressing two regions
+    real_cram_api.decompress_regions(
+        cram_path, bam_tmp_path, [Region("chrM", 1, 100), Region("chr16", 1, 100)]
+    )
+    # THEN assert that one process read both regions with the multi region iterator
+    assert len(calls) == 1
+    assert "-M" in calls[0]
+    assert calls[0][-2:] == ["chrM:1-100", "chr16:1-100"]
+
+
+def test_spring_decompress_range_parameters(first_read, second_read, spring_path):
+    """Test that a read range is passed to spring, and gzip is used if any output is gzipped"""
+    # GIVEN a spring process
+    process = SpringProcess("spring")
+    # WHEN getting the parameters to decompress a range to /dev/null and a gzipped file
+    parameters = process.decompress_parameters(
+        spring_path, Path(os.devnull), second_read, read_range=(1, 100)
+    )
+    # THEN assert that the range is given and the output is gzipped
+    assert parameters[-3:] == ["--decompress-range", "1", "100"]
+    assert "-g" in parameters
+
+
+def test_spring_compress_own_working_dir(tmp_path, first_read, second_read, spring_path):
+    """Test that each spring run gets a working directory of its own, which is monitored"""
+    # GIVEN a spring process with a temporary directory shared with another job
+    (tmp_path / "other_job").write_text("files of another job")
+    process = SpringProcess("spring", tmp_dir=str(tmp_path))
+    calls = []
+
+    def record(parameters, monitor_dir=None):
+        calls.append((parameters, monitor_dir, Path(monitor_dir).is_dir()))
+        process.stdout, process.stderr = "compression done", ""
+
+    process.run_command = record
+    # WHEN compressing
+    process.compress(first_read, second_read, spring_path)
+    # THEN assert that spring worked in, and only the disk usage of, a new directory in tmp
+    parameters, monitor_dir, existed = calls[0]
+    assert existed
+    assert Path(monitor_dir).parent == tmp_path
+    assert parameters[-2:] == ["--working-dir", monitor_dir]
+    # THEN assert that the working directory is removed when spring is done
+    assert not Path(monitor_dir).exists()
+    assert [path.name for path in tmp_path.iterdir()] == ["other_job"]
+
+
+def test_spring_without_range_support():
+    """Test that a spring without --decompress-range in its help does not support ranges"""
+    # GIVEN a binary that does not know the option
+    process = SpringProcess("true")
+    # WHEN checking for range support
+    # THEN assert that it is not supported
+    assert process.supports_decompress_range() is False
@@ -1,5 +1,7 @@
 """Base conftest file."""
 
+import copy
+import gzip
 import logging
 import shutil
 import sys
@@ -8,7 +10,7 @@ from typing import Generator
 
 import pytest
 
-from crunchy.command import CramProcess, SpringProcess
+from crunchy.command import CramProcess, ProcessResult, ResourceUsage, SpringProcess
 from crunchy.integrity import get_checksum
 
 LOG = logging.getLogger(__name__)
@@ -66,6 +68,12 @@ def fixture_second_read(fixtures_dir: Path) -> Path:
     return Path(fixtures_dir, "fastq", "TEST_R2_001.fq.gz")
 
 
+@pytest.fixture(name="bgzf_first_read")
+def fixture_bgzf_first_read(fixtures_dir: Path) -> Path:
+    """Return the path to the first read in read pair compressed with BGZF."""
+    return Path(fixtures_dir, "bgzf", "first_read.fastq.gz")
+
+
 @pytest.fixture(name="spring_path")
 def fixture_spring_path(fixtures_dir: Path) -> Path:
     """Return the path to a Spring compressed file."""
@@ -220,6 +228,8 @@ class MockSpringProcess:
         self._create_output = False
         self._fastq1 = None
         self._fastq2 = None
+        self.last_result = None
+        self.range_support = True
 
     @staticmethod
     def run_command(parameters=None):
@@ -227,16 +237,32 @@ class MockSpringProcess:
         LOG.info("Running command %s", " ".join(parameters))
         return 0
 
-    def decompress(self, spring_path: Path, first: Path, second: Path) -> bool:
+    def supports_decompress_range(self) -> bool:
+        """Mock if spring can decompress a range of reads."""
+        return self.range_support
+
+    def decompress(self, spring_path: Path, first: Path, second: Path, read_range=None) -> bool:
         """Run the spring decompress command."""
         parameters = ["-d", "-i", spring_path.as_posix(), "-o", first.as_posix(), second.as_posix()]
+        if read_range:
+            parameters.extend(["--decompress-range", str(read_range[0]), str(read_range[1])])
         self.run_command(parameters)
         if self._create_output:
             LOG.info(f"Create output fastq files {self._fastq1} and {self._fastq2}")
-            shutil.copy(str(self._fastq1), first.as_posix())
-            shutil.copy(str(self._fastq2), second.as_posix())
+            self.write_output(self._fastq1, first)
+            self.write_output(self._fastq2, second)
         return True
 
+    @staticmethod
+    def write_output(fastq: Path, outfile: Path):
+        """Write a fastq file like spring does, unzipped unless the outfile is gzipped.
+
+        The output is written with open so that named pipes can be used as outfiles.
+        """
+        opener = gzip.open if fastq.suffix == ".gz" and outfile.suffix != ".gz" else open
+        with opener(fastq, "rb") as infile, open(outfile, "wb") as out:
+            shutil.copyfileobj(infile, out)
+
     def compress(self, first: Path, second: Path, outfile: Path) -> bool:
         """Run the spring compression command."""
         parameters = [
@@ -250,6 +276,8 @@ class MockSpringProcess:
             str(self.threads),
         ]
         self.run_command(parameters)
+        outfile.touch()
+        self.last_result = ProcessResult(0, "", "", ResourceUsage(wall_seconds=0.0))
         return True
 
 
@@ -262,6 +290,7 @@ class MockCramProcess:
         self.refgenome_path = refgenome_path
         self.threads = threads
         self.base_call = [self.binary]
+        self.last_result = None
 
     @staticmethod
     def run_command(parameters=None) -> int:
@@ -288,9 +317,15 @@ class MockCramProcess:
         self.run_command(parameters)
         return True
 
-    def compress(self, bam_path: Path, cram_path: Path) -> bool:
+    def decompress_regions(self, cram_path: Path, bam_path: Path, regions, index=False) -> bool:
+        """Convert the reads of a CRAM that overlap regions to BAM."""
+        LOG.info("Decompressing %s regions of cram %s to bam %s", len(regions), cram_path, bam_path)
+        self.run_command(["view", "-b", "-o", bam_path.as_posix(), cram_path.as_posix()])
+        return True
+
+    def compress(self, bam_path: Path, cram_path: Path, profile=None) -> bool:
         """Convert BAM to CRAM."""
-        LOG.info(f"Compressing bam {bam_path} to cram {cram_path}")
+        LOG.info(f"Compressing bam {bam_path} to cram {cram_path} with profile {profile}")
         parameters = [
             "view",
             "-C",
@@ -313,6 +348,22 @@ class MockCramProcess:
         self.run_command(parameters)
         return True
 
+    @staticmethod
+    def get_index_path(file_path: Path) -> Path:
+        """Return the index path of a file."""
+        index_suffix = ".bai" if file_path.suffix == ".bam" else ".crai"
+        return file_path.with_suffix(file_path.suffix + index_suffix)
+
+    @staticmethod
+    def records_fingerprint(file_path: Path, workers: int = 1) -> str:
+        """Mock the fingerprint of the records in a file, the same for all files."""
+        LOG.info("Creating fingerprint of the records in %s", file_path)
+        return f"{0:032x}{1:016x}"
+
+    def clone(self) -> "MockCramProcess":
+        """Mock a copy of the process to run a command in another thread."""
+        return copy.copy(self)
+
     @staticmethod
     def self_check():
         """Mocks the self test."""
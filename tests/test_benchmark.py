@@ -0,0 +1,80 @@
+"""Tests for benchmark module"""
+
+import gzip
+
+from crunchy.benchmark import (
+    benchmark_checksum,
+    benchmark_cram,
+    benchmark_cram_calls,
+    benchmark_inflate,
+    get_legacy_checksum,
+)
+
+
+def test_legacy_checksum(first_read, checksum_first_read):
+    """Test that the legacy checksum loop gives the same checksum as the engine"""
+    # GIVEN a fastq file and the corresponding sha256 checksum
+
+    # WHEN generating the checksum with the legacy loop
+    res = get_legacy_checksum(first_read)
+
+    # THEN assert that the checksums are the same
+    assert res == checksum_first_read
+
+
+def test_benchmark_checksum(first_read, checksum_first_read):
+    """Test to benchmark the checksum methods"""
+    # GIVEN a fastq file and the corresponding sha256 checksum
+
+    # WHEN benchmarking the checksum methods
+    res = benchmark_checksum(first_read)
+
+    # THEN assert that there is one result per method
+    assert len(res) == 2
+    # THEN assert that all methods produced the same checksum
+    for result in res:
+        assert result["checksum"] == checksum_first_read
+        assert result["mib_per_second"] > 0
+
+
+def test_benchmark_inflate(first_read):
+    """Test to benchmark the zlib inflate backend"""
+    # GIVEN a gzipped fastq file and its unzipped size
+    with gzip.open(first_read, "rb") as infile:
+        unzipped_size = len(infile.read())
+
+    # WHEN benchmarking unzipping with zlib
+    res = benchmark_inflate(first_read, backends=["zlib"])
+
+    # THEN assert that the whole file was unzipped
+    assert len(res) == 1
+    assert res[0]["backend"] == "zlib"
+    assert res[0]["unzipped_bytes"] == unzipped_size
+
+
+def test_benchmark_cram_calls(bam_path, cram_api):
+    """Test to benchmark the samtools call patterns"""
+    # GIVEN a bam file and a cram api
+
+    # WHEN benchmarking the call patterns
+    res = benchmark_cram_calls(bam_path, cram_api)
+
+    # THEN assert that there is one result per call pattern
+    assert len(res) == 2
+    assert all(result["seconds"] >= 0 for result in res)
+
+
+def test_benchmark_cram(bam_path, real_cram_api):
+    """Test to benchmark the CRAM profiles"""
+    # GIVEN a bam file and a cram api that records the commands instead of running them
+    calls = []
+    real_cram_api.run_command = calls.append
+
+    # WHEN benchmarking two profiles
+    res = benchmark_cram(bam_path, real_cram_api, profiles=["fast", "archive"])
+
+    # THEN assert that there is one result per profile
+    assert [result["profile"] for result in res] == ["fast", "archive"]
+    # THEN assert that each profile was compressed with its options and decompressed
+    assert len(calls) == 4
+    assert "cram,version=3.0,fast,level=1" in calls[0]
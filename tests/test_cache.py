@@ -0,0 +1,100 @@
+"""Tests for the checksum cache module"""
+
+import os
+from pathlib import Path
+
+import pytest
+
+from crunchy.cache import (
+    ChecksumCache,
+    SqliteChecksumCache,
+    XattrChecksumCache,
+    get_file_identity,
+)
+
+
+@pytest.fixture(name="cached_file")
+def fixture_cached_file(project_dir: Path) -> Path:
+    """Return the path to a file to cache checksums for."""
+    cached_file = project_dir / "cached.txt"
+    cached_file.write_text("content")
+    return cached_file
+
+
+def test_sqlite_cache(project_dir, cached_file):
+    """Test to store and fetch a checksum in a SQLite cache"""
+    # GIVEN a SQLite cache and the identity of a file
+    cache = SqliteChecksumCache(project_dir / "cache.sqlite")
+    identity = get_file_identity(cached_file)
+
+    # WHEN storing a checksum
+    cache.set(identity, "sha256", cached_file, "a_checksum")
+
+    # THEN assert that the checksum is found for the same file and algorithm
+    assert cache.get(identity, "sha256", cached_file) == "a_checksum"
+    # THEN assert that there is no checksum for another algorithm
+    assert cache.get(identity, "md5", cached_file) is None
+
+
+def test_sqlite_cache_modified_file(project_dir, cached_file):
+    """Test that a modified file is not found in the cache"""
+    # GIVEN a SQLite cache with a checksum for a file
+    cache = SqliteChecksumCache(project_dir / "cache.sqlite")
+    cache.set(get_file_identity(cached_file), "sha256", cached_file, "a_checksum")
+
+    # WHEN the file is modified
+    cached_file.write_text("new content")
+
+    # THEN assert that the old checksum is not returned
+    assert cache.get(get_file_identity(cached_file), "sha256", cached_file) is None
+
+
+def test_sqlite_cache_eviction(project_dir, cached_file):
+    """Test that the least recently used entries are evicted"""
+    # GIVEN a SQLite cache with room for one entry and a cached checksum
+    cache = SqliteChecksumCache(project_dir / "cache.sqlite", max_entries=1)
+    identity = get_file_identity(cached_file)
+    cache.set(identity, "md5", cached_file, "a_md5")
+
+    # WHEN storing another checksum
+    cache.set(identity, "sha256", cached_file, "a_sha256")
+
+    # THEN assert that the first checksum was evicted
+    assert cache.get(identity, "md5", cached_file) is None
+    assert cache.get(identity, "sha256", cached_file) == "a_sha256"
+
+
+def test_xattr_cache(cached_file):
+    """Test to store and fetch a checksum in extended attributes"""
+    # GIVEN a file system that supports user extended attributes
+    try:
+        os.setxattr(cached_file, "user.crunchy.test", b"test")
+    except OSError:
+        pytest.skip("File system does not support user extended attributes")
+    cache = XattrChecksumCache()
+    identity = get_file_identity(cached_file)
+
+    # WHEN storing a checksum
+    cache.set(identity, "sha256", cached_file, "a_checksum")
+
+    # THEN assert that the checksum is found for the file
+    assert cache.get(identity, "sha256", cached_file) == "a_checksum"
+    # THEN assert that the checksum is outdated if the file changes
+    cached_file.write_text("new content")
+    assert cache.get(get_file_identity(cached_file), "sha256", cached_file) is None
+
+
+def test_incomplete_cache():
+    """Test that a cache without all methods can not be created"""
+    # GIVEN a cache class that does not implement set
+
+    class GetOnlyCache(ChecksumCache):
+        """Cache that only implements get"""
+
+        def get(self, identity, algorithm, infile):
+            return None
+
+    # WHEN creating the cache
+    # THEN assert it fails
+    with pytest.raises(TypeError):
+        GetOnlyCache()
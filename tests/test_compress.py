@@ -4,7 +4,12 @@ import pathlib
 import tempfile
 
 from crunchy.command import CramProcess, SpringProcess
-from crunchy.compress import compress_cram, compress_spring
+from crunchy.compress import (
+    check_cram_integrity,
+    compress_cram,
+    compress_spring,
+    get_partial_path,
+)
 
 
 def test_compress_spring(first_read, second_read, spring_api: SpringProcess):
@@ -23,6 +28,30 @@ def test_compress_spring(first_read, second_read, spring_api: SpringProcess):
     assert res is True
 
 
+def test_compress_spring_failed_leaves_no_files(
+    first_read, second_read, spring_tmp_path, spring_api: SpringProcess, monkeypatch
+):
+    """Test that a failed compression leaves neither a partial nor a final spring file."""
+
+    # GIVEN a spring api that writes part of the output and then fails
+    def failed_compress(first, second, outfile):
+        outfile.write_text("part of a spring file")
+        return False
+
+    monkeypatch.setattr(spring_api, "compress", failed_compress)
+    # WHEN running the compression
+    res = compress_spring(
+        first_read=first_read,
+        second_read=second_read,
+        outfile=spring_tmp_path,
+        spring_api=spring_api,
+    )
+    # THEN assert that the run failed and that no spring file was left behind
+    assert res is False
+    assert not spring_tmp_path.exists()
+    assert not get_partial_path(spring_tmp_path).exists()
+
+
 def test_compress_spring_dry_run(first_read, second_read, spring_api: SpringProcess):
     """Test the compress function."""
     # GIVEN two files with reads from read pair, a spring api and a outfile
@@ -56,3 +85,21 @@ def test_compress_cram_dry_run(bam_path, cram_api: CramProcess, cram_path):
     res = compress_cram(bam_path=bam_path, cram_path=cram_path, cram_api=cram_api, dry_run=True)
     # THEN assert that the run was successful
     assert res is True
+
+
+def test_check_cram_integrity_own_process(bam_path, cram_path, real_cram_api, monkeypatch):
+    """Test that the bam and cram files are fingerprinted by a process each"""
+    # GIVEN a cram api that records which process fingerprints each file
+    processes = {}
+
+    def records_fingerprint(process, file_path, workers=1):
+        processes[file_path] = process
+        return f"{0:032x}{1:016x}"
+
+    monkeypatch.setattr(CramProcess, "records_fingerprint", records_fingerprint)
+    # WHEN checking that the records of the files are the same
+    res = check_cram_integrity(bam_path, cram_path, real_cram_api)
+    # THEN assert that the files were read by two copies of the cram api
+    assert res is True
+    assert processes[bam_path] is not processes[cram_path]
+    assert real_cram_api not in processes.values()
@@ -1,8 +1,12 @@
 """Tests for decompress functions."""
 
+import gzip
+import hashlib
+import os
 from pathlib import Path
 
-from crunchy.decompress import decompress_cram, decompress_spring
+from crunchy import decompress
+from crunchy.decompress import decompress_cram, decompress_spring, decompress_spring_to_checksums
 from crunchy.files import spring_outpath
 from tests.conftest import MockCramProcess, MockSpringProcess
 
@@ -61,3 +65,115 @@ def test_decompress_cram_dry_run(cram_path: Path, bam_path: Path, cram_api: Mock
 
     # THEN assert that the process returns true
     assert res is True
+
+
+def test_decompress_spring_to_checksums(
+    first_read: Path,
+    second_read: Path,
+    spring_api: MockSpringProcess,
+    checksum_first_read: str,
+    checksum_second_read: str,
+):
+    """Test to decompress a spring file into named pipes and get the checksums."""
+    # GIVEN a spring api that decompresses to the original reads
+    spring_path = spring_outpath(first_read)
+    spring_api._create_output = True
+    spring_api._fastq1 = first_read
+    spring_api._fastq2 = second_read
+
+    # WHEN decompressing into named pipes
+    res = decompress_spring_to_checksums(
+        spring_path=spring_path, spring_api=spring_api, algorithms=["sha256"]
+    )
+
+    # THEN assert that the checksums are the same as for the original reads
+    assert res == [{"sha256": checksum_first_read}, {"sha256": checksum_second_read}]
+
+
+def test_decompress_spring_to_checksums_split_fingerprint_workers(
+    first_read: Path, spring_api: MockSpringProcess, monkeypatch
+):
+    """Test that the fingerprint processes are split between the two reads"""
+    # GIVEN eight processes for fingerprints and a recorder of the hash objects asked for
+    monkeypatch.setattr(decompress, "DEFAULT_FINGERPRINT_WORKERS", 8)
+    workers = []
+
+    def record_hash_obj(algorithm, fingerprint_workers):
+        workers.append(fingerprint_workers)
+        return hashlib.sha256()
+
+    monkeypatch.setattr(decompress, "get_hash_obj", record_hash_obj)
+
+    # WHEN decompressing into named pipes with the fastq-set fingerprint
+    decompress_spring_to_checksums(
+        spring_path=spring_outpath(first_read), spring_api=spring_api, algorithms=["fastq-set"]
+    )
+
+    # THEN assert that each read gets half of the processes
+    assert workers == [4, 4]
+
+
+def test_decompress_spring_to_checksums_no_output(first_read: Path, spring_api: MockSpringProcess):
+    """Test that decompressing into named pipes does not hang when nothing is written."""
+    # GIVEN a spring api that does not write any output
+    spring_path = spring_outpath(first_read)
+
+    # WHEN decompressing into named pipes
+    res = decompress_spring_to_checksums(
+        spring_path=spring_path, spring_api=spring_api, algorithms=["sha256"]
+    )
+
+    # THEN assert that the checksums are for empty files
+    assert res == [{"sha256": hashlib.sha256().hexdigest()} for _ in range(2)]
+
+
+def test_decompress_spring_range_truncated(
+    first_read: Path, second_read: Path, spring_api: MockSpringProcess, tmp_path: Path
+):
+    """Test that a range of reads is cut from the output of a spring that can not do it itself."""
+    # GIVEN a spring api without range support that decompresses to the original reads
+    spring_api.range_support = False
+    spring_api._create_output = True
+    spring_api._fastq1 = first_read
+    spring_api._fastq2 = second_read
+    first = Path(tmp_path, "first.fastq")
+    second = Path(tmp_path, "second.fastq")
+
+    # WHEN decompressing the second and third read of the first mate
+    res = decompress_spring(
+        spring_path=spring_outpath(first_read),
+        first=first,
+        second=second,
+        spring_api=spring_api,
+        read_range=(2, 3),
+        mate=1,
+    )
+
+    # THEN assert that only those two records were written, and nothing for the second mate
+    assert res is True
+    lines = gzip.decompress(first_read.read_bytes()).splitlines(keepends=True)
+    assert first.read_bytes() == b"".join(lines[4:12])
+    assert not second.exists()
+
+
+def test_decompress_spring_range_in_spring(
+    first_read: Path, second_read: Path, spring_api: MockSpringProcess, monkeypatch
+):
+    """Test that spring decompresses the range itself when it can, and a mate to /dev/null."""
+    # GIVEN a spring api with range support that records its calls
+    calls = []
+    monkeypatch.setattr(spring_api, "run_command", calls.append)
+
+    # WHEN decompressing a range of the second mate
+    decompress_spring(
+        spring_path=spring_outpath(first_read),
+        first=first_read,
+        second=second_read,
+        spring_api=spring_api,
+        read_range=(1, 1000),
+        mate=2,
+    )
+
+    # THEN assert that spring got the range and wrote the first mate to /dev/null
+    assert calls[0][-3:] == ["--decompress-range", "1", "1000"]
+    assert calls[0][4] == os.devnull
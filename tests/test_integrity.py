@@ -1,8 +1,23 @@
 """Tests for integrity module"""
 
+import gzip
 import hashlib
 
-from crunchy.integrity import get_checksum
+import pytest
+
+from crunchy import integrity
+from crunchy.cache import SqliteChecksumCache
+from crunchy.integrity import (
+    get_available_inflate_backends,
+    get_checksum,
+    get_checksums,
+    get_checksums_concurrently,
+    is_bgzf,
+    iter_bgzf_inflated,
+    open_gzipped,
+    resolve_inflate_backend,
+)
+from crunchy.manifest import ChunkHasher
 
 
 def test_generate_md5(dummy_file_path):
@@ -57,3 +72,382 @@ def test_generate_checksum_read_1(first_read, checksum_first_read):
 
     # THEN assert that the checksums are the same
     assert res == checksum_first_read
+
+
+def test_checksum_small_buffer(first_read, checksum_first_read):
+    """Test that the checksum of a gzipped file does not depend on the buffer size"""
+    # GIVEN a fastq file and the corresponding sha256 checksum
+
+    # WHEN generating a checksum with a buffer smaller than the file
+    res = get_checksum(first_read, buffer_size=1000)
+
+    # THEN assert that the checksums are the same
+    assert res == checksum_first_read
+
+
+def test_checksum_mmap_small_buffer(dummy_file_path):
+    """Test to generate a checksum for an uncompressed file in several slices"""
+    # GIVEN an uncompressed file and a calculated sha256
+    with open(dummy_file_path, "rb") as infile:
+        content = infile.read()
+    sha256 = hashlib.sha256(content).hexdigest()
+
+    # WHEN generating a checksum with a buffer smaller than the file
+    res = get_checksum(dummy_file_path, buffer_size=3)
+
+    # THEN the checksum is correct
+    assert res == sha256
+
+
+def test_checksum_empty_file(project_dir):
+    """Test to generate a checksum for an empty file, which can not be memory mapped"""
+    # GIVEN an empty file
+    empty_file = project_dir / "empty.txt"
+    empty_file.touch()
+
+    # WHEN generating a checksum
+    res = get_checksum(empty_file)
+
+    # THEN the checksum is the one of no content
+    assert res == hashlib.sha256().hexdigest()
+
+
+def test_get_checksums_multiple_algorithms(first_read, checksum_first_read):
+    """Test to generate several checksums in one pass"""
+    # GIVEN a fastq file and the corresponding sha256 checksum
+    md5 = get_checksum(first_read, "md5")
+
+    # WHEN generating a md5 and a sha256 at the same time
+    res = get_checksums(first_read, ["md5", "sha256"])
+
+    # THEN assert that one checksum per algorithm is returned
+    assert res == {"md5": md5, "sha256": checksum_first_read}
+
+
+def test_get_checksums_concurrently(
+    first_read, second_read, checksum_first_read, checksum_second_read
+):
+    """Test to generate checksums for two files at the same time"""
+    # GIVEN two fastq files and their sha256 checksums
+
+    # WHEN generating the checksums in a thread pool
+    res = get_checksums_concurrently([first_read, second_read], ["sha256"], workers=2)
+
+    # THEN assert that the checksums are returned in the same order as the files
+    assert res == [{"sha256": checksum_first_read}, {"sha256": checksum_second_read}]
+
+
+def test_get_checksums_cached(first_tmp_file, checksum_first_read, project_dir, monkeypatch):
+    """Test that checksums are taken from the cache for an unchanged file"""
+    # GIVEN a fastq file, its checksum and a checksum cache
+    cache = SqliteChecksumCache(project_dir / "cache.sqlite")
+
+    # GIVEN that the checksum was created with the cache
+    assert get_checksum(first_tmp_file, cache=cache) == checksum_first_read
+
+    # WHEN creating the checksum again without being able to read the file
+    monkeypatch.setattr(integrity, "create_checksums", None)
+    res = get_checksum(first_tmp_file, cache=cache)
+
+    # THEN assert that the checksum was found in the cache
+    assert res == checksum_first_read
+
+
+def test_is_bgzf(bgzf_first_read, first_read):
+    """Test to detect BGZF files"""
+    # GIVEN a BGZF file and a file gzipped as one member
+
+    # WHEN checking if the files are BGZF
+    # THEN assert that only the BGZF file is detected
+    assert is_bgzf(bgzf_first_read) is True
+    assert is_bgzf(first_read) is False
+
+
+def test_iter_bgzf_inflated(bgzf_first_read, first_read):
+    """Test to unzip a BGZF file in chunks of blocks"""
+    # GIVEN a BGZF file with the same content as a gzipped fastq file
+    with gzip.open(first_read, "rb") as infile:
+        content = infile.read()
+
+    # WHEN unzipping the BGZF file with chunks smaller than a block
+    chunks = list(iter_bgzf_inflated(bgzf_first_read, workers=3, chunk_size=1000))
+
+    # THEN assert that the chunks are returned in order
+    assert b"".join(chunks) == content
+
+
+def test_checksum_bgzf_parallel(bgzf_first_read, checksum_first_read):
+    """Test that unzipping BGZF blocks in parallel gives the same checksum"""
+    # GIVEN a BGZF file with the same content as the first read
+
+    # WHEN generating the checksum with several inflate workers
+    res = get_checksum(bgzf_first_read, inflate_workers=4, buffer_size=100000)
+
+    # THEN assert that the checksum is the same as for the serially unzipped file
+    assert res == checksum_first_read
+    assert get_checksum(bgzf_first_read, inflate_workers=1) == checksum_first_read
+
+
+def test_checksum_bgzf_with_plain_member_consumers(bgzf_first_read, project_dir):
+    """Test that a BGZF file with a later plain gzip member is read serially with consumers"""
+    # GIVEN a BGZF file with a plain gzip member appended
+    extra_record = b"@extra\nACGT\n+\nIIII\n"
+    mixed_path = project_dir / "mixed.fastq.gz"
+    mixed_path.write_bytes(bgzf_first_read.read_bytes() + gzip.compress(extra_record))
+    content = gzip.decompress(mixed_path.read_bytes())
+    # GIVEN consumers for chunk checksums and FASTQ statistics
+    hasher = ChunkHasher(chunk_size=1000)
+    stats = integrity.FastqStats()
+
+    # WHEN generating the checksum with several inflate workers
+    res = get_checksums(
+        mixed_path,
+        ["sha256"],
+        inflate_workers=4,
+        buffer_size=100000,
+        consumers=[hasher, stats],
+    )
+
+    # THEN assert that the checksum and the consumers only saw the content once
+    assert res["sha256"] == hashlib.sha256(content).hexdigest()
+    assert hasher.manifest()["size"] == len(content)
+    assert stats.stats()["reads"] == content.count(b"\n") // 4
+
+
+def test_available_inflate_backends():
+    """Test that zlib is always an available inflate backend"""
+    # GIVEN any environment
+
+    # WHEN fetching the available inflate backends
+    res = get_available_inflate_backends()
+
+    # THEN assert that zlib is available as the last resort
+    assert res[-1] == "zlib"
+    # THEN assert that auto resolves to the preferred backend that runs in this process
+    assert (
+        resolve_inflate_backend("auto")
+        == [backend for backend in res if backend in integrity.AUTO_INFLATE_BACKENDS][0]
+    )
+
+
+def test_auto_inflate_backend_no_subprocess(monkeypatch):
+    """Test that auto does not switch to a subprocess backend that is in PATH"""
+    # GIVEN that the pigz backend runs gzip, which is in PATH
+    monkeypatch.setitem(integrity.INFLATE_COMMANDS, "pigz", ["gzip", "-dc"])
+    # WHEN resolving the auto backend
+    res = resolve_inflate_backend("auto")
+    # THEN assert that an in process backend is used
+    assert res in integrity.AUTO_INFLATE_BACKENDS
+
+
+def test_checksum_subprocess_backend(first_read, checksum_first_read, monkeypatch):
+    """Test to generate a checksum when unzipping with a subprocess"""
+    # GIVEN a fastq file and its checksum
+    # GIVEN that the pigz backend runs gzip
+    monkeypatch.setitem(integrity.INFLATE_COMMANDS, "pigz", ["gzip", "-dc"])
+    assert "pigz" in get_available_inflate_backends()
+
+    # WHEN generating the checksum with the pigz backend
+    res = get_checksum(first_read, inflate_backend="pigz")
+
+    # THEN assert that the checksum is the same as with zlib
+    assert res == checksum_first_read
+
+
+def test_open_gzipped_subprocess_stop_early(first_read, monkeypatch):
+    """Test that a subprocess backend that is not read to the end is stopped without errors"""
+    # GIVEN that the pigz backend runs gzip
+    monkeypatch.setitem(integrity.INFLATE_COMMANDS, "pigz", ["gzip", "-dc"])
+
+    # WHEN only reading the first line of a gzipped file
+    with open_gzipped(first_read, backend="pigz") as content:
+        first_line = content.readline()
+
+    # THEN assert that the first line is a fastq header
+    assert first_line.startswith(b"@")
+
+
+def test_open_gzipped_subprocess_much_stderr(first_read, checksum_first_read, monkeypatch):
+    """Test that a subprocess backend that writes more than a pipe buffer to stderr is read"""
+    # GIVEN that the pigz backend writes 1 MiB to stderr before unzipping the file
+    script = 'head -c 1048576 /dev/zero >&2; gzip -dc "$0"'
+    monkeypatch.setitem(integrity.INFLATE_COMMANDS, "pigz", ["sh", "-c", script])
+
+    # WHEN generating the checksum with the pigz backend
+    res = get_checksum(first_read, inflate_backend="pigz")
+
+    # THEN assert that the checksum is the same as with zlib
+    assert res == checksum_first_read
+
+
+def test_compare_files_identical(first_read, project_dir):
+    """Test that a gzipped file is identical to its unzipped content"""
+    # GIVEN a gzipped file and an uncompressed copy of it
+    uncompressed = project_dir / "reads.fastq"
+    uncompressed.write_bytes(gzip.decompress(first_read.read_bytes()))
+    # WHEN comparing the files with a small buffer
+    difference = integrity.compare_files(first_read, uncompressed, buffer_size=1000)
+    # THEN assert that they are identical
+    assert difference is None
+
+
+def test_compare_files_first_difference(project_dir):
+    """Test that the offset and FASTQ record of the first difference are found"""
+    # GIVEN two FASTQ files that differ in one base of the third record
+    record = b"@read\nACGT\n+\nIIII\n"
+    first = project_dir / "first.fastq"
+    first.write_bytes(record * 10)
+    changed = bytearray(record * 10)
+    changed[2 * len(record) + 8] = ord("N")
+    second = project_dir / "second.fastq"
+    second.write_bytes(changed)
+    # WHEN comparing the files with a buffer smaller than the files
+    difference = integrity.compare_files(first, second, buffer_size=16)
+    # THEN assert that the difference is found in the third record
+    assert difference == integrity.Difference(
+        reason="content", offset=2 * len(record) + 8, record=3
+    )
+
+
+def test_compare_files_sizes_differ(project_dir):
+    """Test that uncompressed files of different sizes differ without being read"""
+    # GIVEN two uncompressed files of different size
+    first = project_dir / "first.fastq"
+    first.write_bytes(b"ACGT")
+    second = project_dir / "second.fastq"
+    second.write_bytes(b"ACG")
+    # WHEN comparing the files
+    difference = integrity.compare_files(first, second)
+    # THEN assert that they differ by size
+    assert difference.reason == "size"
+
+
+def test_compare_files_gzipped_truncated(first_read, project_dir):
+    """Test that a truncated copy differs at the end of the copy"""
+    # GIVEN a gzipped file and a gzipped copy that lacks the last byte
+    content = gzip.decompress(first_read.read_bytes())
+    truncated = project_dir / "truncated.fastq.gz"
+    truncated.write_bytes(gzip.compress(content[:-1]))
+    # WHEN comparing the files
+    difference = integrity.compare_files(first_read, truncated)
+    # THEN assert that the difference is at the last byte
+    assert difference.offset == len(content) - 1
+
+
+def test_fastq_stats():
+    """Test that FASTQ statistics do not depend on how the content is chunked"""
+    # GIVEN FASTQ content with reads of two lengths
+    content = b"@read1\nACGT\n+\nIIII\n@read2\nACG\n+\nIII\n@read3\nACGT\n+\nIIII\n"
+    # WHEN collecting statistics from the whole content and from small chunks
+    whole = integrity.FastqStats()
+    whole.update(content)
+    chunked = integrity.FastqStats()
+    for start in range(0, len(content), 5):
+        chunked.update(memoryview(content)[start : start + 5])
+    # THEN assert that the reads, bases and read lengths are counted
+    stats = whole.stats()
+    assert stats["reads"] == 3
+    assert stats["bases"] == 11
+    assert stats["read_lengths"] == {"3": 1, "4": 2}
+    # THEN assert that the sequences are hashed as lines
+    assert stats["digests"]["sequences"] == hashlib.sha256(b"ACGT\nACG\nACGT\n").hexdigest()
+    # THEN assert that chunking gives the same result
+    assert chunked.stats() == stats
+
+
+def test_compare_fastq_stats():
+    """Test that only the differing FASTQ fields are reported"""
+    # GIVEN statistics for two FASTQs that differ in one quality
+    first = integrity.FastqStats()
+    first.update(b"@read1\nACGT\n+\nIIII\n")
+    second = integrity.FastqStats()
+    second.update(b"@read1\nACGT\n+\nIIIJ\n")
+    # WHEN comparing the statistics
+    differences = integrity.compare_fastq_stats(first.stats(), second.stats())
+    # THEN assert that only the qualities differ
+    assert differences == ["qualities differ"]
+
+
+def test_fastq_set_order_independent(project_dir):
+    """Test that the FASTQ fingerprint does not depend on the order of the records"""
+    # GIVEN two FASTQ files with the same records in different order
+    records = [f"@read{number}\nACGT{number}\n+\nIIII\n".encode() for number in range(100)]
+    first = project_dir / "first.fastq"
+    first.write_bytes(b"".join(records))
+    second = project_dir / "second.fastq"
+    second.write_bytes(b"".join(reversed(records)))
+    # WHEN creating the fingerprints
+    # THEN assert that they are the same
+    assert get_checksum(first, "fastq-set") == get_checksum(second, "fastq-set")
+    # THEN assert that the number of records is part of the fingerprint
+    assert int(get_checksum(first, "fastq-set")[32:], 16) == 100
+
+
+def test_fastq_set_chunks_in_processes(first_read):
+    """Test that hashing chunks in worker processes gives the same fingerprint"""
+    # GIVEN the content of a FASTQ file
+    content = gzip.decompress(first_read.read_bytes())
+    # WHEN creating the fingerprint in one piece and in small chunks in two processes
+    whole = integrity.FastqSetHasher(workers=1, chunk_size=len(content) + 1)
+    whole.update(content)
+    chunked = integrity.FastqSetHasher(workers=2, chunk_size=10000)
+    for start in range(0, len(content), 4096):
+        chunked.update(content[start : start + 4096])
+    # THEN assert that the fingerprints are the same
+    assert chunked.hexdigest() == whole.hexdigest()
+
+
+def test_fastq_set_closed_on_failure(first_read):
+    """Test that the worker processes are shut down when hashing fails"""
+    # GIVEN the content of a FASTQ file
+    content = gzip.decompress(first_read.read_bytes())
+    # WHEN hashing fails after the worker processes have started
+    hasher = integrity.FastqSetHasher(workers=2, chunk_size=10000)
+    with pytest.raises(RuntimeError):
+        with hasher:
+            hasher.update(content)
+            assert hasher._executor is not None
+            raise RuntimeError("Reading failed")
+    # THEN assert that the pool was shut down
+    assert hasher._executor is None
+
+
+def test_concurrent_checksums_split_fingerprint_workers(first_read, second_read, monkeypatch):
+    """Test that the fingerprint processes are split between files hashed at the same time"""
+    # GIVEN eight processes for fingerprints and a recorder of the checksum arguments
+    monkeypatch.setattr(integrity, "DEFAULT_FINGERPRINT_WORKERS", 8)
+    calls = []
+    monkeypatch.setattr(
+        integrity, "create_checksums", lambda infile, algorithms, **kwargs: calls.append(kwargs)
+    )
+    # WHEN hashing two files at the same time
+    get_checksums_concurrently([first_read, second_read], ["fastq-set"], workers=2)
+    # THEN assert that each file gets half of the processes
+    assert [call["fingerprint_workers"] for call in calls] == [4, 4]
+
+
+def test_fastq_set_differs(first_read, second_read):
+    """Test that files with different records have different fingerprints"""
+    # GIVEN two different FASTQ files
+    # WHEN creating the fingerprints
+    # THEN assert that they differ
+    assert get_checksum(first_read, "fastq-set") != get_checksum(second_read, "fastq-set")
+
+
+def test_sam_set_order_independent():
+    """Test that the fingerprint of SAM records does not depend on their order or chunking"""
+    # GIVEN SAM records and the same records in another order
+    records = [
+        f"read{index}\t0\tchrM\t{index + 1}\t60\t4M\t*\t0\t0\tACGT\tIIII\n" for index in range(100)
+    ]
+    content = "".join(records).encode()
+    shuffled = "".join(reversed(records)).encode()
+    # WHEN creating the fingerprints, the shuffled records in small chunks
+    whole = integrity.SamSetHasher(workers=1)
+    whole.update(content)
+    chunked = integrity.SamSetHasher(workers=1, chunk_size=100)
+    for start in range(0, len(shuffled), 37):
+        chunked.update(shuffled[start : start + 37])
+    # THEN assert that the fingerprints are the same and count the records
+    assert chunked.hexdigest() == whole.hexdigest()
+    assert integrity.get_record_count(whole.hexdigest()) == 100
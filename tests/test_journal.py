@@ -0,0 +1,87 @@
+"""Tests for the journal of auto runs"""
+
+from pathlib import Path
+
+from crunchy.journal import FAILED, FINISHED, STARTED, Journal
+
+
+def test_journal_record_and_read(tmp_path: Path):
+    """Test that the stages and outputs of jobs are read back from the journal"""
+    # GIVEN a journal where one job has finished a stage and started the next
+    journal = Journal(Path(tmp_path, "journal.jsonl"))
+    journal.record("pair", "hash", FINISHED, checksums=["abc", "def"])
+    journal.record("pair", "compress", STARTED)
+    journal.record("other", "hash")
+    # WHEN reading the journal
+    states = journal.read()
+    # THEN assert the state of each job is returned
+    assert states["pair"].finished == ("hash",)
+    assert states["pair"].started == ("compress",)
+    assert states["pair"].outputs == {"checksums": ["abc", "def"]}
+    assert states["other"].finished == ("hash",)
+
+
+def test_journal_unfinished_line(tmp_path: Path):
+    """Test that a line that was cut off by a crash is ignored"""
+    # GIVEN a journal where the last line was not completely written
+    journal = Journal(Path(tmp_path, "journal.jsonl"))
+    journal.record("pair", "hash")
+    with open(journal.path, "a") as journal_file:
+        journal_file.write('{"name": "pair", "stage": "comp')
+    # WHEN reading the journal
+    states = journal.read()
+    # THEN assert the complete lines are read
+    assert states["pair"].finished == ("hash",)
+    assert states["pair"].started == ()
+
+
+def test_journal_record_after_unfinished_line(tmp_path: Path):
+    """Test that a line recorded after a line that was cut off by a crash is kept"""
+    # GIVEN a journal where the last line was not completely written
+    journal = Journal(Path(tmp_path, "journal.jsonl"))
+    journal.record("pair", "hash")
+    with open(journal.path, "a") as journal_file:
+        journal_file.write('{"name": "pair", "stage": "comp')
+    # WHEN a resumed run records the next stage
+    journal.record("pair", "compress", STARTED)
+    # THEN assert that the new line is read and the unfinished one is ignored
+    states = journal.read()
+    assert states["pair"].finished == ("hash",)
+    assert states["pair"].started == ("compress",)
+
+
+def test_journal_no_outputs(tmp_path: Path):
+    """Test that a job without outputs has none, and that states do not share their outputs"""
+    # GIVEN a journal where one job has recorded outputs and another has not
+    journal = Journal(Path(tmp_path, "journal.jsonl"))
+    journal.record("pair", "hash", checksums=["abc"])
+    journal.record("other", "hash")
+    # WHEN reading the journal
+    states = journal.read()
+    # THEN assert that only the job that recorded outputs has any
+    assert states["pair"].outputs == {"checksums": ["abc"]}
+    assert states["other"].outputs is None
+
+
+def test_journal_failed_stage(tmp_path: Path):
+    """Test that a stage that failed after it had finished is no longer finished"""
+    # GIVEN a journal where a pair was compressed, and then failed and removed the archive
+    journal = Journal(Path(tmp_path, "journal.jsonl"))
+    journal.record("pair", "hash")
+    journal.record("pair", "compress", STARTED)
+    journal.record("pair", "compress")
+    journal.record("pair", "compress", FAILED)
+    # WHEN reading the journal
+    states = journal.read()
+    # THEN assert that the pair has only finished the stage before
+    assert states["pair"].finished == ("hash",)
+    assert states["pair"].started == ()
+
+
+def test_journal_missing(tmp_path: Path):
+    """Test reading a journal that does not exist"""
+    # GIVEN a journal that has not been written
+    journal = Journal(Path(tmp_path, "journal.jsonl"))
+    # WHEN reading the journal
+    # THEN assert there are no jobs in it
+    assert journal.read() == {}
@@ -0,0 +1,158 @@
+"""Tests for the manifest module"""
+
+import gzip
+import hashlib
+
+import pytest
+
+from crunchy import manifest, metadata
+
+
+def create_manifest(content: bytes, chunk_size: int) -> dict:
+    """Create a manifest for some content fed in pieces that do not match the chunks"""
+    hasher = manifest.ChunkHasher(chunk_size=chunk_size)
+    for start in range(0, len(content), 7):
+        hasher.update(content[start : start + 7])
+    return hasher.manifest()
+
+
+def test_chunk_hasher():
+    """Test that chunks are hashed independently of how the content is fed"""
+    # GIVEN some content and a chunk size that does not divide it evenly
+    content = b"".join(str(number).encode() for number in range(100))
+    chunk_size = 32
+    # WHEN creating a manifest
+    result = create_manifest(content, chunk_size)
+    # THEN assert that there is one checksum per chunk
+    expected = [
+        hashlib.sha256(content[start : start + chunk_size]).hexdigest()
+        for start in range(0, len(content), chunk_size)
+    ]
+    assert result["chunks"] == expected
+    # THEN assert that the root is the merkle root of the chunks
+    assert result["root"] == manifest.merkle_root(expected)
+    assert result["size"] == len(content)
+
+
+def test_merkle_root_empty():
+    """Test that the merkle root of an empty file is the checksum of nothing"""
+    # GIVEN no chunks
+    # WHEN creating the merkle root
+    # THEN assert it is the checksum of empty content
+    assert manifest.merkle_root([]) == hashlib.sha256(b"").hexdigest()
+
+
+def test_verify_manifest_identical(first_tmp_file, project_dir):
+    """Test to verify an identical uncompressed file against its manifest"""
+    # GIVEN an uncompressed file and its manifest
+    content = gzip.decompress(first_tmp_file.read_bytes())
+    infile = project_dir / "reads.fastq"
+    infile.write_bytes(content)
+    file_manifest = create_manifest(content, 100)
+    # WHEN verifying the file in parallel
+    mismatches = manifest.verify_manifest(infile, file_manifest, workers=3)
+    # THEN assert that no chunks differ
+    assert mismatches == []
+
+
+def test_verify_manifest_gzipped(first_read):
+    """Test to verify a gzipped file against the manifest of its content"""
+    # GIVEN a gzipped file and the manifest of its content
+    file_manifest = create_manifest(gzip.decompress(first_read.read_bytes()), 100)
+    # WHEN verifying the file
+    mismatches = manifest.verify_manifest(first_read, file_manifest)
+    # THEN assert that no chunks differ
+    assert mismatches == []
+
+
+def test_verify_manifest_differing_chunk(project_dir):
+    """Test that the chunk with a difference is reported"""
+    # GIVEN a manifest and a file where one byte in the third chunk was changed
+    content = bytearray(b"A" * 1000)
+    file_manifest = create_manifest(bytes(content), 100)
+    content[250] = ord("C")
+    infile = project_dir / "reads.fastq"
+    infile.write_bytes(content)
+    # WHEN verifying the file
+    mismatches = manifest.verify_manifest(infile, file_manifest)
+    # THEN assert that only the third chunk differs
+    assert mismatches == [2]
+
+
+def test_verify_manifest_truncated(project_dir):
+    """Test that chunks missing from a truncated file are reported"""
+    # GIVEN a manifest and a file that was truncated in the middle of the fourth chunk
+    content = b"A" * 1000
+    file_manifest = create_manifest(content, 100)
+    infile = project_dir / "reads.fastq"
+    infile.write_bytes(content[:350])
+    # WHEN verifying the file
+    mismatches = manifest.verify_manifest(infile, file_manifest)
+    # THEN assert that the partial and all missing chunks differ
+    assert mismatches == list(range(3, 10))
+
+
+def test_verify_manifest_corrupt(project_dir):
+    """Test that a manifest that does not match its root is rejected"""
+    # GIVEN a manifest where a chunk checksum was changed
+    infile = project_dir / "reads.fastq"
+    infile.write_bytes(b"A" * 300)
+    file_manifest = create_manifest(b"A" * 300, 100)
+    file_manifest["chunks"][1] = hashlib.sha256(b"B").hexdigest()
+    # WHEN verifying the file
+    # THEN assert that a ValueError is raised
+    with pytest.raises(ValueError):
+        manifest.verify_manifest(infile, file_manifest)
+
+
+def test_verify_manifest_resume(project_dir, monkeypatch):
+    """Test that chunks verified by an earlier run are skipped"""
+    # GIVEN a file, its manifest and a progress file from an interrupted run
+    content = b"A" * 1000
+    infile = project_dir / "reads.fastq"
+    infile.write_bytes(content)
+    file_manifest = create_manifest(content, 100)
+    progress_path = manifest.get_progress_path(infile)
+    manifest.write_progress(progress_path, infile, file_manifest, set(range(8)))
+    hashed = []
+    hash_file_range = manifest.hash_file_range
+    monkeypatch.setattr(
+        manifest,
+        "hash_file_range",
+        lambda infile, start, *args: hashed.append(start) or hash_file_range(infile, start, *args),
+    )
+    # WHEN verifying the file
+    mismatches = manifest.verify_manifest(infile, file_manifest, progress_path=progress_path)
+    # THEN assert that only the remaining chunks were hashed
+    assert mismatches == []
+    assert sorted(hashed) == [800, 900]
+    # THEN assert that the progress file was removed
+    assert not progress_path.exists()
+
+
+def test_verify_spring_reads(first_read, second_read, spring_path):
+    """Test to verify reads against metadata with manifests"""
+    # GIVEN spring metadata with chunk manifests
+    spring_metadata = metadata.fetch_spring_metadata(
+        first_read=first_read, second_read=second_read, spring=spring_path, chunk_size=100
+    )
+    assert all("chunks" in file_info for file_info in spring_metadata[:2])
+    # WHEN verifying the reads
+    # THEN assert that they are identical
+    assert manifest.verify_spring_reads(spring_metadata, first_read, second_read)
+    # WHEN verifying the reads in the wrong order
+    # THEN assert that they differ
+    assert not manifest.verify_spring_reads(spring_metadata, second_read, first_read)
+
+
+def test_verify_spring_reads_fastq_stats(first_read, second_read, spring_path, caplog):
+    """Test that the differing FASTQ fields are logged when reads differ"""
+    # GIVEN spring metadata with FASTQ statistics
+    spring_metadata = metadata.fetch_spring_metadata(
+        first_read=first_read, second_read=second_read, spring=spring_path, fastq_stats=True
+    )
+    # WHEN verifying the reads in the wrong order
+    # THEN assert that they differ
+    assert not manifest.verify_spring_reads(spring_metadata, second_read, first_read)
+    # THEN assert that the differing headers are reported
+    assert "headers differ" in caplog.text
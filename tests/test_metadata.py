@@ -19,6 +19,24 @@ def test_fetch_spring_metadata(first_read, second_read, spring_path):
     assert len(res) == 3
 
 
+def test_fetch_spring_metadata_one_worker(
+    first_read, second_read, spring_path, checksum_first_read, checksum_second_read
+):
+    """Test to fetch the metadata for a spring archive without hashing reads concurrently"""
+    # GIVEN a pair of fastq files, their checksums and a spring file
+
+    # WHEN creating the metadata with one worker
+    res = metadata.fetch_spring_metadata(
+        first_read=first_read, second_read=second_read, spring=spring_path, workers=1
+    )
+
+    # THEN assert that the reads keep their order
+    assert res[0]["file"] == "first_read"
+    assert res[0]["checksum"] == checksum_first_read
+    assert res[1]["file"] == "second_read"
+    assert res[1]["checksum"] == checksum_second_read
+
+
 def test_get_fastq_info(first_read):
     """Test to create metadata info for a fastq file"""
     # GIVEN a fastq file
@@ -43,3 +61,32 @@ def test_dump_metadata(spring_metadata, metadata_tmp_path):
 
     # THEN assert that the metadata file was created
     assert metadata_tmp_path.exists()
+
+
+def test_get_fastq_info_multiple_algorithms(first_read, checksum_first_read):
+    """Test to create metadata info with several checksums for a fastq file"""
+    # GIVEN a fastq file and its sha256 checksum
+
+    # WHEN fetching the file info with two algorithms
+    res = metadata.get_fastq_info(fastq=first_read, tag="first_read", algorithm=["sha256", "md5"])
+
+    # THEN assert that the first algorithm is the main checksum
+    assert res["algorithm"] == "sha256"
+    assert res["checksum"] == checksum_first_read
+
+    # THEN assert that all checksums are stored
+    assert set(res["checksums"]) == {"sha256", "md5"}
+
+
+def test_fetch_spring_metadata_fastq_stats(first_read, second_read, spring_path):
+    """Test to collect FASTQ statistics together with the metadata"""
+    # GIVEN a pair of fastq files and a spring file
+
+    # WHEN creating the metadata with FASTQ statistics
+    res = metadata.fetch_spring_metadata(
+        first_read=first_read, second_read=second_read, spring=spring_path, fastq_stats=True
+    )
+
+    # THEN assert that the reads in both files are counted
+    assert res[0]["stats"]["reads"] > 0
+    assert res[0]["stats"]["reads"] == res[1]["stats"]["reads"]
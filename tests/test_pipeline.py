@@ -0,0 +1,116 @@
+"""Tests for the pipeline module"""
+
+import threading
+import time
+
+import click
+import pytest
+
+from crunchy.pipeline import Pipeline, Stage
+
+
+def test_pipeline_runs_jobs_through_stages():
+    """Test that jobs go through all stages and a failing job stops in its stage"""
+
+    # GIVEN a pipeline where the second stage fails for job 1
+    def fail_one(job):
+        if job == 1:
+            raise click.Abort
+        return job
+
+    done = []
+    stages = [
+        Stage("add", lambda job: job + 1, workers=2),
+        Stage("check", fail_one),
+        Stage("collect", lambda job: done.append(job) or job),
+    ]
+    pipeline = Pipeline(stages, queue_depth=1)
+    # WHEN running four jobs
+    results = pipeline.run((str(job), job) for job in range(4))
+    # THEN assert that the results are in order and only the second job failed in the check stage
+    assert [result.name for result in results] == ["0", "1", "2", "3"]
+    assert [result.success for result in results] == [False, True, True, True]
+    assert results[0].error == "check: Abort"
+    assert sorted(done) == [2, 3, 4]
+    # THEN assert that each stage reports what it did and queues never grew past their depth
+    reports = {report.name: report for report in pipeline.reports()}
+    assert reports["discover"].processed == 4
+    assert reports["check"].processed == 3
+    assert reports["check"].failed == 1
+    assert all(report.queue_peak <= 1 for report in reports.values())
+
+
+def test_pipeline_stages_overlap():
+    """Test that a job is in one stage while the next job is in the stage before"""
+    # GIVEN two stages that record which jobs are running at the same time
+    running = set()
+    overlaps = []
+    lock = threading.Lock()
+
+    def work(job):
+        with lock:
+            running.add(job)
+            overlaps.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.discard(job)
+        return job
+
+    pipeline = Pipeline([Stage("first", work), Stage("second", work)])
+    # WHEN running three jobs
+    pipeline.run((str(job), job) for job in range(3))
+    # THEN assert that two jobs were running at the same time
+    assert max(overlaps) == 2
+
+
+class WorkerStopped(BaseException):
+    """Error that is not an Exception, like SystemExit, and stops a worker"""
+
+
+def test_pipeline_worker_stopped():
+    """Test that a worker that is stopped does not leave the pipeline waiting forever"""
+
+    # GIVEN a pipeline where the only worker of the second stage is stopped by the first job
+    def stop(job):
+        raise WorkerStopped
+
+    pipeline = Pipeline([Stage("first", lambda job: job), Stage("stop", stop)], queue_depth=1)
+    # WHEN running more jobs than fit in the queues
+    # THEN assert that the error is raised when the pipeline is done
+    with pytest.raises(WorkerStopped):
+        pipeline.run((str(job), job) for job in range(5))
+    # THEN assert that all jobs failed in the stage that was stopped
+    reports = {report.name: report for report in pipeline.reports()}
+    assert reports["first"].processed == 5
+    assert reports["stop"].failed == 5
+
+
+def test_pipeline_discover_fails():
+    """Test that an error while finding the jobs is raised"""
+
+    # GIVEN jobs that can not all be found
+    def find_jobs():
+        yield "0", 0
+        raise OSError("Directory is gone")
+
+    pipeline = Pipeline([Stage("first", lambda job: job)])
+    # WHEN running the jobs
+    # THEN assert that the error is raised
+    with pytest.raises(OSError):
+        pipeline.run(find_jobs())
+
+
+def test_pipeline_same_names():
+    """Test that jobs with the same name each get their own result"""
+
+    # GIVEN a pipeline that fails odd jobs
+    def fail_odd(job):
+        if job % 2:
+            raise click.Abort
+        return job
+
+    pipeline = Pipeline([Stage("check", fail_odd)])
+    # WHEN running jobs that all have the same name
+    results = pipeline.run(("pair", job) for job in range(4))
+    # THEN assert that each job has its own result
+    assert [result.success for result in results] == [True, False, True, False]
@@ -0,0 +1,48 @@
+"""Tests for the profiles module"""
+
+import pytest
+
+from crunchy.profiles import CRAM_PROFILES
+
+
+def test_default_profile():
+    """Test that the default profile keeps the samtools defaults"""
+    # GIVEN the default profile
+    profile = CRAM_PROFILES["default"]
+    # WHEN getting the samtools view parameters
+    # THEN assert that plain CRAM output is used
+    assert profile.view_parameters() == ["-C"]
+
+
+def test_archive_profile():
+    """Test that all options of a profile are passed to samtools"""
+    # GIVEN the archive profile
+    profile = CRAM_PROFILES["archive"]
+    # WHEN getting the output format
+    output_format = profile.output_format()
+    # THEN assert that the version, preset, level, codecs and slice size are set
+    assert output_format == (
+        "cram,version=3.1,archive,level=9,use_bzip2,use_lzma,seqs_per_slice=100000"
+    )
+
+
+def test_profile_with_options():
+    """Test that settings of a profile can be changed"""
+    # GIVEN the archive profile
+    profile = CRAM_PROFILES["archive"]
+    # WHEN changing the level, dropping a codec and embedding the reference
+    changed = profile.with_options(["level=7", "use_lzma=0", "embed_ref=1"])
+    # THEN assert that the output format has the changed settings
+    assert changed.output_format() == (
+        "cram,version=3.1,archive,level=7,use_bzip2,seqs_per_slice=100000,embed_ref=1"
+    )
+
+
+def test_profile_with_invalid_option():
+    """Test that an unknown setting is rejected"""
+    # GIVEN the default profile
+    profile = CRAM_PROFILES["default"]
+    # WHEN changing a setting that does not exist
+    # THEN assert that it is rejected
+    with pytest.raises(ValueError):
+        profile.with_options(["speed=11"])
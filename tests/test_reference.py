@@ -0,0 +1,101 @@
+"""Tests for the reference module"""
+
+import hashlib
+import shutil
+from pathlib import Path
+
+import pytest
+
+from crunchy import reference
+from crunchy.reference import ReferenceCache, get_cache_path, get_fai_path, read_fasta
+
+
+@pytest.fixture(name="tmp_reference")
+def fixture_tmp_reference(reference_path: Path, tmp_path: Path) -> Path:
+    """Return a copy of the FASTA reference without an index."""
+    tmp_reference = Path(tmp_path, "reference.fasta")
+    shutil.copy(reference_path, tmp_reference)
+    return tmp_reference
+
+
+def test_read_fasta_index(reference_path):
+    """Test that the index fields of a FASTA file are the same as from samtools faidx"""
+    # GIVEN a FASTA file indexed by samtools
+    fai_lines = get_fai_path(reference_path).read_text().splitlines(keepends=True)
+    # WHEN reading the sequences of the file
+    sequences = read_fasta(reference_path)
+    # THEN assert that the index lines are the same
+    assert [sequence.fai_line() for sequence in sequences] == fai_lines
+
+
+def test_read_fasta_error_removes_tmp_file(reference_path, tmp_path, monkeypatch):
+    """Test that a sequence that fails to be read leaves no temporary file in the cache"""
+    # GIVEN a cache directory and a disk that fills up while the second sequence is written
+    add_line = reference._SequenceWriter.add_line
+
+    def fail_on_second_sequence(self, line):
+        if self.name == "chr16":
+            raise OSError("No space left on device")
+        add_line(self, line)
+
+    monkeypatch.setattr(reference._SequenceWriter, "add_line", fail_on_second_sequence)
+    # WHEN reading the sequences to the cache
+    with pytest.raises(OSError):
+        read_fasta(reference_path, cache_dir=tmp_path)
+    # THEN assert that only the complete first sequence is in the cache
+    assert not list(tmp_path.glob(".tmp_*"))
+    assert len([path for path in tmp_path.rglob("*") if path.is_file()]) == 1
+
+
+def test_warm_fills_cache(tmp_reference, tmp_path):
+    """Test that warming a cache stores the sequences by MD5 and indexes the reference"""
+    # GIVEN a reference without an index and an empty cache directory
+    cache = ReferenceCache(tmp_reference, Path(tmp_path, "cache"))
+    assert not get_fai_path(tmp_reference).exists()
+    # WHEN warming the cache
+    sequences = cache.warm()
+    # THEN assert that each sequence is stored, upper case and without newlines, under its MD5
+    assert list(sequences) == ["chrM", "chr16"]
+    for md5 in sequences.values():
+        cached_sequence = get_cache_path(cache.cache_dir, md5).read_bytes()
+        assert hashlib.md5(cached_sequence).hexdigest() == md5
+        assert b"\n" not in cached_sequence
+    # THEN assert that the reference was indexed
+    assert get_fai_path(tmp_reference).exists()
+
+
+def test_warm_twice(tmp_reference, tmp_path, monkeypatch):
+    """Test that a reference is only read once for a cache"""
+    # GIVEN a warm cache
+    ReferenceCache(tmp_reference, Path(tmp_path, "cache")).warm()
+    # WHEN warming the cache again from another process
+    monkeypatch.setattr(reference, "read_fasta", lambda *args, **kwargs: pytest.fail("read"))
+    sequences = ReferenceCache(tmp_reference, Path(tmp_path, "cache")).warm()
+    # THEN assert that the sequences are taken from the marker
+    assert list(sequences) == ["chrM", "chr16"]
+
+
+def test_warm_changed_reference(tmp_reference, tmp_path):
+    """Test that a reference that has changed is added to the cache again"""
+    # GIVEN a warm cache
+    cache = ReferenceCache(tmp_reference, Path(tmp_path, "cache"))
+    first_sequences = cache.warm()
+    # WHEN the reference changes and the cache is warmed again
+    with open(tmp_reference, "a") as fasta:
+        fasta.write(">extra\nACGT\n")
+    sequences = cache.warm()
+    # THEN assert that the new sequence is cached and the index updated
+    assert sequences["chrM"] == first_sequences["chrM"]
+    assert get_cache_path(cache.cache_dir, sequences["extra"]).read_bytes() == b"ACGT"
+    assert "extra\t4\t" in get_fai_path(tmp_reference).read_text()
+
+
+def test_environment(tmp_reference, tmp_path):
+    """Test that samtools is pointed to the cache"""
+    # GIVEN a reference cache
+    cache = ReferenceCache(tmp_reference, Path(tmp_path, "cache"))
+    # WHEN getting the environment for samtools
+    environment = cache.environment()
+    # THEN assert that both the lookup path and the cache use the local directory
+    assert environment["REF_PATH"] == f"{cache.cache_dir}/%2s/%2s/%s"
+    assert environment["REF_CACHE"] == environment["REF_PATH"]
@@ -0,0 +1,60 @@
+"""Tests for the regions module"""
+
+from pathlib import Path
+
+import pytest
+
+from crunchy.regions import Region, merge_regions, parse_region, read_regions_file
+
+
+def test_parse_region():
+    """Test to parse regions in the samtools format"""
+    # GIVEN regions as strings
+    # WHEN parsing them
+    # THEN assert that contigs, starts and ends are found and printed back the same way
+    assert parse_region("chrM") == Region("chrM")
+    assert parse_region("chrM:1,000-2,000") == Region("chrM", 1000, 2000)
+    assert str(parse_region("chrM:100")) == "chrM:100"
+    assert str(Region("HLA-A*01:01", 1, 10)) == "{HLA-A*01:01}:1-10"
+
+
+def test_parse_invalid_region():
+    """Test that a region that ends before it starts is invalid"""
+    # GIVEN a region with the end before the start
+    # WHEN parsing it
+    # THEN assert that it is not accepted
+    with pytest.raises(ValueError):
+        parse_region("chrM:200-100")
+
+
+def test_read_regions_file(tmp_path):
+    """Test that BED coordinates are converted to 1-based regions"""
+    # GIVEN a BED file with a header and a file with a region per line
+    bed_path = Path(tmp_path, "regions.bed")
+    bed_path.write_text("track name=genes\nchrM\t0\t100\nchr16\t199\t300\nchr16:500-600\n")
+    # WHEN reading the regions
+    regions = read_regions_file(bed_path)
+    # THEN assert that the regions are 1-based and inclusive
+    assert regions == [Region("chrM", 1, 100), Region("chr16", 200, 300), Region("chr16", 500, 600)]
+
+
+def test_merge_regions():
+    """Test that overlapping and touching regions are merged"""
+    # GIVEN regions that overlap, touch or are apart on two contigs
+    regions = [
+        Region("chr16", 500, 600),
+        Region("chrM", 1, 100),
+        Region("chr16", 100, 200),
+        Region("chr16", 150, 300),
+        Region("chrM", 101, 150),
+        Region("chrM", 1000),
+    ]
+    # WHEN merging them
+    merged = merge_regions(regions)
+    # THEN assert that the regions that are apart remain, sorted within the contig
+    assert merged == [
+        Region("chr16", 100, 300),
+        Region("chr16", 500, 600),
+        Region("chrM", 1, 150),
+        Region("chrM", 1000, None),
+    ]
@@ -0,0 +1,123 @@
+"""Tests for the scheduler module"""
+
+from pathlib import Path
+
+import click
+import pytest
+
+from crunchy.scheduler import (
+    Shard,
+    get_shard,
+    get_threads_per_job,
+    order_jobs,
+    parse_shard,
+    read_priority_file,
+    run_jobs,
+)
+
+
+def succeed_or_abort(succeed: bool):
+    """Job that fails like a pair that is skipped if succeed is not set."""
+    if not succeed:
+        raise click.Abort
+
+
+def test_threads_per_job():
+    """Test that the threads are split between the jobs unless set"""
+    # GIVEN a thread budget
+    # WHEN getting the threads for each job
+    # THEN assert that the budget is split, with at least one thread per job
+    assert get_threads_per_job(128, 16) == 8
+    assert get_threads_per_job(4, 8) == 1
+    assert get_threads_per_job(128, 16, threads_per_job=4) == 4
+
+
+def test_run_jobs_isolates_failures():
+    """Test that a failing job does not stop the others, in this process"""
+    # GIVEN jobs where the second fails
+    jobs = [("first", (True,)), ("second", (False,)), ("third", (True,))]
+    # WHEN running them one at a time
+    results = run_jobs(succeed_or_abort, jobs)
+    # THEN assert that only the second failed
+    assert [result.success for result in results] == [True, False, True]
+    assert results[1].error == "Abort"
+
+
+def test_run_jobs_in_processes():
+    """Test that jobs run in a pool of processes return their results in order"""
+    # GIVEN jobs where the first fails
+    jobs = [(str(index), (index > 0,)) for index in range(4)]
+    # WHEN running two at a time
+    results = run_jobs(succeed_or_abort, jobs, max_jobs=2)
+    # THEN assert that the results are in the order of the jobs
+    assert [result.name for result in results] == ["0", "1", "2", "3"]
+    assert [result.success for result in results] == [False, True, True, True]
+
+
+def test_run_jobs_same_names():
+    """Test that jobs with the same name each get their own result"""
+    # GIVEN two jobs with the same name where the first fails
+    jobs = [("pair", (False,)), ("pair", (True,))]
+    # WHEN running them at the same time
+    results = run_jobs(succeed_or_abort, jobs, max_jobs=2)
+    # THEN assert that both results are returned
+    assert [result.success for result in results] == [False, True]
+
+
+def test_order_jobs_largest_first(tmp_path: Path):
+    """Test that the jobs with the most data are started first"""
+    # GIVEN jobs with files of different sizes
+    jobs = []
+    for name, size in [("small", 10), ("large", 1000), ("medium", 100)]:
+        path = Path(tmp_path, name)
+        path.write_bytes(b"A" * size)
+        jobs.append(path)
+    # WHEN ordering the jobs with the default order
+    ordered = order_jobs(jobs, lambda job: [job])
+    # THEN assert the largest job is first
+    assert [job.name for job in ordered] == ["large", "medium", "small"]
+    # WHEN ordering smallest first
+    ordered = order_jobs(jobs, lambda job: [job], order="smallest")
+    # THEN assert the smallest job is first
+    assert [job.name for job in ordered] == ["small", "medium", "large"]
+
+
+def test_order_jobs_priorities(tmp_path: Path):
+    """Test that prioritised jobs come first, in the order of the priorities"""
+    # GIVEN jobs with files of different sizes and a priority file with the two smallest
+    jobs = []
+    for name, size in [("small", 10), ("large", 1000), ("medium", 100)]:
+        path = Path(tmp_path, name)
+        path.write_bytes(b"A" * size)
+        jobs.append(path)
+    priority_file = Path(tmp_path, "priorities.txt")
+    priority_file.write_text(f"# run these first\n{jobs[2]}\n{jobs[0]}\n")
+    # WHEN ordering the jobs
+    ordered = order_jobs(jobs, lambda job: [job], priorities=read_priority_file(priority_file))
+    # THEN assert the prioritised jobs come first and the rest largest first
+    assert [job.name for job in ordered] == ["medium", "small", "large"]
+
+
+def test_parse_shard():
+    """Test parsing a shard given as K/N"""
+    # GIVEN a valid shard
+    # WHEN parsing it
+    # THEN assert the index and count are returned
+    assert parse_shard("2/4") == Shard(index=2, count=4)
+    # GIVEN a shard with an index outside the count
+    # WHEN parsing it
+    # THEN assert it is rejected
+    with pytest.raises(ValueError):
+        parse_shard("0/4")
+
+
+def test_get_shard_stable_and_even():
+    """Test that keys are spread over all shards and always get the same shard"""
+    # GIVEN many keys
+    keys = [f"project/sample_{number}_S1_001.spring" for number in range(400)]
+    # WHEN getting the shard of each key twice
+    shards = [get_shard(key, 4) for key in keys]
+    # THEN assert the shards are the same each time and all shards get a fair part of the keys
+    assert shards == [get_shard(key, 4) for key in keys]
+    for index in range(1, 5):
+        assert 50 < shards.count(Shard(index, 4)) < 150